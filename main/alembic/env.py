@@ -12,7 +12,7 @@ from alembic import context
 
 from app.database import Base
 from app.database import DATABASE_URL
-from app.models import User, Score
+from app.models import User, Score, Job, CachedResult
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
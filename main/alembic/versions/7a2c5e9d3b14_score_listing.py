@@ -0,0 +1,61 @@
+"""score listing
+
+Revision ID: 7a2c5e9d3b14
+Revises: e4b8a61f2c90
+Create Date: 2025-03-14 11:22:08.604517
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a2c5e9d3b14'
+down_revision: Union[str, None] = 'e4b8a61f2c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(timezone=True), nullable=True))
+
+    # existing scores: created with their first job (now if they never had one,
+    # in the format SQLAlchemy writes to SQLite so keyset comparisons hold),
+    # status of the latest job, done for anything with a result
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+    op.get_bind().execute(sa.text("""
+        UPDATE scores SET
+            created_at = COALESCE(
+                (SELECT MIN(jobs.created_at) FROM jobs WHERE jobs.score_id = scores.id),
+                :now
+            ),
+            status = CASE
+                WHEN xmlmusic_path IS NOT NULL THEN 'done'
+                ELSE COALESCE(
+                    (SELECT jobs.status FROM jobs WHERE jobs.score_id = scores.id
+                     ORDER BY jobs.id DESC LIMIT 1),
+                    'failed'
+                )
+            END
+    """), {"now": now})
+
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.alter_column('status', existing_type=sa.String(), nullable=False)
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+        batch_op.create_index('ix_scores_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_scores_user_id_created_at_id', ['user_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_scores_status_created_at_id', ['status', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.drop_index('ix_scores_status_created_at_id')
+        batch_op.drop_index('ix_scores_user_id_created_at_id')
+        batch_op.drop_index('ix_scores_created_at_id')
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('status')
@@ -0,0 +1,48 @@
+"""result cache
+
+Revision ID: a3d94e0c6b27
+Revises: 5b1f7c2d9a01
+Create Date: 2025-03-04 18:22:10.540917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d94e0c6b27'
+down_revision: Union[str, None] = '5b1f7c2d9a01'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('result_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cache_key', sa.String(), nullable=False),
+    sa.Column('processed_path', sa.String(), nullable=False),
+    sa.Column('xmlmusic_path', sa.String(), nullable=False),
+    sa.Column('score_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['score_id'], ['scores.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('result_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_result_cache_cache_key'), ['cache_key'], unique=True)
+
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cache_key', sa.String(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_scores_cache_key'), ['cache_key'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_scores_cache_key'))
+        batch_op.drop_column('cache_key')
+
+    with op.batch_alter_table('result_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_result_cache_cache_key'))
+
+    op.drop_table('result_cache')
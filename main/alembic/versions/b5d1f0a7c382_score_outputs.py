@@ -0,0 +1,35 @@
+"""score outputs
+
+Revision ID: b5d1f0a7c382
+Revises: 7a2c5e9d3b14
+Create Date: 2025-03-16 09:41:52.117204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d1f0a7c382'
+down_revision: Union[str, None] = '7a2c5e9d3b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# scores converted before this are resolved and recorded on their first download
+def upgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('output_path', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('output_bytes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('output_sha256', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('output_modified', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.drop_column('output_modified')
+        batch_op.drop_column('output_sha256')
+        batch_op.drop_column('output_bytes')
+        batch_op.drop_column('output_path')
@@ -0,0 +1,48 @@
+"""batches
+
+Revision ID: d83f6b1e2a47
+Revises: b5d1f0a7c382
+Create Date: 2025-03-18 15:07:33.280914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd83f6b1e2a47'
+down_revision: Union[str, None] = 'b5d1f0a7c382'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('batches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('rejected', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('batches', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_batches_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_scores_batch_id'), ['batch_id'], unique=False)
+        batch_op.create_foreign_key('fk_scores_batch_id_batches', 'batches', ['batch_id'], ['id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_scores_batch_id_batches', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_scores_batch_id'))
+        batch_op.drop_column('batch_id')
+
+    with op.batch_alter_table('batches', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_batches_user_id'))
+
+    op.drop_table('batches')
@@ -0,0 +1,49 @@
+"""score profiles
+
+Revision ID: e4b8a61f2c90
+Revises: c71e2b84f5d3
+Create Date: 2025-03-12 16:05:41.218733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8a61f2c90'
+down_revision: Union[str, None] = 'c71e2b84f5d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('score_profiles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('score_id', sa.Integer(), nullable=False),
+    sa.Column('source', sa.String(), nullable=True),
+    sa.Column('input_bytes', sa.Integer(), nullable=True),
+    sa.Column('page_count', sa.Integer(), nullable=True),
+    sa.Column('render_dpi', sa.Integer(), nullable=True),
+    sa.Column('pages', sa.JSON(), nullable=True),
+    sa.Column('stages', sa.JSON(), nullable=True),
+    sa.Column('audiveris_runs', sa.Integer(), nullable=True),
+    sa.Column('audiveris_wall_s', sa.Float(), nullable=True),
+    sa.Column('audiveris_cpu_s', sa.Float(), nullable=True),
+    sa.Column('audiveris_peak_rss_mb', sa.Float(), nullable=True),
+    sa.Column('processed_bytes', sa.Integer(), nullable=True),
+    sa.Column('output_bytes', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['score_id'], ['scores.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('score_profiles', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_score_profiles_score_id'), ['score_id'], unique=True)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('score_profiles', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_score_profiles_score_id'))
+
+    op.drop_table('score_profiles')
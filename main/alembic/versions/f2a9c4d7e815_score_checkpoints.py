@@ -0,0 +1,29 @@
+"""score checkpoints
+
+Revision ID: f2a9c4d7e815
+Revises: d83f6b1e2a47
+Create Date: 2025-03-20 10:12:45.391726
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a9c4d7e815'
+down_revision: Union[str, None] = 'd83f6b1e2a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# existing scores have none; one that is continued starts again from cleanup
+def upgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('checkpoints', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('scores', schema=None) as batch_op:
+        batch_op.drop_column('checkpoints')
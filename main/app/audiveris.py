@@ -1,14 +1,247 @@
 import subprocess
+import hashlib
 import logging
+import os
+import re
+import resource
+from collections import deque
 from pathlib import Path
-from typing import Optional, Union
-from time import sleep
+from threading import Event, Lock, Timer
+from typing import Optional, Union, List, Callable, Dict, Tuple, NamedTuple, Deque
+from time import sleep, monotonic
+
+from .metrics import AUDIVERIS_EXITS, AUDIVERIS_TIMEOUTS
 
 logger = logging.getLogger(__name__)
 
+AUDIVERIS_OPTIONS = [
+    "-option", "org.audiveris.omr.sheet.BookManager.useOpus=true",
+    "-option", "org.audiveris.omr.text.Language.defaultSpecification=eng+ita",
+    "-option", "org.audiveris.omr.text.tesseract.path=/usr/local/bin/tesseract",
+    "-option", "org.audiveris.omr.text.tesseract.datadir=/usr/local/share/tessdata",
+    "-option", "org.audiveris.omr.text.tesseract.ocrEngineMode=1",  # LSTM mode
+    "-option", "org.audiveris.omr.batch.threadCount=4",  # Parallel processing
+    "-option", "org.audiveris.omr.batch.memoryMax=4096", # 4GB heap
+    
+    "-option", "org.audiveris.omr.sheet.SheetStub.maxErrors=500",  
+    "-option", "org.audiveris.omr.steps.sheet.MaxStubs=20",  
+    "-option", "book.export.force=true",  
+
+    "-option", "org.audiveris.omr.steps.TEXTS.minGrade=0.05",  
+    "-option", "org.audiveris.omr.steps.DYNAMICS.minGrade=0.15",  
+    "-option", "org.audiveris.omr.steps.SYMBOLS.minGrade=0.1",
+    
+    "-option", "omr.sheet.staves.voidPartCreation=true",  # Keeps irregular staff regions  
+    "-option", "omr.sheet.parts.mergePolicy=ALWAYS",      # Forces system connectivity  
+    "-option", "omr.steps.GRID.peakMergeX=1.0",           # Broad horizontal staff merging  
+    "-option", "omr.steps.GRID.peakMergeY=0.8",           # Loose vertical staff alignment  
+
+    # Removing TIME processing  
+    "-option", "omr.steps.TIME.maxCandidates=0",  
+    # Disabling key signature analysis  
+    "-option", "omr.steps.KEYS.maxCandidates=0",  
+    # Bypassing clef validation  
+    "-option", "omr.steps.CLEFS.maxCandidates=0", 
+    
+    "-option", "musicxml.extension.visualDescriptors=true", # Shape complexity metrics
+]
+
+
+def options_fingerprint() -> str:
+    """Short hash of the Audiveris options; changes whenever the OMR settings do."""
+    return hashlib.sha256("\n".join(AUDIVERIS_OPTIONS).encode()).hexdigest()[:16]
+
+
+# OMR steps in the order Audiveris runs them on every sheet; EXPORT is the
+# book-level step that writes the .mxl
+AUDIVERIS_STEPS = (
+    "LOAD", "BINARY", "SCALE", "GRID", "HEADERS", "STEM_SEEDS", "BEAMS",
+    "LEDGERS", "HEADS", "STEMS", "REDUCTION", "CUE_BEAMS", "TEXTS", "MEASURES",
+    "CHORDS", "CURVES", "SYMBOLS", "LINKS", "RHYTHMS", "PAGE", "EXPORT",
+)
+STEP_PATTERN = re.compile(r"\b(" + "|".join(AUDIVERIS_STEPS) + r")\b")
+# log lines are tagged [book] or [book#sheet]
+SHEET_PATTERN = re.compile(r"\[[^\]\s]*#(\d+)\]")
+
+ProgressCallback = Callable[[str, Optional[int]], None]
+
+
+def parse_progress(line: str) -> Optional[Tuple[str, Optional[int]]]:
+    """Picks the OMR step and sheet number out of an Audiveris log line, if it names one."""
+    step = STEP_PATTERN.search(line)
+    if not step:
+        return None
+    sheet = SHEET_PATTERN.search(line)
+    return step.group(1), int(sheet.group(1)) if sheet else None
+
+
+class StepTimer:
+    """Turns the stream of (step, sheet) sightings into time spent per step.
+
+    Sheets can be processed in parallel, so the current step is tracked per
+    sheet and durations are summed across sheets.
+    """
+    def __init__(self):
+        self.current: Dict[Optional[int], Tuple[str, float]] = {}
+        self.durations: Dict[str, float] = {}
+
+    def update(self, step: str, sheet: Optional[int], now: float) -> bool:
+        previous = self.current.get(sheet)
+        if previous and previous[0] == step:
+            return False
+        if previous:
+            self._close(previous, now)
+        self.current[sheet] = (step, now)
+        return True
+
+    def finish(self, now: float) -> Dict[str, float]:
+        for previous in self.current.values():
+            self._close(previous, now)
+        self.current = {}
+        return {step: round(seconds, 3) for step, seconds in self.durations.items()}
+
+    def _close(self, previous: Tuple[str, float], now: float):
+        step, started = previous
+        self.durations[step] = self.durations.get(step, 0.0) + now - started
+
+
+def wait_for_output(path: Path, timeout: float = 10.0, poll_interval: float = 0.1) -> bool:
+    """Waits until `path` exists and its size stopped changing.
+
+    Audiveris has normally finished writing by the time we look, so this
+    returns on the first or second poll instead of a fixed sleep.
+    """
+    deadline = monotonic() + timeout
+    last_size = -1
+    while monotonic() < deadline:
+        if path.exists():
+            size = path.stat().st_size
+            if size > 0 and size == last_size:
+                return True
+            last_size = size
+        sleep(poll_interval)
+    return path.exists() and path.stat().st_size > 0
+
+
+class StreamedRun(NamedTuple):
+    returncode: int
+    timed_out: bool
+    tail: Deque[str]
+    wall_s: float = 0.0
+    # resources of the launcher and the JVM it waited for; None when the
+    # exit status was collected elsewhere
+    cpu_s: Optional[float] = None
+    peak_rss_mb: Optional[float] = None
+
+
+class RunUsage:
+    """Adds up the Audiveris runs this process makes between reset() and summary().
+
+    A job worker converts one score at a time, so this is that score's usage,
+    split chunks included (their runs overlap, peak_rss_mb is the largest
+    single run). Linux carries the forking process's own peak over into the
+    child's, so peak_rss_mb never reads below the worker's (~150 MB); a JVM
+    run is well above that.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.runs = 0
+            self.wall_s = 0.0
+            self.cpu_s = None
+            self.peak_rss_mb = None
+
+    def add(self, run: StreamedRun):
+        with self._lock:
+            self.runs += 1
+            self.wall_s += run.wall_s
+            if run.cpu_s is not None:
+                self.cpu_s = (self.cpu_s or 0.0) + run.cpu_s
+            if run.peak_rss_mb is not None:
+                self.peak_rss_mb = max(self.peak_rss_mb or 0.0, run.peak_rss_mb)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            return {"runs": self.runs, "wall_s": self.wall_s, "cpu_s": self.cpu_s, "peak_rss_mb": self.peak_rss_mb}
+
+
+run_usage = RunUsage()
+
+
+def _wait_with_usage(process: subprocess.Popen) -> Tuple[int, Optional[resource.struct_rusage]]:
+    try:
+        _, wait_status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # already reaped, the timeout's kill() polls the process
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    return process.returncode, usage
+
+
+def run_streaming(
+    cmd: List[str],
+    timeout: float,
+    on_line: Callable[[str], None],
+    tail_lines: int = 200,
+    env: Optional[Dict[str, str]] = None
+) -> StreamedRun:
+    """Runs Audiveris with stdout/stderr merged and read line by line as it is produced.
+
+    Keeps the last `tail_lines` lines for error reports; the process is
+    killed once `timeout` seconds have passed.
+    """
+    tail = deque(maxlen=tail_lines)
+    timed_out = Event()
+
+    started = monotonic()
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, env=env
+    )
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    killer = Timer(timeout, kill)
+    killer.start()
+    try:
+        for line in process.stdout:
+            tail.append(line)
+            on_line(line)
+        # wait4 rather than wait() for the child's cpu time and peak memory
+        returncode, usage = _wait_with_usage(process)
+    finally:
+        killer.cancel()
+    AUDIVERIS_EXITS.labels(code=str(returncode)).inc()
+    if timed_out.is_set():
+        AUDIVERIS_TIMEOUTS.inc()
+
+    run = StreamedRun(returncode, timed_out.is_set(), tail, wall_s=monotonic() - started)
+    if usage is not None:
+        # ru_maxrss is in KB on Linux
+        run = run._replace(cpu_s=usage.ru_utime + usage.ru_stime, peak_rss_mb=usage.ru_maxrss / 1024)
+    run_usage.add(run)
+    return run
+
+
 class AudiverisConverter:
-    def __init__(self, audiveris_path: str = "/app/audiveris/build/install/audiveris/bin/audiveris"):
+    """Runs Audiveris in batch mode.
+
+    `heap_mb` and `thread_count` override the defaults in AUDIVERIS_OPTIONS
+    (and the JVM -Xmx) for runs that have to share the machine.
+    """
+    def __init__(
+        self,
+        audiveris_path: str = "/app/audiveris/build/install/audiveris/bin/audiveris",
+        heap_mb: Optional[int] = None,
+        thread_count: Optional[int] = None
+    ):
         self.audiveris_path = Path(audiveris_path)
+        self.heap_mb = heap_mb
+        self.thread_count = thread_count
         self._validate_installation()
         
     def _validate_installation(self):
@@ -17,88 +250,76 @@ class AudiverisConverter:
                 f"Audiveris not fount at {self.audiveris_path}. Verify docker installation contains Audiveris."
                 )
             
+    def _options(self) -> List[str]:
+        overrides = {}
+        if self.thread_count:
+            overrides["org.audiveris.omr.batch.threadCount"] = self.thread_count
+        if self.heap_mb:
+            overrides["org.audiveris.omr.batch.memoryMax"] = self.heap_mb
+
+        options = []
+        for option in AUDIVERIS_OPTIONS:
+            key = option.split("=", 1)[0]
+            options.append(f"{key}={overrides[key]}" if key in overrides else option)
+        return options
+
+    def environment(self) -> Optional[Dict[str, str]]:
+        if not self.heap_mb:
+            return None
+        # the launcher script reads JVM flags from AUDIVERIS_OPTS
+        env = os.environ.copy()
+        opts = re.sub(r"-Xmx\S+", "", env.get("AUDIVERIS_OPTS", ""))
+        env["AUDIVERIS_OPTS"] = f"{opts} -Xmx{self.heap_mb}m".strip()
+        return env
+
+    def build_command(self, input_paths: List[Path], output_dir: Path) -> List[str]:
+        return [
+            str(self.audiveris_path),
+            "-batch",
+            "-export",
+            *self._options(),
+            "-output", str(output_dir),
+            *[str(p) for p in input_paths]
+        ]
+
     def convert_to_musicxml(
         self,
         input_path: str,
         output_dir: str,
-        timeout: int = 1800
+        timeout: int = 1800,
+        on_progress: Optional[ProgressCallback] = None
     ) -> Optional[str]:
         input_path = Path(input_path)
         output_dir = Path(output_dir)
         
-        try:
-            cmd = [
-                
-                str(self.audiveris_path),
-                "-batch",
-                "-export",
-                "-option", "org.audiveris.omr.sheet.BookManager.useOpus=true",
-                "-option", "org.audiveris.omr.text.Language.defaultSpecification=eng+ita",
-                "-option", "org.audiveris.omr.text.tesseract.path=/usr/local/bin/tesseract",
-                "-option", "org.audiveris.omr.text.tesseract.datadir=/usr/local/share/tessdata",
-                "-option", "org.audiveris.omr.text.tesseract.ocrEngineMode=1",  # LSTM mode
-                "-option", "org.audiveris.omr.batch.threadCount=4",  # Parallel processing
-                "-option", "org.audiveris.omr.batch.memoryMax=4096", # 4GB heap
-                
-                "-option", "org.audiveris.omr.sheet.SheetStub.maxErrors=500",  
-                "-option", "org.audiveris.omr.steps.sheet.MaxStubs=20",  
-                "-option", "book.export.force=true",  
-
-                "-option", "org.audiveris.omr.steps.TEXTS.minGrade=0.05",  
-                "-option", "org.audiveris.omr.steps.DYNAMICS.minGrade=0.15",  
-                "-option", "org.audiveris.omr.steps.SYMBOLS.minGrade=0.1",
-                
-                "-option", "omr.sheet.staves.voidPartCreation=true",  # Keeps irregular staff regions  
-                "-option", "omr.sheet.parts.mergePolicy=ALWAYS",      # Forces system connectivity  
-                "-option", "omr.steps.GRID.peakMergeX=1.0",           # Broad horizontal staff merging  
-                "-option", "omr.steps.GRID.peakMergeY=0.8",           # Loose vertical staff alignment  
-
-                # Removing TIME processing  
-                "-option", "omr.steps.TIME.maxCandidates=0",  
-                # Disabling key signature analysis  
-                "-option", "omr.steps.KEYS.maxCandidates=0",  
-                # Bypassing clef validation  
-                "-option", "omr.steps.CLEFS.maxCandidates=0", 
-                
-                "-option", "musicxml.extension.visualDescriptors=true", # Shape complexity metrics  
-
-                "-output", str(output_dir),
-                str(input_path)
-            ]
+        cmd = self.build_command([input_path], output_dir)
+        logger.debug(f"Running command {' '.join(cmd )}")
 
-            
-            logger.debug(f"Running command {' '.join(cmd )}")
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-                check=True
-            )
-            
-            sleep(10 if input_path.stat().st_size > 1_000_000 else 5) 
-            
-                
-            mxl_file = output_dir / f"{input_path.stem}.opus.mxl"
-            
-            if mxl_file.exists():
-                logger.info(f"Successfully generated {mxl_file}")
-                return str(mxl_file)
-            
-            else:
-                logger.error(f"MXL file missing. Directory contents:")
-                for f in output_dir.glob("*"):
-                    logger.error(f" - {f}")
-                return None            
-        
-        except subprocess.TimeoutExpired:
+        def on_line(line: str):
+            progress = parse_progress(line)
+            if progress and on_progress:
+                on_progress(*progress)
+
+        run = run_streaming(cmd, timeout, on_line, env=self.environment())
+
+        if run.timed_out:
             logger.error(f"Conversion timed out after {timeout}s")
             return None
-        except subprocess.CalledProcessError as e:
+        if run.returncode != 0:
             logger.error("Audiveris crash details:")
-            logger.error(f"Command: {e.cmd}")
-            logger.error(f"Exit code:  {e.returncode}")
-            logger.error(f"STDOUT:\n{e.stdout[:2000]}")
-            logger.error(f"STDERR:\n{e.stderr[:2000]}")
-            return None
\ No newline at end of file
+            logger.error(f"Command: {cmd}")
+            logger.error(f"Exit code:  {run.returncode}")
+            logger.error(f"Last {len(run.tail)} lines of output:\n{''.join(run.tail)}")
+            return None
+            
+        mxl_file = output_dir / f"{input_path.stem}.opus.mxl"
+        
+        if wait_for_output(mxl_file):
+            logger.info(f"Successfully generated {mxl_file}")
+            return str(mxl_file)
+        
+        else:
+            logger.error(f"MXL file missing. Directory contents:")
+            for f in output_dir.glob("*"):
+                logger.error(f" - {f}")
+            return None
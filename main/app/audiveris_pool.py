@@ -0,0 +1,317 @@
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+from pathlib import Path
+from time import monotonic
+from typing import Optional
+from uuid import uuid4
+
+from watchfiles import watch
+
+from .audiveris import AudiverisConverter, ProgressCallback, parse_progress, run_streaming, wait_for_output
+from .config import DATA_DIR, AUDIVERIS_PATH, AUDIVERIS_POOL_SIZE, AUDIVERIS_POOL_BATCH
+from .processes import OwnerLock, lead_process_group, parent_alive, stop_on_sigterm, stop_process_group
+from .scheduler import current_plan
+
+logger = logging.getLogger(__name__)
+
+# Audiveris has no resident/server mode, every `-batch` run is one JVM that
+# exits when its books are done. The pool keeps long-lived dispatcher
+# processes that hand every book waiting in the inbox to a single JVM run, so
+# under load the JVM startup, class loading and Tesseract init are paid once
+# per batch instead of once per score.
+#
+# Handoff is through the filesystem so any job worker process can submit:
+#   inbox/<id>.json    request written by submit()
+#   claimed/<id>.json  moved there (atomic rename) by the dispatcher that takes it,
+#                      and renamed to <id>.answering while the result is written
+#   progress/<id>.jsonl  one [step, sheet] line per step change, tailed by submit()
+#   outbox/<id>.json   result, {"mxl": path} or {"error": message}
+POOL_DIR = DATA_DIR / "audiveris_pool"
+INBOX_DIR = POOL_DIR / "inbox"
+CLAIMED_DIR = POOL_DIR / "claimed"
+PROGRESS_DIR = POOL_DIR / "progress"
+OUTBOX_DIR = POOL_DIR / "outbox"
+BATCHES_DIR = POOL_DIR / "batches"
+# held by the process running the dispatchers; next to POOL_DIR, not in it,
+# since the owner clears that
+POOL_LOCK = DATA_DIR / "audiveris_pool.lock"
+
+# books are renamed to their request id, so log lines tagged with the book
+# name tell which book Audiveris is working on
+BOOK_TAG = re.compile(r"\[([0-9a-f]{32})")
+
+
+def _write_json_atomic(path: Path, data: dict):
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+class _ProgressRelay:
+    """Reads the progress lines a dispatcher appended since the last call."""
+    def __init__(self, path: Path, on_progress: Optional[ProgressCallback]):
+        self.path = path
+        self.on_progress = on_progress
+        self.offset = 0
+
+    def poll(self):
+        if not self.on_progress or not self.path.exists():
+            return
+        with open(self.path) as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # half-written, picked up next time
+                self.offset += len(line)
+                step, sheet = json.loads(line)
+                self.on_progress(step, sheet)
+
+
+def _wait_for_result(path: Path, relay: _ProgressRelay, timeout: float) -> bool:
+    deadline = monotonic() + timeout
+    # rust_timeout makes watch() yield periodically so the deadline and the
+    # event/creation race are both covered
+    for _ in watch(path.parent, relay.path.parent, rust_timeout=1000, yield_on_timeout=True):
+        relay.poll()
+        if path.exists():
+            return True
+        if monotonic() > deadline:
+            return False
+    return path.exists()
+
+
+def submit(
+    input_path: str,
+    output_dir: str,
+    timeout: int = 1800,
+    on_progress: Optional[ProgressCallback] = None
+) -> Optional[str]:
+    """Queues a book for the pool and blocks until its .mxl is exported.
+
+    Same contract as AudiverisConverter.convert_to_musicxml: returns the path
+    of `<output_dir>/<input stem>.opus.mxl`, or None on failure/timeout.
+    """
+    request_id = uuid4().hex
+    _write_json_atomic(INBOX_DIR / f"{request_id}.json", {
+        "id": request_id,
+        "input": str(Path(input_path).resolve()),
+        "output_dir": str(Path(output_dir).resolve()),
+        "timeout": timeout,
+    })
+    logger.debug(f"Submitted {input_path} to the Audiveris pool as {request_id}")
+
+    result_path = OUTBOX_DIR / f"{request_id}.json"
+    relay = _ProgressRelay(PROGRESS_DIR / f"{request_id}.jsonl", on_progress)
+    try:
+        if not _wait_for_result(result_path, relay, timeout):
+            if _withdraw(request_id):
+                logger.error(f"Conversion timed out after {timeout}s in the Audiveris pool")
+                return None
+            # lost the race to a dispatcher that is writing the result
+            if not wait_for_output(result_path):
+                logger.error(f"Conversion timed out after {timeout}s in the Audiveris pool")
+                return None
+        relay.poll()
+    finally:
+        relay.path.unlink(missing_ok=True)
+
+    result = json.loads(result_path.read_text())
+    result_path.unlink(missing_ok=True)
+    if "error" in result:
+        logger.error(f"Audiveris pool failed on {input_path}: {result['error']}")
+        return None
+    logger.info(f"Successfully generated {result['mxl']}")
+    return result["mxl"]
+
+
+def _withdraw(request_id: str) -> bool:
+    """Takes back a request nobody has answered, False when a dispatcher already is."""
+    # still unclaimed: no dispatcher wastes a JVM run on it. Claimed: the
+    # dispatcher finds its claim gone and drops the result instead of
+    # leaving it in the outbox
+    for path in (INBOX_DIR / f"{request_id}.json", CLAIMED_DIR / f"{request_id}.json"):
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            continue
+    return False
+
+
+def _claim_batch(limit: int) -> list:
+    requests = []
+    for path in sorted(INBOX_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime):
+        if len(requests) >= limit:
+            break
+        claimed = CLAIMED_DIR / path.name
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue  # another dispatcher (or a timed out submitter) got there first
+        requests.append(json.loads(claimed.read_text()))
+    return requests
+
+
+def _answering(request: dict) -> Optional[Path]:
+    # renaming the claim is atomic against the submitter's _withdraw: either
+    # the submitter took the request back, or it waits for this answer
+    claimed = CLAIMED_DIR / f"{request['id']}.json"
+    answering = claimed.with_suffix(".answering")
+    try:
+        os.rename(claimed, answering)
+    except FileNotFoundError:
+        logger.info(f"Request {request['id']} was withdrawn by its submitter, dropping the result")
+        return None
+    return answering
+
+
+def _finish(request: dict, export_dir: Path, wait: float) -> bool:
+    exported = export_dir / f"{request['id']}.opus.mxl"
+    if not wait_for_output(exported, timeout=wait):
+        return False
+
+    answering = _answering(request)
+    if answering is None:
+        return True
+    output_dir = Path(request["output_dir"])
+    output_dir.mkdir(parents=True, exist_ok=True)
+    mxl_file = output_dir / f"{Path(request['input']).stem}.opus.mxl"
+    shutil.move(str(exported), mxl_file)
+    _write_json_atomic(OUTBOX_DIR / f"{request['id']}.json", {"mxl": str(mxl_file)})
+    answering.unlink()
+    return True
+
+
+def _fail(request: dict, error: str):
+    answering = _answering(request)
+    if answering is None:
+        return
+    _write_json_atomic(OUTBOX_DIR / f"{request['id']}.json", {"error": error})
+    answering.unlink()
+
+
+def run_batch(converter: AudiverisConverter, requests: list):
+    batch_dir = BATCHES_DIR / uuid4().hex
+    export_dir = batch_dir / "out"
+    export_dir.mkdir(parents=True)
+
+    inputs = []
+    for request in requests:
+        link = batch_dir / f"{request['id']}{Path(request['input']).suffix}"
+        os.symlink(request["input"], link)
+        inputs.append(link)
+
+    cmd = converter.build_command(inputs, export_dir)
+    logger.info(f"Audiveris batch of {len(requests)} book(s) in {batch_dir.name}")
+    started = monotonic()
+
+    pending = {request["id"]: request for request in requests}
+    current_book = None
+    last_progress = {}
+
+    def on_line(line: str):
+        nonlocal current_book
+        match = BOOK_TAG.search(line)
+        if not match:
+            return
+        book = match.group(1)
+        if book != current_book:
+            # Audiveris moved on to another book, the previous one is exported
+            # (if it is going to be); answer its submitter right away instead
+            # of holding it until the whole batch is through
+            if current_book in pending and _finish(pending[current_book], export_dir, wait=2.0):
+                del pending[current_book]
+            current_book = book
+
+        progress = parse_progress(line)
+        # no progress for a withdrawn request, nobody would read or remove it
+        if (book in pending and progress and last_progress.get(book) != progress
+                and (CLAIMED_DIR / f"{book}.json").exists()):
+            last_progress[book] = progress
+            with open(PROGRESS_DIR / f"{book}.jsonl", "a") as f:
+                f.write(json.dumps(progress) + "\n")
+
+    run = run_streaming(
+        cmd, sum(r["timeout"] for r in requests), on_line, tail_lines=50, env=converter.environment()
+    )
+
+    for request_id, request in pending.items():
+        if not _finish(request, export_dir, wait=2.0):
+            _fail(request, f"no export (exit code {run.returncode}): {''.join(run.tail)[-2000:]}")
+
+    logger.info(f"Audiveris batch {batch_dir.name} finished in {monotonic() - started:.1f}s")
+    shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+def _dispatcher_main(batch_size: int, parent_pid: int):
+    lead_process_group()
+    stop_event = stop_on_sigterm()
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    plan = current_plan()
+    converter = AudiverisConverter(AUDIVERIS_PATH, heap_mb=plan.heap_mb, thread_count=plan.threads)
+    # after the owner was killed outright the next one clears POOL_DIR and
+    # starts dispatchers of its own, these leave after their batch
+    while not stop_event.is_set() and parent_alive(parent_pid):
+        requests = _claim_batch(batch_size)
+        if requests:
+            run_batch(converter, requests)
+            continue
+        # sleep until something lands in the inbox (or we are told to stop)
+        for _ in watch(INBOX_DIR, stop_event=stop_event, rust_timeout=1000, yield_on_timeout=True):
+            break
+
+
+class AudiverisPool:
+    """Long-lived dispatcher processes feeding books to batched Audiveris runs.
+
+    One process runs them, the one holding POOL_LOCK (the job runner's, see
+    main.py and jobs.py); start() anywhere else returns False and leaves
+    POOL_DIR alone.
+    """
+    def __init__(self, size: int = AUDIVERIS_POOL_SIZE, batch_size: int = AUDIVERIS_POOL_BATCH):
+        self.size = size or current_plan().slots
+        self.batch_size = batch_size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._lock = OwnerLock(POOL_LOCK)
+
+    def start(self) -> bool:
+        if not self._lock.acquire():
+            logger.info(f"Audiveris pool runs in process {self._lock.owner()}, not starting one here")
+            return False
+        # no other pool owns the directory, so whoever submitted leftovers
+        # from a previous run is gone; their jobs are requeued by the
+        # JobRunner and will submit again
+        shutil.rmtree(POOL_DIR, ignore_errors=True)
+        for directory in (INBOX_DIR, CLAIMED_DIR, PROGRESS_DIR, OUTBOX_DIR, BATCHES_DIR):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        for i in range(self.size):
+            process = self._ctx.Process(
+                target=_dispatcher_main,
+                args=(self.batch_size, os.getpid()),
+                name=f"audiveris-pool-{i}",
+            )
+            process.start()
+            self._processes.append(process)
+        logger.info(f"Started {self.size} Audiveris pool dispatcher(s)")
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        if not self._processes:
+            return
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            # with the batch JVM a dispatcher may be waiting on
+            stop_process_group(process, timeout)
+        self._processes = []
+        self._lock.release()
@@ -0,0 +1,79 @@
+import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+
+import fitz
+
+from .audiveris import ProgressCallback
+from .musicxml import merge_mxl_files
+
+logger = logging.getLogger(__name__)
+
+# (input path, output dir, progress callback) -> path of the exported .mxl or None;
+# AudiverisConverter.convert_to_musicxml and audiveris_pool.submit both fit
+ChunkConverter = Callable[[str, str, Optional[ProgressCallback]], Optional[str]]
+
+
+def split_pdf(pdf_path: Path, chunk_dir: Path, pages_per_chunk: int) -> List[Tuple[Path, int]]:
+    """Writes the PDF out as consecutive page ranges; returns (chunk path, index of its first page)."""
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    chunks = []
+    with fitz.open(str(pdf_path)) as doc:
+        for first in range(0, len(doc), pages_per_chunk):
+            last = min(first + pages_per_chunk, len(doc)) - 1
+            chunk_path = chunk_dir / f"{pdf_path.stem}_p{first + 1:04d}-{last + 1:04d}.pdf"
+            with fitz.open() as chunk:
+                chunk.insert_pdf(doc, from_page=first, to_page=last)
+                chunk.save(str(chunk_path))
+            chunks.append((chunk_path, first))
+    return chunks
+
+
+def convert_in_chunks(
+    convert: ChunkConverter,
+    input_path: Path,
+    output_dir: Path,
+    pages_per_chunk: int,
+    max_parallel: int,
+    on_progress: Optional[ProgressCallback] = None
+) -> Optional[str]:
+    """Converts page ranges of a book concurrently and merges them into `<stem>.mxl`.
+
+    Wall clock ends up close to the slowest chunk instead of the whole book.
+    Raises musicxml.MergeError when the chunk outputs can't be stitched
+    together (e.g. Audiveris found a different number of parts in each), so
+    the caller can fall back to converting the book in one run.
+    """
+    work_dir = output_dir / "chunks"
+    chunks = split_pdf(input_path, work_dir, pages_per_chunk)
+    logger.info(f"Converting {input_path.name} as {len(chunks)} chunk(s), {max_parallel} at a time")
+
+    # callbacks arrive from several threads; sheets are renumbered to their
+    # position in the whole book
+    progress_lock = Lock()
+
+    def convert_chunk(chunk: Tuple[Path, int]) -> Optional[str]:
+        chunk_path, first_page = chunk
+
+        def relay(step: str, sheet: Optional[int]):
+            with progress_lock:
+                on_progress(step, None if sheet is None else first_page + sheet)
+
+        chunk_output = work_dir / chunk_path.stem
+        chunk_output.mkdir(exist_ok=True)
+        return convert(str(chunk_path), str(chunk_output), relay if on_progress else None)
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        results = list(pool.map(convert_chunk, chunks))
+
+    failed = [chunk_path.name for (chunk_path, _), result in zip(chunks, results) if result is None]
+    if failed:
+        logger.error(f"Chunk conversion failed for {', '.join(failed)}")
+        return None
+
+    mxl_file = merge_mxl_files([Path(result) for result in results], output_dir / f"{input_path.stem}.mxl")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return str(mxl_file)
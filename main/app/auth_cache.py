@@ -0,0 +1,144 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Hashable, Optional
+
+from sqlalchemy import delete, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from .auth_utils import decode_access_token
+from .config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+from .database import commit_with_retry_async
+from .models import RevokedToken, User, utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after they are set.
+
+    A ttl of 0 turns it off: nothing is stored and every get() misses.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Per process. With several server workers each has its own copy, so nothing
+# cached outlives AUTH_CACHE_TTL: a user changed or deleted, or a token logged
+# out, through another worker is seen here at most that late, and a token is
+# never trusted past its own expiry.
+token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)  # token -> user id (checked against revoked_tokens)
+user_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)  # user id -> detached User
+# Revocations live in the revoked_tokens table, shared by all workers, until
+# the token expires; this only saves looking up the same revoked token twice.
+# An entry it drops is read from the table again
+revoked_tokens = TTLCache(AUTH_CACHE_SIZE, float("inf"))
+
+
+def _token_sha256(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def token_user_id(token: str, db: AsyncSession) -> Optional[int]:
+    """The user id a valid, unrevoked token belongs to."""
+    if revoked_tokens.get(token):
+        return None
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    payload = decode_access_token(token)
+    if not payload:
+        return None
+    try:
+        user_id = int(payload["sub"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if await db.get(RevokedToken, _token_sha256(token)) is not None:
+        revoked_tokens.set(token, True, ttl=payload["exp"] - time())
+        return None
+    token_cache.set(token, user_id, ttl=payload["exp"] - time())
+    return user_id
+
+
+async def load_user(user_id: int, db: AsyncSession) -> Optional[User]:
+    """The user row, from the cache when it's fresh enough.
+
+    Cached rows are merged into `db` without a query, so the request gets an
+    ordinary instance of its own session and the cached copy is never shared.
+    """
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return await db.merge(cached, load=False)
+
+    user = await db.get(User, user_id)
+    if user is not None:
+        logger.debug("Loaded user %s", user_id)
+        copy = User(id=user.id, username=user.username, hashed_password=user.hashed_password)
+        make_transient_to_detached(copy)
+        user_cache.set(user_id, copy)
+    return user
+
+
+async def revoke_token(token: str, db: AsyncSession):
+    payload = decode_access_token(token)
+    token_cache.pop(token)
+    if not payload:
+        return  # expired or invalid, nothing would accept it anyway
+    revoked_tokens.set(token, True, ttl=payload["exp"] - time())
+
+    revoked = RevokedToken(
+        token_sha256=_token_sha256(token),
+        expires_at=datetime.fromtimestamp(payload["exp"], tz=timezone.utc),
+    )
+
+    async def apply():
+        await db.merge(revoked)
+        # rows of tokens that have expired since are of no use any more
+        await db.execute(delete(RevokedToken).where(RevokedToken.expires_at < utcnow()))
+
+    await commit_with_retry_async(db, apply)
+
+
+# any change to a user row made through this process drops its cached copy
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target: User):
+    user_cache.pop(target.id)
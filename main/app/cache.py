@@ -0,0 +1,64 @@
+import logging
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import commit_with_retry
+from .models import Score, CachedResult
+from .audiveris import options_fingerprint
+from .preprocessing import preprocessing_fingerprint
+from .storage import get_storage
+from .metrics import RESULT_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+def make_cache_key(content_digest: str) -> str:
+    """Key for a finished conversion: the upload's sha256 plus everything that shapes the output."""
+    return f"{content_digest}:{preprocessing_fingerprint()}:{options_fingerprint()}"
+
+
+def _artifacts_stored(cached: CachedResult) -> bool:
+    storage = get_storage()
+    return storage.exists(cached.processed_path) and storage.exists(cached.xmlmusic_path)
+
+
+async def lookup_result(cache_key: str, db: AsyncSession) -> Optional[CachedResult]:
+    cached = (await db.execute(select(CachedResult).filter(CachedResult.cache_key == cache_key))).scalars().first()
+
+    # an entry whose score was deleted is useless (hits copy its output
+    # columns), drop it and convert again
+    if cached and await db.get(Score, cached.score_id) is None:
+        logger.warning(f"Score {cached.score_id} cached for {cache_key} is gone, evicting")
+        await db.delete(cached)
+        await db.commit()
+        cached = None
+    # so is one whose artifacts were removed from storage; with S3 that's a
+    # HEAD request per artifact, made in a worker thread
+    if cached and not await run_in_threadpool(_artifacts_stored, cached):
+        logger.warning(f"Cached artifacts for {cache_key} are gone, evicting")
+        await db.delete(cached)
+        await db.commit()
+        cached = None
+
+    RESULT_CACHE_LOOKUPS.labels(outcome="hit" if cached else "miss").inc()
+    return cached
+
+
+def remember_result(score: Score, db: Session):
+    if not score.cache_key or not score.xmlmusic_path:
+        return
+    entry = CachedResult(
+        cache_key=score.cache_key,
+        processed_path=score.processed_path,
+        xmlmusic_path=score.xmlmusic_path,
+        score_id=score.id,
+    )
+    try:
+        commit_with_retry(db, lambda: db.add(entry))
+    except IntegrityError:
+        # an identical upload finished first, its entry is just as good
+        db.rollback()
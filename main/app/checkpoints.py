@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .models import Score, utcnow
+
+# a score goes through these in order; each one that finishes leaves a
+# checkpoint on the score (scores.checkpoints, {stage: {..., "at"}}), and a
+# job for a score that failed or was interrupted starts at the first stage
+# without one:
+#   ingest   the original is in storage (written at upload)
+#   cleanup  "pages" so far while it runs, "complete" once processed_path is stored
+#   omr      the Audiveris export, stored under "output"
+#   export   xmlmusic_path and the download columns point at it
+STAGES = ("ingest", "cleanup", "omr", "export")
+
+
+def checkpoint(score: Score, stage: str) -> dict:
+    return (score.checkpoints or {}).get(stage) or {}
+
+
+def set_checkpoint(score: Score, stage: str, **info):
+    # a new dict every time, in-place changes to a JSON column aren't tracked
+    score.checkpoints = {**(score.checkpoints or {}), stage: {**info, "at": utcnow().isoformat()}}
+
+
+def resume_stage(score: Score) -> Optional[str]:
+    """The first stage without a finished checkpoint, None when all are done."""
+    # a score row only exists once its original is stored, so ingest is
+    # done even for scores uploaded before checkpoints
+    for stage in STAGES[1:]:
+        done = checkpoint(score, stage)
+        if not done or (stage == "cleanup" and not done.get("complete")):
+            return stage
+    return None
+
+
+# cleaned pages are kept in the score's work dir until the whole stage is
+# done, lossless and with light compression: writing one costs a fraction of
+# cleaning it
+def save_page(path: Path, image: np.ndarray):
+    # under another name until complete, a crash mid-write leaves no half page
+    partial = path.with_name(f"{path.stem}.part{path.suffix}")
+    if not cv2.imwrite(str(partial), image, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+        raise OSError(f"Could not write page checkpoint {path}")
+    os.replace(partial, path)
+
+
+def load_page(path: Path) -> Optional[np.ndarray]:
+    return cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
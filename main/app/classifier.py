@@ -0,0 +1,124 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import fitz
+import numpy as np
+
+from .config import VECTOR_MAX_NOISE
+
+# what a PDF page is made of decides how much cleaning it needs:
+#   vector   drawn by notation software: paths and glyphs, at most a logo-sized image
+#   scanned  images and nothing drawn over them but possibly an OCR text layer
+#   mixed    images together with vector notation, cleaned like a scan
+VECTOR = "vector"
+SCANNED = "scanned"
+MIXED = "mixed"
+PAGE_CLASSES = (VECTOR, SCANNED, MIXED)
+
+# share of the page images may cover and still be vector / make it a scan
+# even with vector art on top
+VECTOR_MAX_IMAGE_COVERAGE = 0.05
+SCAN_MIN_IMAGE_COVERAGE = 0.5
+
+# text that isn't painted: the OCR layer over a scan (render mode 3, or
+# fully transparent), which is no more vector notation than the scan is
+INVISIBLE_TEXT = 3
+
+# the noise estimate only needs the paper, a thumbnail renders in a few ms
+THUMBNAIL_DPI = 36
+
+
+class PageClass(NamedTuple):
+    kind: str
+    drawings: int
+    images: int
+    # lowest effective resolution of the page's images, None without images
+    image_dpi: Optional[float]
+    image_coverage: float
+    # visible glyphs (notation fonts, titles) and the OCR layer's hidden ones
+    text_chars: int
+    hidden_chars: int
+    # spread of the paper's gray level in the thumbnail (robust std, gray levels)
+    noise: float
+
+    @property
+    def clean_vector(self) -> bool:
+        return self.kind == VECTOR and self.noise <= VECTOR_MAX_NOISE
+
+
+def paper_noise(thumbnail: np.ndarray) -> float:
+    """How much the paper of a page varies: 0 for rendered vector art, several gray levels for a scan.
+
+    Paper is what Otsu puts on the light side; the median absolute deviation
+    keeps anti-aliased edges, a small minority, from counting as noise.
+    """
+    threshold, _ = cv2.threshold(thumbnail, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    paper = thumbnail[thumbnail > threshold]
+    if paper.size == 0:
+        return 0.0
+    median = np.median(paper)
+    return 1.4826 * float(np.median(np.abs(paper.astype(np.int16) - median)))
+
+
+def count_text(page: fitz.Page) -> Tuple[int, int]:
+    """Visible and hidden characters on a page."""
+    visible = hidden = 0
+    for span in page.get_texttrace():
+        chars = sum(1 for char in span["chars"] if not chr(char[0]).isspace())
+        if span["type"] == INVISIBLE_TEXT or span["opacity"] == 0:
+            hidden += chars
+        else:
+            visible += chars
+    return visible, hidden
+
+
+def page_kind(image_coverage: float, images: int, drawings: int, text_chars: int) -> str:
+    """vector, scanned or mixed, from the images and what is drawn besides them.
+
+    The images' resolution doesn't take part: a low resolution scan needs
+    the same cleaning as a fine one, and the render dpi comes from the
+    staves (page_scale), not from the images.
+    """
+    vector_art = drawings > 0 or text_chars > 0
+    if not images or (vector_art and image_coverage <= VECTOR_MAX_IMAGE_COVERAGE):
+        return VECTOR
+    # a scan however much of the page it fills, OCR layer or not
+    if not vector_art:
+        return SCANNED
+    return SCANNED if image_coverage >= SCAN_MIN_IMAGE_COVERAGE else MIXED
+
+
+def classify_page(page: fitz.Page) -> PageClass:
+    """Sorts a page into vector, scanned or mixed from its content and a thumbnail."""
+    area = page.rect.width * page.rect.height
+    covered = 0.0
+    dpis = []
+    infos = page.get_image_info()
+    for info in infos:
+        bbox = fitz.Rect(info["bbox"]).intersect(page.rect)
+        if bbox.is_empty:
+            continue
+        covered += bbox.width * bbox.height
+        dpis.append(min(info["width"] / bbox.width, info["height"] / bbox.height) * 72)
+    coverage = min(1.0, covered / area) if area else 0.0
+    # the C variant skips building Python dicts for every path
+    drawings = len(page.get_cdrawings())
+    text_chars, hidden_chars = count_text(page)
+
+    pix = page.get_pixmap(dpi=THUMBNAIL_DPI, colorspace=fitz.csGRAY, alpha=False)
+    thumbnail = np.ndarray((pix.height, pix.width), dtype=np.uint8, buffer=pix.samples_mv, strides=(pix.stride, 1))
+    return PageClass(
+        kind=page_kind(coverage, len(dpis), drawings, text_chars),
+        drawings=drawings,
+        images=len(infos),
+        image_dpi=round(min(dpis), 1) if dpis else None,
+        image_coverage=round(coverage, 3),
+        text_chars=text_chars,
+        hidden_chars=hidden_chars,
+        noise=round(paper_noise(thumbnail), 2),
+    )
+
+
+def classify_pdf(pdf_path: str) -> List[PageClass]:
+    with fitz.open(pdf_path) as doc:
+        return [classify_page(page) for page in doc]
@@ -1,11 +1,143 @@
-from sqlalchemy import create_engine
+import asyncio
+import inspect
+import logging
+import random
+from time import sleep
+from typing import Callable, TypeVar
+
+from sqlalchemy import create_engine, event, inspect as sa_inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from .config import (
+    DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_JOURNAL_MODE,
+    DB_BUSY_TIMEOUT_MS, DB_SYNCHRONOUS, DB_COMMIT_ATTEMPTS,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
 
-DATABASE_URL = "sqlite:///data/scores.db"
 
-engine = create_engine(DATABASE_URL)
+def async_url(url: str) -> str:
+    """The same database through an asyncio driver."""
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)).render_as_string(
+        hide_password=False
+    )
+
+
+# every process (uvicorn worker, job worker) builds its own engines and pools
+# at import; pools only open connections as they are needed, so a job worker
+# running one session at a time holds one, and never touches the async one.
+# The sync engine is for the job workers, scripts and Alembic, the async one
+# for the route handlers, so queries don't block the event loop
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=not DATABASE_URL.startswith("sqlite"),
+)
+# aiosqlite would default to a connection per session; pooled they're reused
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL or async_url(DATABASE_URL),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=not DATABASE_URL.startswith("sqlite"),
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes can't be lazy loaded outside an await,
+# so objects stay readable after a commit (templates, responses)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+
+# WAL lets readers carry on while one process writes, and the busy timeout
+# makes a second writer wait for the lock instead of failing straight away
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not DATABASE_URL.startswith("sqlite"):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.close()
+
+
+def is_contention(error: OperationalError) -> bool:
+    """Whether a failed statement lost to another writer and is worth retrying."""
+    # SQLite: lock still held after busy_timeout, or a stale WAL snapshot;
+    # PostgreSQL: serialization failure or deadlock
+    if getattr(error.orig, "pgcode", None) in ("40001", "40P01"):
+        return True
+    message = str(error.orig).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def _count_retry():
+    # imported here so Alembic, which imports this module, leaves metrics alone
+    from .metrics import DB_COMMIT_RETRIES
+    DB_COMMIT_RETRIES.inc()
+
+
+def commit_with_retry(db: Session, apply: Callable[[], T], attempts: int = DB_COMMIT_ATTEMPTS) -> T:
+    """Runs `apply` (the session changes) and commits, redoing both when either loses to another writer.
+
+    `apply` may write straight away (a bulk UPDATE like the job claim), so
+    the lock can be lost there as well as at the commit. Either way the
+    session is rolled back, which drops whatever `apply` did, so it has to be
+    safe to call again.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            result = apply()
+            db.commit()
+            return result
+        except OperationalError as e:
+            db.rollback()
+            if attempt == attempts or not is_contention(e):
+                raise
+            _count_retry()
+            delay = min(1.0, 0.01 * 2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f"Commit lost to a concurrent writer ({e.orig}), retrying in {delay:.3f}s")
+            sleep(delay)
+
+
+async def commit_with_retry_async(db: AsyncSession, apply: Callable[[], T], attempts: int = DB_COMMIT_ATTEMPTS) -> T:
+    """commit_with_retry for an AsyncSession; `apply` may be a plain or an async function.
+
+    A retry's rollback expires every object the session holds, which
+    expire_on_commit=False doesn't cover; they are reloaded once the commit
+    goes through, as the caller can't lazy load them afterwards.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            result = apply()
+            if inspect.isawaitable(result):
+                result = await result
+            await db.commit()
+            if attempt > 1:
+                for obj in list(db.identity_map.values()):
+                    if sa_inspect(obj).expired:
+                        await db.refresh(obj)
+            return result
+        except OperationalError as e:
+            await db.rollback()
+            if attempt == attempts or not is_contention(e):
+                raise
+            _count_retry()
+            delay = min(1.0, 0.01 * 2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f"Commit lost to a concurrent writer ({e.orig}), retrying in {delay:.3f}s")
+            await asyncio.sleep(delay)
 
-Base = declarative_base()
\ No newline at end of file
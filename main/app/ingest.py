@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import zipfile
+import zlib
+from pathlib import Path, PurePosixPath
+from threading import Lock
+from typing import AsyncIterator, BinaryIO, List, NamedTuple, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from magic import Magic
+
+from .config import UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, BATCH_MAX_FILES
+from .metrics import UPLOAD_BYTES, UPLOAD_INGEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# enough of the header for libmagic to tell PDF/JPEG/PNG apart
+SNIFF_BYTES = 2048
+
+# accepted types and the suffix the stored original gets; clean_up picks
+# the PDF or image branch by suffix
+ALLOWED_TYPES = {
+    "application/pdf": ".pdf",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+}
+
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+
+# opening a handle loads the whole magic database, so it is done once per
+# process; libmagic handles aren't thread safe, hence the lock
+_magic = Magic(mime=True)
+_magic_lock = Lock()
+
+
+class IngestedFile(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+    mime: str
+
+
+def sniff_mime(header: bytes) -> str:
+    with _magic_lock:
+        return _magic.from_buffer(header)
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File size exceeds {max_size / (1024 * 1024):g}mb limit"
+    )
+
+
+def store_upload(source: BinaryIO, dest_dir: Path, max_size: int = UPLOAD_MAX_BYTES) -> IngestedFile:
+    """Sniffs, hashes and copies an upload to `dest_dir/<uuid><suffix>` in one pass.
+
+    Blocking, meant to run in a worker thread. The partial file is removed if
+    the upload turns out too large or the copy fails.
+    """
+    header = source.read(SNIFF_BYTES)
+    mime = sniff_mime(header)
+    if mime not in ALLOWED_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload a valid file")
+
+    # named by us, not by the client: two users uploading "score.pdf" no
+    # longer overwrite each other's original
+    path = dest_dir / f"{uuid4().hex}{ALLOWED_TYPES[mime]}"
+    hasher = hashlib.sha256(header)
+    size = len(header)
+    try:
+        with open(path, "wb") as buffer:
+            buffer.write(header)
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise _too_large(max_size)
+                hasher.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+    return IngestedFile(path=path, size=size, sha256=hasher.hexdigest(), mime=mime)
+
+
+async def ingest_upload(file: UploadFile, dest_dir: Path, max_size: Optional[int] = None) -> IngestedFile:
+    """Stores an UploadFile without blocking the event loop."""
+    max_size = max_size or UPLOAD_MAX_BYTES
+    # the multipart parser already knows the size, no need to copy 10mb to find out
+    if file.size is not None and file.size > max_size:
+        raise _too_large(max_size)
+
+    await file.seek(0)
+    with UPLOAD_INGEST_SECONDS.time():
+        ingested = await run_in_threadpool(store_upload, file.file, dest_dir, max_size)
+    UPLOAD_BYTES.observe(ingested.size)
+    logger.info(f"Stored upload {file.filename} as {ingested.path.name} ({ingested.mime}, {ingested.size} bytes)")
+    return ingested
+
+
+class BatchMember(NamedTuple):
+    """One file of a batch: stored in `ingested`, or why it wasn't in `error`."""
+    name: str
+    ingested: Optional[IngestedFile]
+    error: Optional[str]
+
+
+def _skip_member(info: zipfile.ZipInfo) -> bool:
+    # directories, and what archivers add next to the files (__MACOSX, .DS_Store)
+    parts = PurePosixPath(info.filename).parts
+    return info.is_dir() or not parts or parts[0] == "__MACOSX" or parts[-1].startswith(".")
+
+
+def _store_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, dest_dir: Path, max_size: int) -> IngestedFile:
+    # the declared size can lie, store_upload counts what actually comes out
+    if info.file_size > max_size:
+        raise _too_large(max_size)
+    with archive.open(info) as member:
+        return store_upload(member, dest_dir, max_size)
+
+
+async def ingest_batch(
+    files: List[UploadFile], dest_dir: Path, max_files: int = BATCH_MAX_FILES
+) -> AsyncIterator[BatchMember]:
+    """Stores the files of a batch one at a time, each ZIP member as a file of its own.
+
+    Members are decompressed straight from the spooled upload into their own
+    file, the archive is never extracted as a whole; the caller is expected
+    to move each one on before asking for the next. Files that can't be
+    taken come back with an error instead of failing the batch.
+    """
+    count = 0
+    for file in files:
+        await file.seek(0)
+        header = await file.read(SNIFF_BYTES)
+        await file.seek(0)
+        if sniff_mime(header) not in ZIP_TYPES:
+            count += 1
+            if count > max_files:
+                yield BatchMember(file.filename, None, f"More than {max_files} files in the batch")
+                continue
+            try:
+                yield BatchMember(file.filename, await ingest_upload(file, dest_dir), None)
+            except HTTPException as e:
+                yield BatchMember(file.filename, None, e.detail)
+            continue
+
+        try:
+            archive = await run_in_threadpool(zipfile.ZipFile, file.file)
+        except zipfile.BadZipFile as e:
+            yield BatchMember(file.filename, None, f"Not a readable ZIP archive ({e})")
+            continue
+        with archive:
+            for info in archive.infolist():
+                if _skip_member(info):
+                    continue
+                name = f"{file.filename}/{info.filename}"
+                count += 1
+                if count > max_files:
+                    yield BatchMember(name, None, f"More than {max_files} files in the batch")
+                    continue
+                try:
+                    with UPLOAD_INGEST_SECONDS.time():
+                        ingested = await run_in_threadpool(_store_member, archive, info, dest_dir, UPLOAD_MAX_BYTES)
+                except HTTPException as e:
+                    yield BatchMember(name, None, e.detail)
+                    continue
+                # encrypted members, unsupported compression, corrupt data
+                except (RuntimeError, NotImplementedError, zipfile.BadZipFile, zlib.error, EOFError) as e:
+                    yield BatchMember(name, None, f"Could not read from the archive ({e})")
+                    continue
+                UPLOAD_BYTES.observe(ingested.size)
+                logger.info(f"Stored archive member {name} as {ingested.path.name} ({ingested.mime}, {ingested.size} bytes)")
+                yield BatchMember(name, ingested, None)
+
+
+class BodySizeLimit:
+    """ASGI middleware holding the request bodies of `paths` to `max_bytes`.
+
+    The form parser spools every file of a request before the endpoint runs,
+    so a limit checked there only comes after the whole body was written to
+    disk. This answers 413 on the Content-Length before anything is read,
+    and counts the body as it streams in for requests that don't send one.
+    """
+    def __init__(self, app, paths: List[str], max_bytes: int, detail: str):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=self.detail)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse({"detail": too_large.detail}, status_code=too_large.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                # raised in the middle of parsing the form, answered by the
+                # app's HTTPException handler
+                if received > self.max_bytes:
+                    raise too_large
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,120 @@
+from typing import NamedTuple, Optional, Tuple
+
+import cv2
+import fitz
+import numpy as np
+
+from .config import TARGET_INTERLINE, INTERLINE_PROBE_DPI, RENDER_DPI_MIN, RENDER_DPI_MAX
+
+# Audiveris reads a score by its interline, the distance from one staff line
+# to the next, and works best with it around TARGET_INTERLINE pixels. At a
+# fixed dpi a large-format score comes out with far more pixels than it needs
+# and a miniature score with too few, so each page is measured on a quick
+# render first and then rendered at the dpi that hits the target.
+
+# Audiveris rasterizes PDF input at a fixed 300 dpi, whatever resolution the
+# page's image has. Cleaned pages are given the size in points that makes
+# that render land on the image's own pixels, so Audiveris sees the
+# interline a page was rendered for
+AUDIVERIS_PDF_DPI = 300
+
+# every this many columns of the probe render is scanned for runs, more on
+# larger images so no more than MAX_COLUMNS are
+COLUMN_STEP = 2
+MAX_COLUMNS = 500
+# at least this many staff line pairs, and this share of them within a pixel
+# of the most common spacing, or the page has no staves to go by
+MIN_LINE_PAIRS = 50
+MIN_MODE_SHARE = 0.3
+
+# a rendered page whose interline is further than this share from
+# TARGET_INTERLINE is rendered once more; a PDF handed to Audiveris as it is
+# gets AUDIVERIS_PDF_DPI, so clean vector PDFs are only passed through when
+# that is within this share of what their pages want
+INTERLINE_TOLERANCE = 0.15
+
+
+class StaffScale(NamedTuple):
+    line_thickness: int  # pixels, most common vertical black run
+    interline: float  # pixels from one staff line to the next
+    pairs: int  # line pairs measured
+
+
+def measure_staff_scale(image: np.ndarray) -> Optional[StaffScale]:
+    """Staff line thickness and interline of a grayscale page from vertical run lengths.
+
+    Scans columns for runs of ink. Staff lines are the most common black
+    run, and the distance from the start of one such run to the start of the
+    next in the same column is most often the interline (note heads, stems
+    and text give runs too, but fewer and of every length). The interline is
+    interpolated between the histogram bins around the mode, so it is finer
+    than a pixel even on a small render. None for pages without staves.
+    """
+    _, ink = cv2.threshold(image, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # one row per scanned column, padded with paper so every run ends
+    step = max(COLUMN_STEP, image.shape[1] // MAX_COLUMNS)
+    columns = np.pad(ink[:, ::step].T, ((0, 0), (1, 1))).astype(np.int8)
+    edges = np.diff(columns, axis=1)
+    column, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    if len(starts) < MIN_LINE_PAIRS:
+        return None
+
+    black = ends - starts
+    line_thickness = int(np.argmax(np.bincount(black)))
+    # consecutive runs in one column that are both line-thin
+    thin = black <= line_thickness + 1
+    pairs = (column[1:] == column[:-1]) & thin[1:] & thin[:-1]
+    periods = (starts[1:] - starts[:-1])[pairs]
+    if len(periods) < MIN_LINE_PAIRS:
+        return None
+
+    histogram = np.bincount(periods).astype(np.float64)
+    mode = int(np.argmax(histogram))
+    low, high = max(0, mode - 1), min(len(histogram), mode + 2)
+    near = histogram[low:high]
+    if mode <= line_thickness or near.sum() < MIN_MODE_SHARE * len(periods):
+        return None
+    interline = float(np.dot(np.arange(low, high), near) / near.sum())
+    return StaffScale(line_thickness, interline, int(len(periods)))
+
+
+class PageScale(NamedTuple):
+    dpi: int  # to render the page at
+    interline_pt: Optional[float]  # measured, in points; None without staves
+
+
+def render_dpi_for(interline: float, probe_dpi: int) -> int:
+    """The dpi that gives `interline` (measured at `probe_dpi`) TARGET_INTERLINE pixels."""
+    dpi = probe_dpi * TARGET_INTERLINE / interline
+    return int(round(min(RENDER_DPI_MAX, max(RENDER_DPI_MIN, dpi))))
+
+
+def probe_page(page: fitz.Page) -> Optional[StaffScale]:
+    """Measures a page's staves on an INTERLINE_PROBE_DPI render."""
+    pix = page.get_pixmap(dpi=INTERLINE_PROBE_DPI, colorspace=fitz.csGRAY, alpha=False)
+    image = np.ndarray((pix.height, pix.width), dtype=np.uint8, buffer=pix.samples_mv, strides=(pix.stride, 1))
+    return measure_staff_scale(image)
+
+
+def page_scale(page: fitz.Page, default_dpi: int) -> PageScale:
+    """The dpi to render a PDF page at, `default_dpi` when it has no measurable staves."""
+    if not TARGET_INTERLINE:
+        return PageScale(default_dpi, None)
+    staff_scale = probe_page(page)
+    if staff_scale is None:
+        return PageScale(default_dpi, None)
+    return PageScale(
+        render_dpi_for(staff_scale.interline, INTERLINE_PROBE_DPI),
+        round(staff_scale.interline * 72 / INTERLINE_PROBE_DPI, 2),
+    )
+
+
+def in_target_band(interline: float) -> bool:
+    return abs(interline - TARGET_INTERLINE) <= INTERLINE_TOLERANCE * TARGET_INTERLINE
+
+
+def page_size_pt(image: np.ndarray) -> Tuple[float, float]:
+    """Page size for a cleaned image, so Audiveris renders it at one pixel per pixel."""
+    height, width = image.shape
+    return width * 72 / AUDIVERIS_PDF_DPI, height * 72 / AUDIVERIS_PDF_DPI
@@ -0,0 +1,325 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, commit_with_retry
+from .models import Job, JobStatus, utcnow
+from .config import (
+    DATA_DIR, AUDIVERIS_MODE, JOB_POLL_INTERVAL, JOB_MAX_ATTEMPTS, JOB_HEARTBEAT_INTERVAL, JOB_HEARTBEAT_TIMEOUT,
+)
+from .scheduler import current_plan
+from .metrics import CONVERSIONS_IN_FLIGHT, process_exited
+from .processes import OwnerLock, lead_process_group, parent_alive, stop_on_sigterm, stop_process_group
+
+logger = logging.getLogger(__name__)
+
+# held by the process running the job workers: with several uvicorn workers
+# (or a `python -m app.jobs` next to them) only one of them runs them
+RUNNER_LOCK = DATA_DIR / "job_runner.lock"
+
+
+def requeue_interrupted_jobs(stale_after: float = JOB_HEARTBEAT_TIMEOUT) -> int:
+    """Puts jobs whose worker is gone back on the queue.
+
+    A job is in flight as long as its worker keeps the heartbeat going; one
+    without a heartbeat for `stale_after` seconds lost it (the worker was
+    killed, or the server stopped). Jobs other workers are still running
+    are left alone. Jobs that already used up JOB_MAX_ATTEMPTS are marked
+    failed instead, so a score that keeps killing its worker doesn't loop
+    forever.
+    """
+    def requeue(db: Session) -> list:
+        cutoff = utcnow() - timedelta(seconds=stale_after)
+        jobs = (
+            db.query(Job)
+            .filter(Job.status.in_(JobStatus.IN_FLIGHT))
+            .filter(or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < cutoff))
+            .all()
+        )
+        for job in jobs:
+            if job.attempts >= JOB_MAX_ATTEMPTS:
+                job.status = JobStatus.FAILED
+                job.error = f"Interrupted {job.attempts} times, giving up"
+            else:
+                job.status = JobStatus.QUEUED
+            if job.score is not None:
+                job.score.status = job.status
+        return jobs
+
+    with SessionLocal() as db:
+        jobs = commit_with_retry(db, lambda: requeue(db))
+        if jobs:
+            logger.warning(f"Recovered {len(jobs)} interrupted job(s)")
+        return len(jobs)
+
+
+def claim_next_job() -> Optional[int]:
+    # the conditional UPDATE is what makes the claim atomic: if another
+    # worker grabbed the same row first, rowcount comes back 0 and we retry
+    with SessionLocal() as db:
+        while True:
+            candidate = (
+                db.query(Job.id)
+                .filter(Job.status == JobStatus.QUEUED)
+                .order_by(Job.id)
+                .first()
+            )
+            if candidate is None:
+                return None
+
+            claimed = commit_with_retry(db, lambda: (
+                db.query(Job)
+                .filter(Job.id == candidate.id, Job.status == JobStatus.QUEUED)
+                .update(
+                    {
+                        Job.status: JobStatus.CLEANING,
+                        Job.attempts: Job.attempts + 1,
+                        Job.heartbeat_at: utcnow(),
+                        Job.updated_at: utcnow(),
+                    },
+                    synchronize_session=False,
+                )
+            ))
+            if claimed:
+                return candidate.id
+
+
+class Heartbeat:
+    """Marks a job alive every `interval` seconds from a thread, while the worker runs it.
+
+    A thread of its own, with its own session, so the mark keeps coming
+    through OpenCV and Audiveris runs that hold up the worker for minutes.
+    """
+    def __init__(self, job_id: int, interval: float = JOB_HEARTBEAT_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job_id}", daemon=True)
+
+    def _run(self):
+        with SessionLocal() as db:
+            while not self._stop.wait(self.interval):
+                try:
+                    commit_with_retry(db, lambda: (
+                        db.query(Job)
+                        .filter(Job.id == self.job_id)
+                        .update({Job.heartbeat_at: utcnow()}, synchronize_session=False)
+                    ))
+                except Exception:
+                    # a missed mark or two is fine, the timeout is several intervals
+                    logger.exception(f"Job {self.job_id}: heartbeat failed")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _set_status(job: Job, db: Session, status: str, error: Optional[str] = None):
+    # the score mirrors its job, so the listing can filter and sort without a join
+    def apply():
+        job.status = status
+        job.score.status = status
+        job.error = error
+
+    commit_with_retry(db, apply)
+
+
+def run_job(job_id: int):
+    # imported here so the web process never loads OpenCV/Audiveris through this module
+    from .pipeline import clean_up, convert_to_musicxml
+    from .cache import remember_result
+    from .checkpoints import resume_stage
+
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        score = job.score
+        # clean_up and convert_to_musicxml skip what an earlier job checkpointed
+        logger.info(
+            f"Job {job.id}: processing score {score.id} (attempt {job.attempts}), "
+            f"from stage {resume_stage(score) or 'export'}"
+        )
+        # the claim only touched the job row
+        commit_with_retry(db, lambda: setattr(score, "status", job.status))
+        try:
+            with CONVERSIONS_IN_FLIGHT.labels(stage="cleaning").track_inprogress():
+                clean_up(score, db)
+            _set_status(job, db, JobStatus.CONVERTING)
+
+            sheets = {}
+
+            def report_progress(step: str, sheet: Optional[int]):
+                sheets["book" if sheet is None else str(sheet)] = step
+                progress = {"step": step, "sheet": sheet, "sheets": dict(sheets)}
+                commit_with_retry(db, lambda: setattr(job, "progress", progress))
+
+            with CONVERSIONS_IN_FLIGHT.labels(stage="converting").track_inprogress():
+                convert_to_musicxml(score, db, on_progress=report_progress)
+            _set_status(job, db, JobStatus.DONE)
+            logger.info(f"Job {job.id}: done")
+        except Exception as e:
+            db.rollback()
+            cause = e.__cause__ or e
+            logger.error(f"Job {job.id} failed: {cause}")
+            _set_status(job, db, JobStatus.FAILED, error=str(cause)[:2000])
+            return
+
+        # the conversion stands without its cache entry, the next identical
+        # upload just converts again
+        try:
+            remember_result(score, db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Job {job.id}: could not cache the result of score {score.id}: {e}")
+
+
+def _worker_main(poll_interval: float, parent_pid: int):
+    lead_process_group()
+    stop_event = stop_on_sigterm()
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    # a runner that was killed outright can't stop us; the job we are on is
+    # finished, then whoever holds the lock next takes over the queue
+    while not stop_event.is_set() and parent_alive(parent_pid):
+        try:
+            job_id = claim_next_job()
+            if job_id is None:
+                stop_event.wait(poll_interval)
+                continue
+            with Heartbeat(job_id):
+                run_job(job_id)
+        except Exception:
+            # the job or score vanished, or even recording the failure didn't
+            # get through; the worker carries on, a job left in flight is
+            # requeued once its heartbeat is stale
+            logger.exception("Job worker: unexpected error, continuing")
+            stop_event.wait(poll_interval)
+
+
+class JobRunner:
+    """Pool of worker processes draining the jobs table.
+
+    Workers are spawned (not forked) so each gets its own DB engine, and are
+    not daemonic so they may run their own process pools. One worker runs one
+    conversion, so by default there are as many as the memory budget has
+    conversion slots.
+
+    Only the process holding RUNNER_LOCK runs workers; start() in any other
+    returns False and does nothing. The owner also requeues the jobs of
+    workers that died and starts new workers in their place, every
+    JOB_HEARTBEAT_INTERVAL, and with
+    AUDIVERIS_MODE=pool runs the pool its workers submit to.
+    """
+    def __init__(self, workers: Optional[int] = None, poll_interval: float = JOB_POLL_INTERVAL):
+        # sized by the owner in start(): the budget is the container's, and
+        # only one process per container runs workers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._ctx = multiprocessing.get_context("spawn")
+        # stops the monitor; workers are asked to stop with SIGTERM
+        self._stop_event = threading.Event()
+        self._processes = []
+        self._lock = OwnerLock(RUNNER_LOCK)
+        self._monitor = None
+        self._pool = None
+
+    def start(self) -> bool:
+        if not self._lock.acquire():
+            logger.info(f"Job workers run in process {self.owner()}, not starting any here")
+            return False
+        self.workers = self.workers or current_plan().slots
+        if AUDIVERIS_MODE == "pool":
+            from .audiveris_pool import AudiverisPool
+            self._pool = AudiverisPool()
+            self._pool.start()
+        requeue_interrupted_jobs()
+        self._processes = [self._spawn(i) for i in range(self.workers)]
+        self._monitor = threading.Thread(target=self._watch, name="job-monitor", daemon=True)
+        self._monitor.start()
+        logger.info(f"Started {self.workers} job worker(s)")
+        return True
+
+    def owner(self) -> Optional[int]:
+        """Pid of the process running the workers."""
+        return self._lock.owner()
+
+    def _spawn(self, i: int):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.poll_interval, os.getpid()),
+            name=f"job-worker-{i}",
+        )
+        process.start()
+        return process
+
+    def _respawn_dead(self):
+        for i, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            logger.warning(f"{process.name} exited with code {process.exitcode}, starting a new one")
+            # along with anything it left running in its group (a JVM)
+            stop_process_group(process, 0)
+            process_exited(process.pid)
+            self._processes[i] = self._spawn(i)
+
+    def _watch(self):
+        while not self._stop_event.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                self._respawn_dead()
+                requeue_interrupted_jobs()
+            except Exception:
+                logger.exception("Job monitor: unexpected error, continuing")
+
+    def stop(self, timeout: float = 10.0):
+        if not self._processes:
+            return
+        self._stop_event.set()
+        self._monitor.join()
+        for process in self._processes:
+            # finishes the job it is on, if that takes less than `timeout`
+            process.terminate()
+        for process in self._processes:
+            # a worker stuck in a long Audiveris run is killed, together with
+            # the JVM; its heartbeat stops and the job is requeued by the
+            # next runner once JOB_HEARTBEAT_TIMEOUT has passed
+            stop_process_group(process, timeout)
+            process_exited(process.pid)
+        self._processes = []
+        if self._pool:
+            self._pool.stop()
+            self._pool = None
+        self._lock.release()
+
+
+def main():
+    """Runs the job workers on their own, for JOB_RUNNER=external."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    runner = JobRunner()
+    if not runner.start():
+        raise SystemExit(f"Another process ({runner.owner()}) already runs the job workers")
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopped.set())
+    stopped.wait()
+    runner.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+from .models import Score
+
+# Keyset pagination for the scores listing: newest first, ordered by
+# (created_at, id) so ties on the timestamp still page deterministically. A
+# cursor is the key of the last row of a page; the next page starts strictly
+# after it, so pages stay stable while new scores are uploaded and the cost of
+# a page doesn't grow with how deep it is.
+
+LISTING_ORDER = (Score.created_at.desc(), Score.id.desc())
+
+
+def encode_cursor(created_at: datetime, score_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{score_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, score_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(score_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def page_filters(user_id: Optional[int] = None,
+                 score_status: Optional[str] = None,
+                 cursor: Optional[str] = None) -> list:
+    """WHERE clauses for one page, each backed by one of the scores indexes."""
+    filters = []
+    if user_id is not None:
+        filters.append(Score.user_id == user_id)
+    if score_status is not None:
+        filters.append(Score.status == score_status)
+    if cursor:
+        created_at, score_id = decode_cursor(cursor)
+        filters.append(tuple_(Score.created_at, Score.id) < (created_at, score_id))
+    return filters
+
+
+def split_page(rows: list, limit: int) -> Tuple[list, Optional[str]]:
+    """Rows fetched with limit + 1 -> the page and the cursor to the next one."""
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.created_at, last.id)
@@ -6,46 +6,70 @@ logging.basicConfig(
     datefmt="%H:%M:%S" 
 )
 
-from fastapi import FastAPI, File, UploadFile, Request, HTTPException, Depends, status, Form
+from fastapi import FastAPI, File, UploadFile, Request, HTTPException, Depends, status, Form, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.requests import Request
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import Response, RedirectResponse, FileResponse
+from fastapi.responses import Response, RedirectResponse, FileResponse, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 
-from sqlalchemy.orm import Session, joinedload
-from .database import SessionLocal, engine
-from .models import User, Score
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, load_only
+from .database import AsyncSessionLocal, async_engine, commit_with_retry_async
+from .models import User, Score, ScoreProfile, Job, JobStatus, Batch
+from typing import List, Optional, Tuple
 
 from pydantic import BaseModel
 
 # aux locally created functions
-from .auth_utils import verify_password, create_access_token ,decode_access_token, JWTError, hash_password
-from .helpers import validate_file
-from .audiveris import AudiverisConverter
-
-import cv2
-import numpy as np
-import fitz
+from .auth_utils import verify_password, create_access_token, hash_password
+from .auth_cache import token_user_id, load_user, revoke_token
+from .ingest import IngestedFile, BodySizeLimit, ingest_upload, ingest_batch
+from .jobs import JobRunner
+from .cache import make_cache_key, lookup_result
+from .scheduler import admission_retry_after
+from .listing import LISTING_ORDER, page_filters, split_page
+from .outputs import locate_output, describe_output, set_output, copy_output, output_is_current, parse_range, etag, etag_matches, last_modified, unmodified_since
+from .storage import get_storage
+from .checkpoints import set_checkpoint, resume_stage
+from .metrics import REQUEST_SECONDS, counter_totals, render_metrics
+from .config import DATA_DIR, UPLOAD_DIR, BATCH_MAX_BYTES, WORK_DIR, STATIC_DIR, TEMPLATES_DIR, JOB_RUNNER
 
 #way to save data files to separate dir
 from pathlib import Path
+import asyncio
+import json
+from time import perf_counter
 
-
-BASE_DIR = Path(__file__).parent.parent 
-DATA_DIR = BASE_DIR / "data"
-STATIC_DIR = BASE_DIR / "static"
-TEMPLATES_DIR = BASE_DIR / "templates"
+logger = logging.getLogger(__name__)
 
 DATA_DIR.mkdir(exist_ok=True)
-(DATA_DIR / "originals").mkdir(exist_ok=True, parents=True)
-(DATA_DIR / "processed").mkdir(exist_ok=True, parents=True)
-(DATA_DIR / "xmlmusic").mkdir(exist_ok=True, parents=True)
+# scratch space only, the artifacts themselves are in storage (storage.py)
+UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
+WORK_DIR.mkdir(exist_ok=True, parents=True)
+
+
+# clean_up and convert_to_musicxml run in background worker processes,
+# started and stopped with the app; with several server workers only the
+# first to start runs them (JOB_RUNNER=external leaves it to `python -m app.jobs`)
+# (and with them the Audiveris pool, AUDIVERIS_MODE=pool)
+job_runner = JobRunner() if JOB_RUNNER == "embedded" else None
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if job_runner:
+        job_runner.start()
+    yield
+    if job_runner:
+        job_runner.stop()
+    # closes the pooled aiosqlite connections, whose threads would keep the process alive
+    await async_engine.dispose()
 
-app = FastAPI()
 
-converter = AudiverisConverter()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -55,39 +79,68 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+# turns an oversized batch away before it is spooled; the multipart framing
+# counts towards the body, so it gets a megabyte on top of the files' limit
+app.add_middleware(
+    BodySizeLimit,
+    paths=["/upload_batch/"],
+    max_bytes=BATCH_MAX_BYTES + 1024 * 1024,
+    detail=f"Batch exceeds {BATCH_MAX_BYTES / (1024 * 1024):g}mb limit",
+)
+
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
-app.mount("/data", StaticFiles(directory=DATA_DIR), name="data")
 
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
 
-
-#get DB session
-def get_db():
-    db = SessionLocal()
+# latency per route template (not per raw path, ids would blow up the label
+# set); streaming responses count until their headers go out, unhandled
+# errors as 500
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = perf_counter()
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
     try:
-        yield db
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
     finally:
-        db.close()
+        # mounts (/static) leave no route, only their prefix in root_path
+        route = getattr(request.scope.get("route"), "path", None) or request.scope.get("root_path")
+        REQUEST_SECONDS.labels(
+            method=request.method,
+            route=route or "unmatched",
+            status=status_code,
+        ).observe(perf_counter() - started)
+
+
+#get DB session; async, so queries don't hold up the event loop (the job
+# workers and Alembic keep the sync SessionLocal)
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
         
 # docker health check func
 @app.get("/health")
 async def health_check():
     return {"status": "Healthy"}
+
+# prometheus scrape target, adds up the samples of the web process and all
+# the conversion workers
+@app.get("/metrics")
+def metrics():
+    data, content_type = render_metrics()
+    return Response(content=data, media_type=content_type)
         
 # funnction to inject user for jinja templating and check for authorization of user
-async def get_current_user(request: Request, db: Session = Depends(get_db)):   
+# decoded tokens and user rows come from a short lived per-process cache, see auth_cache.py
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):   
+    user = None
     token = request.cookies.get("access_token")
     if token:
-        try: 
-            token = token.replace("Bearer ", "")
-            payload = decode_access_token(token)
-            print(f"Decoded payload: {payload}")
-            user_id = int(payload.get("sub"))
-            user = db.query(User).filter(User.id == user_id).first()
-            print(f"User fetched: {user}")
-        except JWTError:
-            pass
+        user_id = await token_user_id(token.replace("Bearer ", ""), db)
+        if user_id is not None:
+            user = await load_user(user_id, db)
         
     if not user:
         response = Response(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -138,20 +191,20 @@ def register_page(request: Request):
         "register.html", context={'request':request}                           
     ) 
 @app.post("/register")
-def register(request: Request, data: RegisterRequest = Depends(RegisterRequest.as_form), db: Session = Depends(get_db)):
+async def register(request: Request, data: RegisterRequest = Depends(RegisterRequest.as_form), db: AsyncSession = Depends(get_db)):
     if data.password != data.repeat_password:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Passwords do not match")
     if not data.username:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Please enter a username")
     
-    existing_user = db.query(User).filter(User.username == data.username).first()
+    existing_user = await db.scalar(select(User).where(User.username == data.username))
     if existing_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already exists")
     
-    hashed_password = hash_password(data.password)
+    # bcrypt is slow on purpose, keep it off the event loop
+    hashed_password = await run_in_threadpool(hash_password, data.password)
     new_user = User(username=data.username, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
+    await commit_with_retry_async(db, lambda: db.add(new_user))
     
     return templates.TemplateResponse(
         "login.html", context={'request':request,
@@ -165,9 +218,9 @@ def login_page(request: Request):
         "login.html", context={'request':request}
     )
 @app.post("/login")
-def login(response: Response, request: Request, data: LoginRequest = Depends(LoginRequest.as_form), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data.username).first()
-    if not user or not verify_password(data.password, user.hashed_password):
+async def login(response: Response, request: Request, data: LoginRequest = Depends(LoginRequest.as_form), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == data.username))
+    if not user or not await run_in_threadpool(verify_password, data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail= "Invalid credentials")
         
     access_token = create_access_token(data={"sub": str(user.id)})
@@ -185,7 +238,10 @@ def login(response: Response, request: Request, data: LoginRequest = Depends(Log
     return response
 
 @app.get("/logout")
-def logout(response: Response, request: Request):
+async def logout(response: Response, request: Request, db: AsyncSession = Depends(get_db)):
+    token = request.cookies.get("access_token")
+    if token:
+        await revoke_token(token.replace("Bearer ", ""), db)
     response = RedirectResponse(
         url="/?message=You are now logged out",
         status_code=status.HTTP_303_SEE_OTHER, 
@@ -219,326 +275,443 @@ async def upload_sheet_music_page(request: Request, user: User = Depends(get_cur
     return templates.TemplateResponse(
     "upload_sheet_music.html", context={'request':request}
     )
+def too_many_queued(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many scores waiting for conversion, try again later",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+# what follows the ingest of every uploaded file, single or in a batch: link
+# the cached result, or store the original and queue a job (None on a cache
+# hit). With `admit` a full queue turns the file away with a 429. Takes the
+# user's id, not the row: a caller's rollback expires the row, and reading
+# it again would mean a lazy load, which an AsyncSession can't do
+async def queue_score(ingested: IngestedFile, user_id: int, db: AsyncSession,
+                      batch_id: Optional[int] = None, admit: bool = True) -> Tuple[Score, Optional[Job]]:
+    cache_key = make_cache_key(ingested.sha256)
+    
+    # identical bytes already went through the same pipeline: link the
+    # existing artifacts instead of running OpenCV and Audiveris again
+    cached = await lookup_result(cache_key, db)
+    # workers take jobs at the pace the memory budget allows; past
+    # JOB_QUEUE_LIMIT waiting jobs tell the client when to come back; the
+    # admission helper is shared with sync code, run_sync hands it the
+    # session's sync side
+    retry_after = None if cached or not admit else await db.run_sync(admission_retry_after)
+    if retry_after:
+        ingested.path.unlink(missing_ok=True)
+        raise too_many_queued(retry_after)
+    
+    # stored under its hash, so the same bytes uploaded twice are kept once
+    original_key = await run_in_threadpool(
+        get_storage().put_file, ingested.path, "originals", ingested.sha256
+    )
+    new_score = Score(original_path=original_key, user_id=user_id, cache_key=cache_key, batch_id=batch_id)
+    set_checkpoint(new_score, "ingest", original=original_key, sha256=ingested.sha256, bytes=ingested.size)
+    if cached:
+        new_score.processed_path = cached.processed_path
+        new_score.xmlmusic_path = cached.xmlmusic_path
+        new_score.status = JobStatus.DONE
+        # lookup_result only returns entries whose score still exists
+        copy_output(new_score, await db.get(Score, cached.score_id))
+        await commit_with_retry_async(db, lambda: db.add(new_score))
+        return new_score, None
+    
+    # one commit, so there's never a queued score without its job
+    job = Job(score=new_score, status=JobStatus.QUEUED)
+    await commit_with_retry_async(db, lambda: db.add_all([new_score, job]))
+    return new_score, job
+
 @app.post("/upload_sheet_music/")
 async def upload_sheet_music(request: Request, 
                              user: User = Depends(get_current_user),
-                             db: Session = Depends(get_db), 
+                             db: AsyncSession = Depends(get_db), 
                              file: UploadFile = File(...)):
     
-    MAX_FILE_SIZE = 10 * 1024 * 1024
-    
   #  if user is None:
    #     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not authenticated")
     
     try:
-        print(f"Received file: {file.filename}, type: {file.content_type}, size: {file.size}")
+        logger.debug(f"Received file: {file.filename}, type: {file.content_type}, size: {file.size}")
     
-        file_type = await validate_file(file)
-        
-        if file_type not in ["application/pdf", "image/jpeg", "image/jpg", "image/png"]:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail= "Upload a valid file")
+        # type check, size limit, sha256 and the copy to disk all happen in a
+        # worker thread so other requests keep being served meanwhile
+        ingested = await ingest_upload(file, UPLOAD_DIR)
         
-        file_size = 0
-        file_location = DATA_DIR / "originals" / file.filename
-        with open(file_location, "wb") as buffer:
-            while chunk := await file.read(1024):
-                file_size += len(chunk)
-                if file_size > MAX_FILE_SIZE:
-                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail= "File size exceeds 10mb limit")
-                buffer.write(chunk)
-                    
         try:
-            file_location = str(file_location)
-            new_score = Score(original_path=file_location, user_id=user.id)
-            db.add(new_score)
-            db.commit()
-            db.refresh(new_score)
-            db.flush
+            new_score, job = await queue_score(ingested, user.id, db)
+            if job is None:
+                return {
+                    "message": "File already converted, reusing the previous result",
+                    "score_id": new_score.id,
+                    "cached": True,
+                }
+        except HTTPException:
+            raise
         except Exception as e:
-            db.rollback()
-            print(f"Error during commit {e}")
+            await db.rollback()
+            # still in the upload dir if it never made it into storage
+            ingested.path.unlink(missing_ok=True)
+            logger.exception(f"Error during commit {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"An error accurred while saving to the database: {str(e)}"
             )
-        clean_up(new_score, db)
-        
-        convert_to_musicxml(new_score, db)  
                 
-        return {"message": "File processed and converted successfully"}
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={
+                "message": f"File uploaded, conversion queued (job {job.id})",
+                "job_id": job.id,
+                "score_id": new_score.id,
+                "cached": False,
+            }
+        )
         
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Unexpected error: {e}")
-        db.rollback()
+        logger.exception(f"Unexpected error: {e}")
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail=f"An unexpected error occured: {str(e)}"
             )
+
+# a collection in one request: several files and/or ZIP archives, each file
+# and archive member queued as a score of its own. The queue is checked once
+# for the whole batch, and files that can't be taken are listed instead of
+# failing the rest. Progress is at /batches/{id}
+@app.post("/upload_batch/")
+async def upload_batch(user: User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_db),
+                       files: List[UploadFile] = File(...)):
+    # BodySizeLimit already stopped bodies well past the limit; the parser
+    # has spooled the files, so their sizes are known without reading
+    if sum(file.size or 0 for file in files) > BATCH_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch exceeds {BATCH_MAX_BYTES / (1024 * 1024):g}mb limit"
+        )
+    retry_after = await db.run_sync(admission_retry_after)
+    if retry_after:
+        raise too_many_queued(retry_after)
+    
+    # the rollback after a member that fails expires `user`
+    user_id = user.id
+    batch_id = None
+    scores, rejected = [], []
+    # one member on disk at a time: each is stored and queued before the next is read
+    async for member in ingest_batch(files, UPLOAD_DIR):
+        if member.error:
+            rejected.append({"name": member.name, "detail": member.error})
+            continue
+        try:
+            # created with the first file that makes it, none when all are rejected
+            if batch_id is None:
+                batch = Batch(user_id=user_id, rejected=[])
+                await commit_with_retry_async(db, lambda: db.add(batch))
+                batch_id = batch.id
+            score, job = await queue_score(member.ingested, user_id, db, batch_id=batch_id, admit=False)
+        except Exception as e:
+            await db.rollback()
+            member.ingested.path.unlink(missing_ok=True)
+            logger.error(f"Could not queue {member.name} of batch {batch_id}: {e}")
+            rejected.append({"name": member.name, "detail": "Could not be saved"})
+            continue
+        scores.append({
+            "name": member.name,
+            "score_id": score.id,
+            "job_id": job and job.id,
+            "cached": job is None,
+        })
+    
+    if not scores:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "No file in the batch could be queued", "rejected": rejected}
+        )
+    if rejected:
+        batch = await db.get(Batch, batch_id)
+        await commit_with_retry_async(db, lambda: setattr(batch, "rejected", rejected))
+    
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "message": f"{len(scores)} files queued, {len(rejected)} rejected",
+            "batch_id": batch_id,
+            "progress_url": f"/batches/{batch_id}",
+            "scores": scores,
+            "rejected": rejected,
+        }
+    )
+
+# aggregate progress of a batch: how many of its scores are in each status,
+# and the share that's finished (done or failed)
+@app.get("/batches/{batch_id}")
+async def batch_status(batch_id: int,
+                       user: User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_db)):
+    batch = await db.get(Batch, batch_id)
+    if not batch or batch.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+    
+    rows = (await db.execute(
+        select(Score.id, Score.status).where(Score.batch_id == batch_id).order_by(Score.id)
+    )).all()
+    counts = {state: 0 for state in (JobStatus.QUEUED, *JobStatus.IN_FLIGHT, JobStatus.DONE, JobStatus.FAILED)}
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+    finished = counts[JobStatus.DONE] + counts[JobStatus.FAILED]
+    return {
+        "id": batch.id,
+        "created_at": batch.created_at.isoformat(),
+        "total": len(rows),
+        "counts": counts,
+        "finished": finished,
+        "progress": round(finished / len(rows), 3) if rows else 1.0,
+        "rejected": batch.rejected,
+        "scores": [
+            {"id": row.id, "status": row.status, "download_url": f"/download/{row.id}" if row.status == JobStatus.DONE else None}
+            for row in rows
+        ],
+    }
+
+# queues a failed score again; the job starts at the first stage that has no
+# checkpoint, so e.g. a crashed Audiveris run doesn't redo the cleanup. A POST:
+# the SameSite=Lax cookie isn't sent with one from another site, so a link
+# or image elsewhere can't queue work in the user's name
+@app.post("/continue_processing/{score_id}")
+async def continue_processing(score_id: int,
+                              user: User = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_db)):
+    score = await db.get(Score, score_id)
+    if not score or score.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Score not found")
+    if score.status != JobStatus.FAILED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Score is {score.status}, only failed scores can be continued"
+        )
+    retry_after = await db.run_sync(admission_retry_after)
+    if retry_after:
+        raise too_many_queued(retry_after)
+    
+    job = Job(score_id=score.id, status=JobStatus.QUEUED)
+    def apply():
+        score.status = JobStatus.QUEUED
+        db.add(job)
+    await commit_with_retry_async(db, apply)
+    logger.info(f"Score {score.id} continued as job {job.id}, from stage {resume_stage(score) or 'export'}")
+    return RedirectResponse(url="/scores/?mine=true", status_code=status.HTTP_303_SEE_OTHER)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: int, 
+                     user: User = Depends(get_current_user), 
+                     db: AsyncSession = Depends(get_db)):
+    job = await db.scalar(select(Job).options(joinedload(Job.score)).where(Job.id == job_id))
+    if not job or job.score.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return {
+        "id": job.id,
+        "score_id": job.score_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+PROGRESS_POLL_INTERVAL = 1.0
+
+async def latest_job_snapshot(score_id: int):
+    async with AsyncSessionLocal() as db:
+        job = await db.scalar(select(Job).where(Job.score_id == score_id).order_by(Job.id.desc()).limit(1))
+        if not job:
+            return None
+        return {"job_id": job.id, "status": job.status, "progress": job.progress, "error": job.error}
+
+# server-sent events with the conversion progress of a score. The job worker
+# writes each Audiveris step change to the jobs table; this pushes it on as
+# soon as it lands, so the page doesn't have to poll /jobs/{id}
+@app.get("/scores/{score_id}/progress")
+async def score_progress(score_id: int,
+                         request: Request,
+                         user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_db)):
+    score = await db.get(Score, score_id)
+    if not score or score.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Score not found")
+    
+    async def events():
+        last = None
+        while not await request.is_disconnected():
+            snapshot = await latest_job_snapshot(score_id)
+            if snapshot != last:
+                yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+                last = snapshot
+            if snapshot is None or snapshot["status"] in (JobStatus.DONE, JobStatus.FAILED):
+                yield "event: end\ndata: {}\n\n"
+                return
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
         
+# what processing a score took: per page branch and timings, per stage wall
+# and cpu time, Audiveris runtime and memory, sizes
+@app.get("/scores/{score_id}/profile")
+async def score_profile(score_id: int,
+                        user: User = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_db)):
+    score = await db.get(Score, score_id)
+    if not score or score.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Score not found")
+    profile = await db.scalar(select(ScoreProfile).where(ScoreProfile.score_id == score_id))
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile for this score")
+    return profile.as_dict()
+
+# the result_cache_lookups counter of /metrics, added up over all processes
+@app.get("/cache/stats")
+async def result_cache_stats(user: User = Depends(get_current_user)):
+    totals = await run_in_threadpool(counter_totals, "result_cache_lookups", "outcome")
+    return {"hits": int(totals.get("hit", 0)), "misses": int(totals.get("miss", 0))}
+
+# both listings page by cursor, newest first, and take the same filters:
+# user_id (mine=true for the caller's own) and status
 @app.get("/scores/")
 async def upload_sheet_music_page(request: Request, 
+                                  mine: bool = False,
+                                  score_status: Optional[str] = Query(None, alias="status"),
+                                  cursor: Optional[str] = None,
+                                  limit: int = Query(50, ge=1, le=200),
                                   user: User = Depends(get_current_user), 
-                                  db: Session = Depends(get_db)):
-    scores = db.query(Score).options(joinedload(Score.user)).filter(Score.xmlmusic_path != None).all()
+                                  db: AsyncSession = Depends(get_db)):
+    # only what the table shows; the profile's per-page list and the
+    # checkpoints can be large and are left out
+    rows = (await db.scalars(
+        select(Score)
+        .options(
+            load_only(Score.id, Score.user_id, Score.xmlmusic_path, Score.status, Score.created_at),
+            joinedload(Score.user).load_only(User.username),
+            joinedload(Score.profile).load_only(
+                ScoreProfile.page_count, ScoreProfile.stages, ScoreProfile.audiveris_peak_rss_mb
+            ),
+        )
+        .where(*page_filters(user.id if mine else None, score_status, cursor))
+        .order_by(*LISTING_ORDER)
+        .limit(limit + 1)
+    )).all()
+    scores, next_cursor = split_page(rows, limit)
     return templates.TemplateResponse(
-        "scores.html", context={'request': request, "scores": scores}
+        "scores.html", context={'request': request, "user": user, "scores": scores, "next_cursor": next_cursor,
+                                "mine": mine, "status": score_status, "limit": limit}
     )
+
+# same listing as JSON, selecting only the columns it returns
+@app.get("/scores/list")
+async def list_scores(user_id: Optional[int] = None,
+                      mine: bool = False,
+                      score_status: Optional[str] = Query(None, alias="status"),
+                      cursor: Optional[str] = None,
+                      limit: int = Query(50, ge=1, le=200),
+                      user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_db)):
+    if mine:
+        user_id = user.id
+    rows = (await db.execute(
+        select(Score.id, Score.user_id, User.username, Score.status, Score.created_at)
+        .join(User, Score.user_id == User.id)
+        .where(*page_filters(user_id, score_status, cursor))
+        .order_by(*LISTING_ORDER)
+        .limit(limit + 1)
+    )).all()
+    page, next_cursor = split_page(rows, limit)
+    return {
+        "scores": [
+            {
+                "id": row.id,
+                "user_id": row.user_id,
+                "username": row.username,
+                "status": row.status,
+                "created_at": row.created_at.isoformat(),
+                "download_url": f"/download/{row.id}" if row.status == JobStatus.DONE else None,
+            }
+            for row in page
+        ],
+        "next_cursor": next_cursor,
+    }
               
+# served from what conversion recorded: a repeat download is one row and one
+# stat (or HEAD), a 304 when the client already has it, and byte ranges are
+# supported. The file is streamed in chunks from whichever storage holds it
 @app.get("/download/{score_id}")
-async def download_score(score_id: int, db: Session = Depends(get_db)):
-    score = db.query(Score).filter(Score.id == score_id).first()
+async def download_score(score_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    score = await db.get(Score, score_id)
     if not score or not score.xmlmusic_path:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Score file not found"
         )
-    conversion_dir = Path(score.xmlmusic_path)
     
-    if not conversion_dir.exists():
-        logging.critical(f"Missing conversion directory: {conversion_dir}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="Invalid conversion path configuration")
-        
-    canditate_files = sorted(
-        list(conversion_dir.glob("*.mxl")) + 
-        list(conversion_dir.glob("*.xml")),
-        key=lambda f: f.stat().st_mtime,
-        reverse=True
-    )
+    # converted before outputs were recorded, or the file changed since
+    if not await run_in_threadpool(output_is_current, score):
+        output_key = await run_in_threadpool(locate_output, score.xmlmusic_path)
+        if output_key is None:
+            logger.error(f"No stored output for score {score_id} at {score.xmlmusic_path}")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversion file missing"
+            )
+        output = await run_in_threadpool(describe_output, output_key)
+        await commit_with_retry_async(db, lambda: set_output(score, output))
     
-    if not canditate_files:
-        logging.error(f"No files in directory: {conversion_dir}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Conversion file missing"
-        )
+    headers = {
+        "ETag": etag(score),
+        "Last-Modified": last_modified(score),
+        # results can change when a score is processed again, so revalidate
+        "Cache-Control": "no-cache",
+    }
+    # If-Modified-Since only counts when there's no If-None-Match
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and etag_matches(if_none_match, score)) or \
+            (not if_none_match and if_modified_since and unmodified_since(if_modified_since, score)):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     
-    target_file = canditate_files[0]
-    if not target_file.is_file():
-        logging.error((f"Invalid file type: {target_file}"))
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Invalid conversion output"
-        )
-            
-    return FileResponse(
-        path=target_file,
-        filename=f"score_{score_id}.mxl",
-        media_type="application/vnd.recordare.musicxml"
-    )
-      
-#cleaning up the .pdf and .jpeg images using OpenCV library before proccessing further.
+    filename = f"score_{score_id}.mxl"
+    media_type = "application/vnd.recordare.musicxml"
+    storage = get_storage()
+    local_path = storage.local_path(score.output_path)
+    if local_path is not None:
+        # Starlette handles the ranges and reads the file in chunks itself
+        return FileResponse(path=local_path, filename=filename, media_type=media_type, headers=headers)
     
-def clean_up(score: Score, db: Session):
-    try:
-        original_file_path = Path(score.original_path)
-        if not original_file_path.is_file():
-            raise ValueError(f"Original file does not exist at path: {score.original_path}")
-        
-        processed_dir = DATA_DIR / "processed" / f"score_{score.id}"
-        processed_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_extension = original_file_path.suffix.lower()
-        logging.info(f"Proccessing file: {score.original_path} (extension: {file_extension})")
-        
-        if file_extension == ".pdf":
-            doc = fitz.open(str(original_file_path))
-            new_pdf_path = processed_dir / f"cleaned_score_{score.id}.pdf"
-            new_doc = fitz.open()
-            
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                width = page.rect.width
-                height = page.rect.height
-                
-                
-                pix = page.get_pixmap(dpi=300, alpha=False)
-                logging.info(f"PDF channels: {pix.n} (3=RGB, 4=RGBA)")
-                    
-                if not pix or pix.width == 0 or pix.height == 0:
-                    raise ValueError("PDF conversion failed: Invalid page dimensions")
-                
-                #debug logging
-                logging.info(
-                    f"PDF dimensions: {pix.width}x{pix.height}, "
-                    f"Pixel data size: {len(pix.samples)} bytes"
-                )
-                
-                #verifying pixel data integrity
-                expected_size = pix.width * pix.height * pix.n 
-                if len(pix.samples) != expected_size:
-                    raise ValueError(
-                        f"Pixel data mismatch. Expected {expected_size} bytes, got {len(pix.samples)}"
-                    )
-                                
-                # converting pixmap to numpy array for openCV processing
-                image_np = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
-                image = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-                
-                if image is None or image.size == 0:
-                    raise ValueError(f"Page {page_num + 1}: Empty image")
-                
-                std_dev = np.std(image)
-                
-                if 40 < std_dev < 150:
-                    logging.info(f"Skipping agressive processing for clean page (std_dev = {std_dev:.2f})")
-                    
-                    binary = image # cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
-                                                # cv2.THRESH_BINARY, 61, 3)
-                    
-                    '''
-                    otsu_thresh, _ = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-                    logging.info(f"Otsu threshold: {otsu_thresh}")
-                    
-                    # Adjust the threshold by subtracting an offset so fewer pixels become black
-                    adjusted_threshold = max(0, otsu_thresh + 1)
-                    logging.info(f"Adjusted threshold: {adjusted_threshold}")
-                    
-                    # Apply thresholding with the adjusted (lower) threshold
-                    _, binary = cv2.threshold(image, adjusted_threshold, 255, cv2.THRESH_BINARY)
-                    
-                    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
-                    binary = cv2.dilate(binary, kernel, iterations=1)
-                '''    
-                                 
-                else: 
-                
-                    denoised = cv2.GaussianBlur(image, (3, 3), 0)
-                    #more contrast
-                    clahe = cv2.createCLAHE(clipLimit=1.0, tileGridSize=(8, 8))
-                    contrast_enhanced = clahe.apply(denoised)
-                    
-                    #binarization
-                    binary = cv2.adaptiveThreshold(
-                        contrast_enhanced, 
-                        255, 
-                        cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                        cv2.THRESH_BINARY, 
-                        21,  # Smaller block size for local adaptation
-                        4    # Gentler constant
-                    )
-                    #Hough transform
-                    edges =cv2.Canny(binary, 50, 150, apertureSize=3)
-                    lines = cv2.HoughLines(edges, 1, np.pi/180, 150)
-                    
-                    if lines is not None:
-                        angles = [line[0][1] for line in lines]
-                        median_angle = np.degrees(np.median(angles))
-                        # Only rotate if skew exceeds a threshold (e.g., > 1 degree)
-                        if abs(median_angle - 90) > 2.0:
-                            center = (binary.shape[1]//2, binary.shape[0]//2)
-                            rot_mat = cv2.getRotationMatrix2D(center, median_angle - 90, 1.0)
-                            binary = cv2.warpAffine(
-                                binary, 
-                                rot_mat, 
-                                (binary.shape[1], binary.shape[0]), 
-                                flags=cv2.INTER_LINEAR,
-                                borderMode=cv2.BORDER_CONSTANT, 
-                                borderValue=255 
-                            )
-                
-                pixmap = fitz.Pixmap(
-                fitz.csGRAY, 
-                binary.shape[1], 
-                binary.shape[0],
-                binary.ravel().tobytes()
-            )
-                
-                new_page = new_doc.new_page(width=width, height=height)
-                
-                new_page.insert_image(new_page.rect, pixmap=pixmap)
-                
-            new_doc.save(str(new_pdf_path))
-            new_doc.close()
-            score.processed_path = str(new_pdf_path) 
-                
-              #  page_path = processed_dir / f"page_{page_num + 1}.jpg"
-               # cv2.imwrite(str(page_path), result)              
-                
-            # now taking care of non .pdf files   
-        else:
-            new_pdf_path = processed_dir / f"cleaned_{score.id}.pdf"
-            new_doc = fitz.open()
-            
-            with open(original_file_path, "rb") as f:
-                image_data = f.read()
-                       
-            image_np = np.frombuffer(image_data, dtype=np.uint8)
-            image = cv2.imdecode(image_np, cv2.IMREAD_GRAYSCALE)
-                
-            if image is None or image.size == 0:
-                raise ValueError("Failed to load image from file")
-                
-            denoised = cv2.bilateralFilter(image, 9, 75, 75)
-                #binarization
-            binary = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-                #Hough transform
-            edges =cv2.Canny(binary, 50, 150, apertureSize=3)
-            lines = cv2.HoughLines(edges, 1, np.pi/180, 200)
-            if lines is not None:
-                angles = [line[0][1] for line in lines]
-                median_angle = np.degrees(np.median(angles))
-                center = (image.shape[1]//2, image.shape[0]//2)
-                rot_mat = cv2.getRotationMatrix2D(center, median_angle -90, 1.0)
-                result = cv2.warpAffine(binary, rot_mat, 
-                                            (image.shape[1], image.shape[0]), 
-                                            flags=cv2.INTER_LINEAR)
-            else:
-                result = binary
-            
-            cleaned_image = result
-                
-            pix = fitz.Pixmap(
-                fitz.csGRAY, 
-                cleaned_image.shape[1], 
-                cleaned_image.shape[0],
-                cleaned_image.ravel().tobytes()
-            )
-            new_page = new_doc.new_page(width=cleaned_image.shape[1], height=cleaned_image.shape[0])
-                
-            new_page.insert_image(new_page.rect, pixmap=pix)
-                
-            new_doc.save(str(new_pdf_path))
-            new_doc.close()
-            score.processed_path = str(new_pdf_path)        
-          #  page_path = processed_dir / f"{score.id}.jpg"
-          #  cv2.imwrite(str(page_path), result)
-          
-        db.commit()
-        logging.info(f"Processing complete. Processed files saved to: {processed_dir}")
-    except Exception as e:
-        db.rollback()
-        logging.error(f"Error during cleanup: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Processing failed") from e
-        
-
-def convert_to_musicxml(score: Score, db: Session):
+    size = score.output_bytes
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
     try:
-        processed_file = Path(score.processed_path)
-        musicxml_dir = DATA_DIR /"xmlmusic" / f"score_{score.id}"
-        musicxml_dir.mkdir(parents=True, exist_ok=True)
-        
-        if not processed_file.exists():
-            raise ValueError(f"Processed file doesn't exist at {score.processed_path}")
-        
-        result = converter.convert_to_musicxml(
-            str(processed_file),
-            str(musicxml_dir)
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, "Content-Range": f"bytes */{size}"},
         )
-        if result is None:
-            raise ValueError(f"Conversion failed for {processed_file}")
-        
-        score.xmlmusic_path = str(musicxml_dir)
-        db.commit()
-        logging.info(f"Converting complete. MusicXML file saved to {score.xmlmusic_path}")
-        
-    except Exception as e:
-        db.rollback()
-        logging.error(f"Error during mxl conversion: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail="converting failed"
-            ) from e
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(storage.iter_bytes(score.output_path), media_type=media_type, headers=headers)
     
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        storage.iter_bytes(score.output_path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,146 @@
+"""Prometheus metrics for the web process and the conversion workers.
+
+Conversions run in spawned processes (job workers, page pools, Audiveris
+dispatchers), so with PROMETHEUS_MULTIPROC_DIR set prometheus_client runs in
+multiprocess mode: each process writes its samples to files there and
+/metrics adds them up. The directory has to be in the environment before
+prometheus_client is imported, and the workers inherit it from there.
+
+With several server workers (uvicorn --workers) each is a separate import,
+so the directory can't be made up here: it is set for the whole server (the
+dockerfile does) and emptied before the server starts, or the samples of an
+earlier run are added in.
+
+Without it (a local uvicorn, the benchmarks) the default registry is used,
+and /metrics only shows the samples of the process answering it.
+"""
+import os
+from time import perf_counter
+from typing import Dict, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+MB = 1024 * 1024
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to the response headers, per route",
+    ["method", "route", "status"],
+)
+
+UPLOAD_BYTES = Histogram(
+    "upload_bytes",
+    "Size of accepted uploads",
+    buckets=(64 * 1024, 256 * 1024, MB, 2 * MB, 5 * MB, 10 * MB, 20 * MB, 50 * MB),
+)
+UPLOAD_INGEST_SECONDS = Histogram(
+    "upload_ingest_seconds",
+    "Type check, hashing and copy to disk of an upload",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+CLEANUP_PAGE_SECONDS = Histogram(
+    "cleanup_page_seconds",
+    "OpenCV cleaning of one page (pdf) or one uploaded image",
+    ["source"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+PDF_PAGES = Counter(
+    "pdf_pages_total",
+    "PDF pages cleaned, by page class (vector, scanned, mixed) and how",
+    ["page_class", "branch"],
+)
+CONVERSION_SECONDS = Histogram(
+    "conversion_seconds",
+    "convert_to_musicxml of one score",
+    ["outcome"],
+    buckets=(5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+AUDIVERIS_EXITS = Counter(
+    "audiveris_exits_total",
+    "Audiveris runs by exit code (killed runs exit with -9)",
+    ["code"],
+)
+AUDIVERIS_TIMEOUTS = Counter(
+    "audiveris_timeouts_total",
+    "Audiveris runs killed for running past their timeout",
+)
+CONVERSIONS_IN_FLIGHT = Gauge(
+    "conversions_in_flight",
+    "Scores being worked on by the job workers, per stage",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+
+RESULT_CACHE_LOOKUPS = Counter(
+    "result_cache_lookups",
+    "Uploads looked up in the result cache, by outcome (hit, miss)",
+    ["outcome"],
+)
+
+DB_SESSION_SECONDS = Histogram(
+    "db_session_seconds",
+    "Time a session held a database connection, per transaction",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+DB_COMMIT_RETRIES = Counter(
+    "db_commit_retries",
+    "Commits retried after losing to a concurrent writer",
+)
+
+
+def _collect() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """The samples of every process, in the Prometheus text format."""
+    return generate_latest(_collect()), CONTENT_TYPE_LATEST
+
+
+def counter_totals(name: str, label: str) -> Dict[str, float]:
+    """The counter `name`'s value over every process, by one of its labels."""
+    totals = {}
+    for family in _collect().collect():
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total"):
+                key = sample.labels[label]
+                totals[key] = totals.get(key, 0) + sample.value
+    return totals
+
+
+def process_exited(pid: int):
+    # drops the gauge samples of a worker that is gone, so in-flight counts
+    # don't stick after it was stopped or killed
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+# time from a session's first use of the connection to its commit, rollback
+# or close; with SQLite this is roughly how long it can hold up writers.
+# On Session itself, so AsyncSessionLocal's sessions are counted too. Here
+# rather than in database.py, which Alembic imports
+@event.listens_for(Session, "after_begin")
+def _session_began(session, transaction, connection):
+    session.info.setdefault("began", perf_counter())
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _session_ended(session, transaction):
+    if transaction.parent is None and "began" in session.info:
+        DB_SESSION_SECONDS.observe(perf_counter() - session.info.pop("began"))
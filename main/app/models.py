@@ -1,26 +1,164 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Float, Index
 from sqlalchemy.orm import relationship
 from app.database import Base 
 
+
+def utcnow():
+    return datetime.now(tz=timezone.utc)
+
+
 class User(Base):
     __tablename__= "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     scores = relationship("Score", back_populates="user")
+    batches = relationship("Batch", back_populates="user")
     
     def __repr__(self):
         return f"({self.id}) ({self.username} {self.hashed_password})"
 
+# also a score's status: that of its latest job, or done for cache hits
+class JobStatus:
+    QUEUED = "queued"
+    CLEANING = "cleaning"
+    CONVERTING = "converting"
+    DONE = "done"
+    FAILED = "failed"
+
+    IN_FLIGHT = (CLEANING, CONVERTING)
+
+
 class Score(Base):
     __tablename__ = "scores"
+    # keyset pagination of the listing, newest first, overall / per user / per status
+    __table_args__ = (
+        Index("ix_scores_created_at_id", "created_at", "id"),
+        Index("ix_scores_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_scores_status_created_at_id", "status", "created_at", "id"),
+    )
     id = Column(Integer, primary_key=True)
     original_path = Column(String, nullable=False)
     processed_path  = Column(String)
     xmlmusic_path = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    cache_key = Column(String, index=True)
+    # seconds spent in each Audiveris step, summed over sheets
+    step_durations = Column(JSON)
+    status = Column(String, nullable=False, default=JobStatus.QUEUED)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    # the file /download serves, recorded when conversion finishes
+    output_path = Column(String)
+    output_bytes = Column(Integer)
+    output_sha256 = Column(String)
+    output_modified = Column(DateTime(timezone=True))
+    # finished pipeline stages, see checkpoints.py
+    checkpoints = Column(JSON)
+    # set for scores uploaded together through /upload_batch/
+    batch_id = Column(Integer, ForeignKey("batches.id"), index=True)
     user = relationship("User", back_populates="scores")
+    batch = relationship("Batch", back_populates="scores")
+    jobs = relationship("Job", back_populates="score")
+    profile = relationship("ScoreProfile", back_populates="score", uselist=False)
         
     def __repr__(self):
         return f"({self.id}) ({self.original_path} {self.processed_path} {self.xmlmusic_path}) ({self.user_id})"
-    
\ No newline at end of file
+
+
+# files uploaded in one request; progress is counted from its scores' status
+class Batch(Base):
+    __tablename__ = "batches"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # files and ZIP members that were not queued, [{"name", "detail"}]
+    rejected = Column(JSON, nullable=False, default=list)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    user = relationship("User", back_populates="batches")
+    scores = relationship("Score", back_populates="batch")
+
+    def __repr__(self):
+        return f"({self.id}) ({self.user_id} rejected={len(self.rejected or [])})"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    score_id = Column(Integer, ForeignKey("scores.id"), nullable=False, index=True)
+    status = Column(String, nullable=False, default=JobStatus.QUEUED, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    # latest Audiveris step per sheet while converting, {"step", "sheet", "sheets"}
+    progress = Column(JSON)
+    # set by the worker running it while in flight, see jobs.py
+    heartbeat_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+    score = relationship("Score", back_populates="jobs")
+
+    def __repr__(self):
+        return f"({self.id}) ({self.score_id} {self.status} attempts={self.attempts})"
+
+
+class CachedResult(Base):
+    __tablename__ = "result_cache"
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String, nullable=False, unique=True, index=True)
+    processed_path = Column(String, nullable=False)
+    xmlmusic_path = Column(String, nullable=False)
+    score_id = Column(Integer, ForeignKey("scores.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"({self.id}) ({self.cache_key} {self.xmlmusic_path}) ({self.score_id})"
+
+
+class ScoreProfile(Base):
+    """What processing one score took, written by the job worker as it goes.
+
+    `pages` has one {"branch", "class", "std_dev", "dpi", "interline_pt",
+    "interline_px", "wall_s", "cpu_s"} per page in page order (None where the
+    page's branch had no use for one); `stages` has {"wall_s", "cpu_s"} per
+    pipeline stage (clean_up also "pages_cpu_s", the pages' cpu wherever they
+    ran, "reused_pages" from an earlier attempt and "page_classes" counts).
+    """
+    __tablename__ = "score_profiles"
+    id = Column(Integer, primary_key=True)
+    score_id = Column(Integer, ForeignKey("scores.id"), nullable=False, unique=True, index=True)
+    source = Column(String)
+    input_bytes = Column(Integer)
+    page_count = Column(Integer)
+    render_dpi = Column(Integer)
+    pages = Column(JSON)
+    stages = Column(JSON)
+    audiveris_runs = Column(Integer)
+    audiveris_wall_s = Column(Float)
+    audiveris_cpu_s = Column(Float)
+    audiveris_peak_rss_mb = Column(Float)
+    processed_bytes = Column(Integer)
+    output_bytes = Column(Integer)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+    score = relationship("Score", back_populates="profile")
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(stage["wall_s"] for stage in (self.stages or {}).values())
+
+    def as_dict(self) -> dict:
+        data = {column.name: getattr(self, column.name) for column in self.__table__.columns}
+        data["updated_at"] = self.updated_at.isoformat()
+        return data
+
+    def __repr__(self):
+        return f"({self.id}) ({self.score_id} {self.page_count} pages {self.total_seconds:.1f}s)"
+
+
+class RevokedToken(Base):
+    """A logged out token, kept until it would have expired anyway.
+
+    Shared by every server worker; the token itself isn't stored, only its
+    sha256.
+    """
+    __tablename__ = "revoked_tokens"
+    token_sha256 = Column(String(64), primary_key=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,115 @@
+import logging
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+MXL_MIMETYPE = "application/vnd.recordare.musicxml"
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container>
+  <rootfiles>
+    <rootfile full-path="{name}" media-type="application/vnd.recordare.musicxml+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+class MergeError(ValueError):
+    pass
+
+
+def _rootfile(archive: zipfile.ZipFile) -> str:
+    container = ET.fromstring(archive.read("META-INF/container.xml"))
+    rootfile = container.find(".//rootfile")
+    if rootfile is None:
+        raise MergeError("container.xml has no rootfile")
+    return rootfile.get("full-path")
+
+
+def read_movements(mxl_path: Path) -> List[ET.Element]:
+    """Returns the score-partwise roots of an .mxl in playing order.
+
+    Audiveris exports with useOpus=true, so the rootfile is usually an
+    <opus> pointing at one MusicXML file per movement.
+    """
+    with zipfile.ZipFile(mxl_path) as archive:
+        root_name = _rootfile(archive)
+        root = ET.fromstring(archive.read(root_name))
+        if root.tag == "score-partwise":
+            return [root]
+        if root.tag != "opus":
+            raise MergeError(f"Unsupported MusicXML root <{root.tag}> in {mxl_path}")
+
+        base = posixpath.dirname(root_name)
+        movements = []
+        for score in root.iter("score"):
+            name = posixpath.normpath(posixpath.join(base, score.get(XLINK_HREF)))
+            movement = ET.fromstring(archive.read(name))
+            if movement.tag != "score-partwise":
+                raise MergeError(f"Unsupported MusicXML root <{movement.tag}> in {name}")
+            movements.append(movement)
+        return movements
+
+
+def merge_movements(movements: List[ET.Element]) -> ET.Element:
+    """Appends the measures of every movement, part by part, to the first one.
+
+    Parts are matched by position in the part-list; measures are renumbered
+    from 1 so numbering runs on across the original chunk boundaries (a
+    leading pickup measure keeps number 0).
+    """
+    if not movements:
+        raise MergeError("Nothing to merge")
+
+    merged = movements[0]
+    merged_parts = merged.findall("part")
+    for movement in movements[1:]:
+        parts = movement.findall("part")
+        if len(parts) != len(merged_parts):
+            raise MergeError(
+                f"Part count changes between chunks ({len(merged_parts)} vs {len(parts)})"
+            )
+        for merged_part, part in zip(merged_parts, parts):
+            merged_part.extend(part.findall("measure"))
+
+    for part in merged_parts:
+        number = 0
+        for index, measure in enumerate(part.findall("measure")):
+            if index == 0 and measure.get("implicit") == "yes":
+                measure.set("number", "0")
+                continue
+            number += 1
+            measure.set("number", str(number))
+    return merged
+
+
+def write_mxl(score: ET.Element, mxl_path: Path):
+    name = f"{mxl_path.stem}.xml"
+    with zipfile.ZipFile(mxl_path, "w") as archive:
+        # the mimetype entry has to come first and stay uncompressed
+        archive.writestr("mimetype", MXL_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", CONTAINER_XML.format(name=name), compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr(
+            name,
+            ET.tostring(score, encoding="UTF-8", xml_declaration=True),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+
+
+def merge_mxl_files(chunks: List[Path], mxl_path: Path) -> Path:
+    movements = []
+    for chunk in chunks:
+        # a truncated or malformed export is a merge failure like any other,
+        # the caller falls back to converting in one run
+        try:
+            movements.extend(read_movements(chunk))
+        except (zipfile.BadZipFile, KeyError, ET.ParseError, TypeError) as e:
+            raise MergeError(f"Unreadable chunk {chunk.name}: {e!r}") from e
+    write_mxl(merge_movements(movements), mxl_path)
+    logger.info(f"Merged {len(chunks)} chunk(s), {len(movements)} movement(s) into {mxl_path}")
+    return mxl_path
@@ -0,0 +1,123 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .models import Score, utcnow
+from .storage import file_sha256, get_storage, key_sha256
+
+
+def find_output(musicxml_dir: Path) -> Optional[Path]:
+    """The newest .mxl or .xml Audiveris left in a conversion directory."""
+    candidates = [path for path in (*musicxml_dir.glob("*.mxl"), *musicxml_dir.glob("*.xml")) if path.is_file()]
+    return max(candidates, key=lambda path: path.stat().st_mtime, default=None)
+
+
+def locate_output(key: str) -> Optional[str]:
+    """The stored file behind a score's xmlmusic_path, None if it's gone.
+
+    Scores converted before storage keys point at an Audiveris output
+    directory instead of the export itself.
+    """
+    storage = get_storage()
+    path = storage.local_path(key)
+    if path is not None and path.is_dir():
+        output = find_output(path)
+        return str(output) if output else None
+    return key if storage.exists(key) else None
+
+
+def describe_output(key: str) -> dict:
+    """The output columns of a score for the stored file `key`.
+
+    The hash comes with the key; only paths from before storage keys are read
+    through to hash them.
+    """
+    return {
+        "output_path": key,
+        "output_bytes": get_storage().size(key),
+        "output_sha256": key_sha256(key) or file_sha256(Path(key)),
+        "output_modified": utcnow().replace(microsecond=0),
+    }
+
+
+def set_output(score: Score, output: dict):
+    for column, value in output.items():
+        setattr(score, column, value)
+
+
+def record_output(score: Score, key: str):
+    """Remember which file a download serves, with what validators; the caller commits."""
+    set_output(score, describe_output(key))
+
+
+def copy_output(score: Score, source: Score):
+    # cache hits serve the very same file as the score that produced it
+    score.output_path = source.output_path
+    score.output_bytes = source.output_bytes
+    score.output_sha256 = source.output_sha256
+    score.output_modified = source.output_modified
+
+
+def output_is_current(score: Score) -> bool:
+    """Whether the recorded output is still in storage (one stat or HEAD, no scan)."""
+    if not score.output_path or not score.output_sha256:
+        return False
+    try:
+        return get_storage().size(score.output_path) == score.output_bytes
+    except OSError:
+        return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a single "bytes=" range, None to send it all.
+
+    Multiple ranges and anything malformed get the whole file, which the
+    spec allows; a range starting past the end raises ValueError (416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            # suffix range: the last N bytes, of which an empty file has none
+            length = int(last)
+            if length > 0 and size == 0:
+                raise ValueError("Suffix range of an empty file")
+            return (max(size - length, 0), size - 1) if length > 0 else None
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise ValueError(f"Range starts past the end of {size} bytes")
+    return (start, end) if start <= end else None
+
+
+def etag(score: Score) -> str:
+    return f'"{score.output_sha256}"'
+
+
+def last_modified(score: Score) -> str:
+    return format_datetime(_as_utc(score.output_modified), usegmt=True)
+
+
+def etag_matches(if_none_match: str, score: Score) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, as If-None-Match asks for
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag(score) in tags
+
+
+def unmodified_since(if_modified_since: str, score: Score) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return since.tzinfo is not None and _as_utc(score.output_modified) <= since
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands timestamps back naive, they're stored in UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
@@ -0,0 +1,148 @@
+import logging
+import os
+import zlib
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def is_bilevel(image: np.ndarray) -> bool:
+    # 0 and 255 wrap to 255 and 254, every gray level in between lands below 254
+    return not np.any((image - np.uint8(1)) < 254)
+
+
+def pack_bits(binary_image: np.ndarray) -> Tuple[bytes, int, int]:
+    """Packs a 0/255 image to 1 bit per pixel, MSB first, 1 = white.
+
+    Rows are padded to whole bytes with white bits. Returns the packed bytes
+    and the padded width and height.
+    """
+    height, width = binary_image.shape
+    packed = np.packbits(binary_image > 0, axis=1, bitorder="big")
+    if width % 8:
+        packed[:, -1] |= 0xFF >> (width % 8)
+    return packed.tobytes(), packed.shape[1] * 8, height
+
+
+class StreamingPdfWriter:
+    """Writes one grayscale image per page straight to a PDF file.
+
+    Every page is compressed and flushed as soon as it is added, so memory
+    stays at one page whatever the page count; only the page object numbers
+    are kept for the page tree and xref written on close. The file is built
+    under a temporary name and moved into place on a clean close.
+
+    Pages that are pure black and white are stored as 1-bit images (an
+    eighth of the raw data before compression, decoding to the same pixels);
+    anything with gray levels, e.g. an anti-aliased rotation, stays 8-bit.
+    `bilevel=False` stores every page 8-bit.
+
+        with StreamingPdfWriter(path) as writer:
+            writer.add_page(image, width_pt, height_pt)
+    """
+    # objects 1 and 2 (catalog and page tree) are written last, once the
+    # pages are known
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, path: Path, compression: int = 6, bilevel: bool = True):
+        self.path = Path(path)
+        self.compression = compression
+        self.bilevel = bilevel
+        self.bilevel_pages = 0
+        self._tmp_path = self.path.with_name(f".{self.path.name}.part")
+        self._file = open(self._tmp_path, "wb")
+        self._offsets = {}
+        self._next_object = 3
+        self._pages: List[int] = []
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def _begin_object(self, number: int):
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n".encode())
+
+    def _write_object(self, number: int, body: bytes):
+        self._begin_object(number)
+        self._file.write(body)
+        self._file.write(b"\nendobj\n")
+
+    def _write_stream(self, number: int, dictionary: str, data: bytes):
+        self._begin_object(number)
+        self._file.write(f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode())
+        self._file.write(data)
+        self._file.write(b"\nendstream\nendobj\n")
+
+    def _allocate(self, count: int) -> List[int]:
+        numbers = list(range(self._next_object, self._next_object + count))
+        self._next_object += count
+        return numbers
+
+    def add_page(self, image: np.ndarray, width: float, height: float):
+        """Adds `image` (2D uint8) stretched over a width x height point page."""
+        if image.ndim != 2 or image.dtype != np.uint8:
+            raise ValueError(f"Expected a 2D uint8 image, got {image.dtype} {image.shape}")
+        pixels_high, pixels_wide = image.shape
+        image_obj, content_obj, page_obj = self._allocate(3)
+
+        if self.bilevel and is_bilevel(image):
+            packed, _, _ = pack_bits(image)
+            data = zlib.compress(packed, self.compression)
+            bits = 1
+            self.bilevel_pages += 1
+        else:
+            # compressed straight from the array's buffer, no bytes copy of the page
+            data = zlib.compress(memoryview(np.ascontiguousarray(image)).cast("B"), self.compression)
+            bits = 8
+        self._write_stream(
+            image_obj,
+            f"/Type /XObject /Subtype /Image /Width {pixels_wide} /Height {pixels_high} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent {bits} /Filter /FlateDecode",
+            data,
+        )
+        self._write_stream(content_obj, "", f"q {width:.2f} 0 0 {height:.2f} 0 0 cm /Im0 Do Q".encode())
+        self._write_object(
+            page_obj,
+            f"<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_obj} 0 R >> >> /Contents {content_obj} 0 R >>".encode(),
+        )
+        self._pages.append(page_obj)
+
+    def close(self):
+        kids = " ".join(f"{page} 0 R" for page in self._pages)
+        self._write_object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>".encode())
+        self._write_object(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>".encode())
+
+        xref_offset = self._file.tell()
+        size = self._next_object
+        self._file.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for number in range(1, size):
+            self._file.write(f"{self._offsets[number]:010d} 00000 n \n".encode())
+        self._file.write(
+            f"trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        logger.info(
+            f"Wrote {len(self._pages)} page(s) ({self.bilevel_pages} 1-bit) to {self.path.name}, "
+            f"{xref_offset // 1024} KB of pages"
+        )
+
+    def abort(self):
+        self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
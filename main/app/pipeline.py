@@ -0,0 +1,371 @@
+import logging
+import shutil
+from collections import Counter
+from pathlib import Path
+from time import monotonic, process_time
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from .models import Score, ScoreProfile
+from .audiveris import AudiverisConverter, ProgressCallback, StepTimer, run_usage
+from .preprocessing import RENDER_DPI, PageStats, clean_pdf_pages, clean_image, preprocessing_fingerprint
+from .audiveris_split import convert_in_chunks
+from .musicxml import MergeError
+from .pdf_writer import StreamingPdfWriter
+from .outputs import find_output, record_output
+from .storage import get_storage
+from .checkpoints import checkpoint, set_checkpoint, save_page, load_page
+from .classifier import classify_pdf
+from .interline import AUDIVERIS_PDF_DPI, INTERLINE_TOLERANCE, page_scale, page_size_pt
+from .database import commit_with_retry
+from .scheduler import current_plan
+from .metrics import CONVERSION_SECONDS, PDF_PAGES
+from .config import (
+    WORK_DIR, VECTOR_PASSTHROUGH, AUDIVERIS_PATH, AUDIVERIS_MODE, AUDIVERIS_SPLIT_PAGES,
+    AUDIVERIS_MEMORY_BUDGET_MB, AUDIVERIS_CHUNK_HEAP_MB, JVM_OVERHEAD_MB,
+)
+
+import cv2
+import numpy as np
+import fitz
+
+
+class PipelineError(Exception):
+    """Raised when a pipeline stage fails; the original error is chained as __cause__."""
+
+
+_converter = None
+
+# Audiveris is only needed where conversions actually run (the job workers),
+# so the installation check is deferred until the first conversion.
+# Heap and threads are this worker's share of the budget, see scheduler.py.
+def get_converter() -> AudiverisConverter:
+    global _converter
+    if _converter is None:
+        plan = current_plan()
+        _converter = AudiverisConverter(AUDIVERIS_PATH, heap_mb=plan.heap_mb, thread_count=plan.threads)
+    return _converter
+
+
+def run_audiveris(
+    input_path: str,
+    output_dir: str,
+    on_progress: Optional[ProgressCallback] = None,
+    converter: Optional[AudiverisConverter] = None
+) -> Optional[str]:
+    if AUDIVERIS_MODE == "pool":
+        from .audiveris_pool import submit
+        return submit(input_path, output_dir, on_progress=on_progress)
+    return (converter or get_converter()).convert_to_musicxml(input_path, output_dir, on_progress=on_progress)
+
+
+def convert_split(processed_file: Path, musicxml_dir: Path, on_progress: ProgressCallback) -> Optional[str]:
+    # as many chunk JVMs as fit in this job's memory budget, sharing its
+    # cores; each takes its overhead on top of the heap, like a whole run
+    plan = current_plan()
+    budget_mb = AUDIVERIS_MEMORY_BUDGET_MB or plan.heap_mb + JVM_OVERHEAD_MB
+    max_parallel = max(1, budget_mb // (AUDIVERIS_CHUNK_HEAP_MB + JVM_OVERHEAD_MB))
+    chunk_converter = None
+    if AUDIVERIS_MODE != "pool":
+        chunk_converter = AudiverisConverter(
+            AUDIVERIS_PATH,
+            heap_mb=AUDIVERIS_CHUNK_HEAP_MB,
+            thread_count=max(1, plan.threads // max_parallel),
+        )
+
+    def convert_chunk(input_path, output_dir, chunk_progress):
+        return run_audiveris(input_path, output_dir, chunk_progress, converter=chunk_converter)
+
+    try:
+        return convert_in_chunks(
+            convert_chunk, processed_file, musicxml_dir,
+            AUDIVERIS_SPLIT_PAGES, max_parallel, on_progress
+        )
+    except MergeError as e:
+        logging.warning(f"Could not merge chunks of {processed_file.name} ({e}), converting in one run")
+        return run_audiveris(str(processed_file), str(musicxml_dir), on_progress)
+
+def get_profile(score: Score) -> ScoreProfile:
+    # one per score; a retried job overwrites what the failed attempt recorded
+    if score.profile is None:
+        score.profile = ScoreProfile()
+    return score.profile
+
+
+def _stage(started: float, cpu_started: float, **extra) -> dict:
+    return {
+        "wall_s": round(monotonic() - started, 3),
+        "cpu_s": round(process_time() - cpu_started, 3),
+        **extra,
+    }
+
+
+def _page_entry(stats: PageStats) -> dict:
+    return {
+        "branch": stats.branch,
+        "class": stats.page_class or None,
+        "std_dev": stats.std_dev and round(stats.std_dev, 2),
+        "dpi": stats.dpi,
+        "interline_pt": stats.interline_pt,
+        "interline_px": stats.interline_px,
+        "wall_s": round(stats.wall_s, 3),
+        "cpu_s": round(stats.cpu_s, 3),
+    }
+
+#cleaning up the .pdf and .jpeg images using OpenCV library before proccessing further.
+    
+def clean_up(score: Score, db: Session):
+    started, cpu_started = monotonic(), process_time()
+    storage = get_storage()
+    # done in an earlier run that failed later on
+    if checkpoint(score, "cleanup").get("complete") and score.processed_path and storage.exists(score.processed_path):
+        logging.info(f"Score {score.id} already cleaned up, reusing {score.processed_path}")
+        return
+
+    # the cleaned pdf is written here, then moved into storage; kept when
+    # cleaning fails, with the pages done so far, for the next attempt
+    processed_dir = WORK_DIR / f"score_{score.id}"
+    processed_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with storage.local_copy(score.original_path) as original_file_path:
+            page_stats, render_dpi, new_pdf_path, reused_pages = _clean_file(
+                score, db, original_file_path, processed_dir
+            )
+            input_bytes = original_file_path.stat().st_size
+        file_extension = original_file_path.suffix.lower()
+
+        profile = get_profile(score)
+        profile.source = "pdf" if file_extension == ".pdf" else "image"
+        profile.input_bytes = input_bytes
+        profile.page_count = len(page_stats)
+        profile.render_dpi = render_dpi
+        profile.pages = [_page_entry(stats) for stats in page_stats]
+        profile.processed_bytes = new_pdf_path.stat().st_size if new_pdf_path else input_bytes
+        profile.stages = {
+            **(profile.stages or {}),
+            "clean_up": _stage(
+                started, cpu_started,
+                pages_cpu_s=round(sum(stats.cpu_s for stats in page_stats), 3),
+                reused_pages=reused_pages,
+                page_classes=dict(Counter(stats.page_class for stats in page_stats if stats.page_class)),
+            ),
+        }
+        # no new pdf: every page is clean vector art, which Audiveris reads as uploaded
+        score.processed_path = storage.put_file(new_pdf_path, "processed") if new_pdf_path else score.original_path
+        # the page list goes, the processed pdf is the checkpoint now
+        set_checkpoint(score, "cleanup", complete=True, page_count=len(page_stats))
+        db.commit()
+        logging.info(f"Processing complete. Processed file stored as {score.processed_path}")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Error during cleanup: {e}")
+        raise PipelineError("Processing failed") from e
+    shutil.rmtree(processed_dir, ignore_errors=True)
+
+
+def _reusable_pages(score: Score, pages_dir: Path, page_count: int) -> list:
+    # pages from an earlier attempt, as long as they were cleaned the same way
+    # and their files are still here (the work dir is local to the node)
+    saved = checkpoint(score, "cleanup")
+    if saved.get("fingerprint") != preprocessing_fingerprint() or saved.get("page_count") != page_count:
+        return []
+    pages = []
+    for entry in saved.get("pages", []):
+        if not (pages_dir / entry["file"]).is_file():
+            break
+        pages.append(entry)
+    return pages
+
+
+def _clean_file(score: Score, db: Session, original_file_path: Path, processed_dir: Path):
+    file_extension = original_file_path.suffix.lower()
+    logging.info(f"Proccessing file: {score.original_path} (extension: {file_extension})")
+    
+    if file_extension == ".pdf":
+        new_pdf_path = processed_dir / f"cleaned_score_{score.id}.pdf"
+        # a few ms a page (content lists and a thumbnail), decides how much
+        # work each page needs
+        classes = classify_pdf(str(original_file_path))
+        page_count = len(classes)
+        counts = Counter(page_class.kind for page_class in classes)
+        clean_vector = sum(page_class.clean_vector for page_class in classes)
+        logging.info(f"Page classes of score {score.id}: {dict(counts)}, {clean_vector} clean vector")
+
+        scales = None
+        if VECTOR_PASSTHROUGH and page_count and clean_vector == page_count:
+            # measured here already: passed through, Audiveris renders it at
+            # its own fixed dpi, which has to suit the staff size
+            with fitz.open(str(original_file_path)) as doc:
+                scales = [page_scale(page, RENDER_DPI) for page in doc]
+            if all(abs(scale.dpi - AUDIVERIS_PDF_DPI) <= INTERLINE_TOLERANCE * AUDIVERIS_PDF_DPI for scale in scales):
+                logging.info(f"Score {score.id} is clean vector art throughout, passing it through")
+                for page_class in classes:
+                    PDF_PAGES.labels(page_class=page_class.kind, branch="passthrough").inc()
+                page_stats = [
+                    PageStats("passthrough", None, page_class=page_class.kind, interline_pt=scale.interline_pt)
+                    for page_class, scale in zip(classes, scales)
+                ]
+                return page_stats, None, None, 0
+            logging.info(f"Score {score.id} is clean vector art, rendering it for its staff size")
+        
+        pages_dir = processed_dir / "pages"
+        pages_dir.mkdir(exist_ok=True)
+        pages = _reusable_pages(score, pages_dir, page_count)
+
+        # each cleaned page goes to disk as soon as it arrives, memory
+        # doesn't grow with the page count; it is also kept as a file of its
+        # own and checkpointed, so a failure further on doesn't clean it again
+        page_stats = []
+        with StreamingPdfWriter(new_pdf_path) as writer:
+            for i, entry in enumerate(pages):
+                image = load_page(pages_dir / entry["file"])
+                # unreadable page file, clean it again from here
+                if image is None:
+                    pages = pages[:i]
+                    break
+                writer.add_page(image, entry["width"], entry["height"])
+                page_stats.append(PageStats(*entry["stats"]))
+            reused_pages = len(pages)
+            if reused_pages:
+                logging.info(f"Reused {reused_pages} of {page_count} cleaned pages of score {score.id}")
+            for page in clean_pdf_pages(
+                str(original_file_path), page_count, workers=current_plan().cleanup_workers,
+                first_page=reused_pages, classes=classes, scales=scales,
+            ):
+                writer.add_page(page.image, page.width, page.height)
+                page_stats.append(page.stats)
+                entry = {"file": f"{len(pages):05d}.png", "width": page.width, "height": page.height, "stats": list(page.stats)}
+                save_page(pages_dir / entry["file"], page.image)
+                pages.append(entry)
+                commit_with_retry(db, lambda: set_checkpoint(
+                    score, "cleanup", fingerprint=preprocessing_fingerprint(), page_count=page_count, pages=list(pages)
+                ))
+        # pages can differ, the profile keeps the typical one
+        render_dpi = int(np.median([stats.dpi or RENDER_DPI for stats in page_stats]))
+            
+        # now taking care of non .pdf files   
+    else:
+        new_pdf_path = processed_dir / f"cleaned_{score.id}.pdf"
+        
+        with open(original_file_path, "rb") as f:
+            image_data = f.read()
+                   
+        image_np = np.frombuffer(image_data, dtype=np.uint8)
+        image = cv2.imdecode(image_np, cv2.IMREAD_GRAYSCALE)
+            
+        if image is None or image.size == 0:
+            raise ValueError("Failed to load image from file")
+            
+        image_started, image_cpu_started = monotonic(), process_time()
+        cleaned_image = clean_image(image, workers=current_plan().cleanup_workers)
+        _, std_dev = cv2.meanStdDev(image)
+        page_stats = [PageStats(
+            "image", float(std_dev[0][0]), monotonic() - image_started, process_time() - image_cpu_started
+        )]
+            
+        with StreamingPdfWriter(new_pdf_path) as writer:
+            writer.add_page(cleaned_image, *page_size_pt(cleaned_image))
+        render_dpi = None
+        reused_pages = 0
+
+    return page_stats, render_dpi, new_pdf_path, reused_pages
+
+
+def record_conversion(profile: ScoreProfile, result: Optional[str], started: float, cpu_started: float):
+    # in pool mode the JVM runs in a dispatcher, which serves several books
+    # per run; only the conversion's wall time is known here then
+    usage = run_usage.summary()
+    ran_here = usage["runs"] > 0
+    profile.audiveris_runs = usage["runs"]
+    profile.audiveris_wall_s = round(usage["wall_s"], 3) if ran_here else None
+    profile.audiveris_cpu_s = usage["cpu_s"] and round(usage["cpu_s"], 3)
+    profile.audiveris_peak_rss_mb = usage["peak_rss_mb"] and round(usage["peak_rss_mb"], 1)
+    profile.output_bytes = Path(result).stat().st_size if result and Path(result).exists() else None
+    profile.stages = {**(profile.stages or {}), "convert": _stage(started, cpu_started)}
+
+
+def convert_to_musicxml(score: Score, db: Session, on_progress: Optional[ProgressCallback] = None):
+    timer = StepTimer()
+
+    # only step changes are passed on, Audiveris repeats the same step
+    # on many consecutive lines
+    def track_progress(step: str, sheet: Optional[int]):
+        if timer.update(step, sheet, monotonic()) and on_progress:
+            on_progress(step, sheet)
+
+    storage = get_storage()
+    omr = checkpoint(score, "omr")
+    if omr.get("output") and storage.exists(omr["output"]):
+        # Audiveris finished in an earlier run that failed after it
+        logging.info(f"Score {score.id} already converted, reusing {omr['output']}")
+        _export(score, db, omr["output"])
+        return
+
+    # a step that never finishes is the interesting case, so a run that
+    # raises keeps them too
+    def record_steps():
+        score.step_durations = timer.finish(monotonic())
+        logging.info(f"Audiveris step durations for score {score.id}: {score.step_durations}")
+
+    started, cpu_started = monotonic(), process_time()
+    run_usage.reset()
+    # Audiveris writes its book and export here; only the export is stored
+    work_dir = WORK_DIR / f"score_{score.id}"
+    musicxml_dir = work_dir / "xmlmusic"
+    try:
+        musicxml_dir.mkdir(parents=True, exist_ok=True)
+        with storage.local_copy(score.processed_path) as processed_file:
+            with fitz.open(str(processed_file)) as doc:
+                page_count = len(doc)
+
+            if AUDIVERIS_SPLIT_PAGES and page_count > AUDIVERIS_SPLIT_PAGES:
+                result = convert_split(processed_file, musicxml_dir, track_progress)
+            else:
+                result = run_audiveris(str(processed_file), str(musicxml_dir), track_progress)
+        # also when Audiveris gave up (result None)
+        record_steps()
+        record_conversion(get_profile(score), result, started, cpu_started)
+        db.commit()
+        
+        if result is None:
+            raise ValueError(f"Conversion failed for {score.processed_path}")
+        
+        output = Path(result) if Path(result).is_file() else find_output(musicxml_dir)
+        if output is None:
+            raise ValueError(f"No MusicXML output in {musicxml_dir}")
+        set_checkpoint(score, "omr", output=storage.put_file(output, "xmlmusic"))
+        db.commit()
+        CONVERSION_SECONDS.labels(outcome="done").observe(monotonic() - started)
+        
+    except Exception as e:
+        CONVERSION_SECONDS.labels(outcome="failed").observe(monotonic() - started)
+        db.rollback()
+        logging.error(f"Error during mxl conversion: {e}")
+        # the rollback dropped them, or Audiveris raised before they were set
+        if timer.current or timer.durations:
+            try:
+                record_steps()
+                db.commit()
+            except Exception as commit_error:
+                db.rollback()
+                logging.error(f"Could not record step durations of score {score.id}: {commit_error}")
+        raise PipelineError("Converting failed") from e
+    finally:
+        # a rerun starts Audiveris from scratch, nothing in here is reused
+        shutil.rmtree(work_dir, ignore_errors=True)
+    _export(score, db, checkpoint(score, "omr")["output"])
+
+
+def _export(score: Score, db: Session, key: str):
+    try:
+        # what /download serves, so it needs neither a directory scan nor a hash per request
+        score.xmlmusic_path = key
+        record_output(score, key)
+        set_checkpoint(score, "export", output=key)
+        db.commit()
+        logging.info(f"Converting complete. MusicXML file stored as {score.xmlmusic_path}")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Error exporting score {score.id}: {e}")
+        raise PipelineError("Export failed") from e
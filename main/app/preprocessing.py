@@ -0,0 +1,428 @@
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import monotonic, process_time
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import fitz
+
+from .config import (
+    DESKEW_MIN_ANGLE, DESKEW_MIN_CONFIDENCE, IMAGE_DENOISE, VECTOR_MAX_NOISE, VECTOR_PASSTHROUGH,
+    TARGET_INTERLINE, INTERLINE_PROBE_DPI, RENDER_DPI_MIN, RENDER_DPI_MAX,
+)
+from .metrics import CLEANUP_PAGE_SECONDS, PDF_PAGES
+from .classifier import PageClass, classify_page
+from .interline import PageScale, in_target_band, measure_staff_scale, page_scale, page_size_pt, render_dpi_for
+
+logger = logging.getLogger(__name__)
+
+# bump whenever the cleaning pass changes its output, so cached conversions
+# of the old output are no longer reused
+PREPROCESSING_VERSION = "8"
+
+# PDF pages are rendered at the dpi their staff interline calls for (see
+# interline.py), at this one when that can't be measured
+RENDER_DPI = 300
+
+
+class PageStats(NamedTuple):
+    # "clean" (kept as rendered), "binarized", "vector" (thresholded only),
+    # "passthrough" (not rendered at all) or "image" for image uploads
+    branch: str
+    # None where the branch didn't need it
+    std_dev: Optional[float]
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    # vector, scanned or mixed for PDF pages, see classifier.py
+    page_class: str = ""
+    # what a PDF page was rendered at, the interline (points) that chose it
+    # and the interline measured on the rendered page (pixels)
+    dpi: Optional[int] = None
+    interline_pt: Optional[float] = None
+    interline_px: Optional[float] = None
+
+
+class CleanedPage(NamedTuple):
+    # points, sized so Audiveris's 300 dpi render of the page is the image
+    # pixel for pixel (see interline.py)
+    width: float
+    height: float
+    image: np.ndarray  # cleaned grayscale
+    stats: PageStats
+
+
+@CLEANUP_PAGE_SECONDS.labels(source="pdf").time()
+def clean_pdf_page(
+    pdf_path: str, page_num: int, page_class: Optional[PageClass] = None, scale: Optional[PageScale] = None
+) -> CleanedPage:
+    """Renders one PDF page at the dpi its staves call for and runs the OpenCV cleaning pass on it.
+
+    Opens the document itself, so it can run in a pool worker with only the
+    path and page number pickled across. Clean vector pages only get a global
+    threshold. The page is classified and its interline measured here unless
+    `page_class` and `scale` are given.
+    """
+    started, cpu_started = monotonic(), process_time()
+    with fitz.open(pdf_path) as doc:
+        page = doc.load_page(page_num)
+        page_class = page_class or classify_page(page)
+        scale = scale or page_scale(page, RENDER_DPI)
+        dpi = scale.dpi
+        pix, image = _render_page(page, page_num, dpi)
+
+        # the probe render can be off (a page with little music on it), the
+        # full one shows what Audiveris will get
+        interline_px = None
+        if scale.interline_pt is not None:
+            measured = measure_staff_scale(image)
+            interline_px = measured and round(measured.interline, 2)
+            if interline_px and not in_target_band(interline_px):
+                corrected = render_dpi_for(interline_px, dpi)
+                if corrected != dpi:
+                    logger.info(f"Page {page_num + 1}: interline {interline_px} px at {dpi} dpi, rendering at {corrected}")
+                    dpi = corrected
+                    pix, image = _render_page(page, page_num, dpi)
+                    measured = measure_staff_scale(image)
+                    interline_px = measured and round(measured.interline, 2)
+            if interline_px and not in_target_band(interline_px):
+                logger.warning(f"Page {page_num + 1}: interline {interline_px} px at {dpi} dpi, outside the target band")
+
+        if page_class.clean_vector:
+            cleaned, stats = threshold_vector_page(image), PageStats("vector", None)
+        else:
+            cleaned, stats = clean_page_image(image)
+        PDF_PAGES.labels(page_class=page_class.kind, branch=stats.branch).inc()
+        # cpu is this process's, which only works on this page meanwhile
+        stats = stats._replace(
+            wall_s=monotonic() - started, cpu_s=process_time() - cpu_started, page_class=page_class.kind,
+            dpi=dpi, interline_pt=scale.interline_pt, interline_px=interline_px,
+        )
+        return CleanedPage(*page_size_pt(cleaned), cleaned, stats)
+
+
+def _render_page(page: fitz.Page, page_num: int, dpi: int) -> Tuple[fitz.Pixmap, np.ndarray]:
+    """The page in gray at `dpi`, and the pixmap the array is a view of (keep it alive)."""
+    # rendered straight to one channel: a third of the RGB pixmap and no
+    # cvtColor pass
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+
+    if not pix or pix.width == 0 or pix.height == 0:
+        raise ValueError("PDF conversion failed: Invalid page dimensions")
+
+    # samples_mv is a view of the pixmap's own buffer (pix.samples would
+    # copy the whole page to a bytes object on every access)
+    samples = pix.samples_mv
+    logger.info(f"PDF dimensions: {pix.width}x{pix.height}, Pixel data size: {len(samples)} bytes")
+
+    #verifying pixel data integrity
+    expected_size = pix.stride * pix.height
+    if len(samples) != expected_size:
+        raise ValueError(
+            f"Pixel data mismatch. Expected {expected_size} bytes, got {len(samples)}"
+        )
+
+    # numpy array over the same memory, rows may be padded to the stride
+    image = np.ndarray(
+        (pix.height, pix.width), dtype=np.uint8, buffer=samples, strides=(pix.stride, 1)
+    )
+
+    if image is None or image.size == 0:
+        raise ValueError(f"Page {page_num + 1}: Empty image")
+    return pix, image
+
+
+def threshold_vector_page(image: np.ndarray) -> np.ndarray:
+    """Black and white version of a page rendered from vector art.
+
+    There is no noise, skew or uneven lighting to correct, only the renderer's
+    anti-aliasing; one Otsu threshold turns it into a 1-bit page (also for
+    gray "ink"), which the PDF writer stores at an eighth of the size.
+    """
+    return cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def looks_clean(image: np.ndarray) -> Tuple[bool, float]:
+    """Whether a rendered page has enough contrast to skip binarization, and its std_dev."""
+    std_dev = float(np.std(image))
+    return 40 < std_dev < 150, std_dev
+
+
+def enhance_contrast(image: np.ndarray) -> np.ndarray:
+    denoised = cv2.GaussianBlur(image, (3, 3), 0)
+    #more contrast
+    clahe = cv2.createCLAHE(clipLimit=1.0, tileGridSize=(8, 8))
+    return clahe.apply(denoised)
+
+
+def binarize_page(image: np.ndarray) -> np.ndarray:
+    return cv2.adaptiveThreshold(
+        image,
+        255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        21,  # Smaller block size for local adaptation
+        4    # Gentler constant
+    )
+
+
+def clean_page_image(image: np.ndarray) -> Tuple[np.ndarray, PageStats]:
+    """Cleaning pass for a grayscale page rendered from a PDF."""
+    clean, std_dev = looks_clean(image)
+
+    if clean:
+        logger.info(f"Skipping agressive processing for clean page (std_dev = {std_dev:.2f})")
+        # copied: the image may be a view of a pixmap that is freed on return
+        return image.copy(), PageStats("clean", std_dev)
+    return deskew(binarize_page(enhance_contrast(image))), PageStats("binarized", std_dev)
+
+
+class SkewEstimate(NamedTuple):
+    angle: float       # degrees counter-clockwise; rotating by -angle straightens the page
+    confidence: float  # 0 (no line structure found) .. 1 (sharp staff lines)
+
+
+def _profile_sharpness(ys: np.ndarray, xs: np.ndarray, weights: np.ndarray, angle: float) -> float:
+    # rows of a page tilted by `angle` line up again once every pixel is
+    # shifted by x*tan(angle); staff lines then pile into a few rows and the
+    # squared jumps between neighbouring rows of the profile peak
+    rows = np.rint(ys + xs * np.tan(np.radians(angle))).astype(np.int64)
+    profile = np.bincount(rows - rows.min(), weights=weights)
+    return float(np.sum(np.diff(profile) ** 2))
+
+
+def estimate_skew(
+    binary: np.ndarray,
+    max_angle: float = 10.0,
+    step: float = 0.5,
+    fine_step: float = 0.05,
+    work_width: int = 400,
+    max_points: int = 40000
+) -> SkewEstimate:
+    """Projection-profile skew estimate on a downsampled copy of a binarized page.
+
+    Tries every angle within +-max_angle in `step`s, then refines around the
+    best one in `fine_step`s. Confidence is how far the best profile stands
+    out from the median one; pages without long horizontal lines get ~0.
+    """
+    scale = min(1.0, work_width / binary.shape[1])
+    small = binary if scale == 1.0 else cv2.resize(binary, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    ink = 255 - small
+    ys, xs = np.nonzero(ink > 64)
+    if len(ys) < 100:
+        return SkewEstimate(0.0, 0.0)
+    if len(ys) > max_points:
+        # noisy scans have ink everywhere; an even sample keeps the profile's shape
+        keep = len(ys) // max_points + 1
+        ys, xs = ys[::keep], xs[::keep]
+    weights = ink[ys, xs].astype(np.float64)
+    xs = xs - small.shape[1] / 2
+
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    scores = np.array([_profile_sharpness(ys, xs, weights, a) for a in angles])
+    best = angles[np.argmax(scores)]
+    confidence = 1.0 - float(np.median(scores)) / float(scores.max()) if scores.max() > 0 else 0.0
+
+    fine = np.arange(best - step, best + step + fine_step / 2, fine_step)
+    fine_scores = [_profile_sharpness(ys, xs, weights, a) for a in fine]
+    return SkewEstimate(round(float(fine[int(np.argmax(fine_scores))]), 2), round(confidence, 3))
+
+
+def should_rotate(skew: SkewEstimate) -> bool:
+    return abs(skew.angle) >= DESKEW_MIN_ANGLE and skew.confidence >= DESKEW_MIN_CONFIDENCE
+
+
+def rotate_page(binary: np.ndarray, angle: float) -> np.ndarray:
+    """Rotates a binarized page `angle` degrees counter-clockwise about its center, filling with white.
+
+    Interpolated, then thresholded again: the edges come out smoother than
+    with nearest neighbour and the page stays black and white, which the
+    PDF writer stores at 1 bit per pixel.
+    """
+    center = (binary.shape[1]//2, binary.shape[0]//2)
+    rot_mat = cv2.getRotationMatrix2D(center, angle, 1.0)
+    rotated = cv2.warpAffine(
+        binary,
+        rot_mat,
+        (binary.shape[1], binary.shape[0]),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=255
+    )
+    cv2.threshold(rotated, 127, 255, cv2.THRESH_BINARY, dst=rotated)
+    return rotated
+
+
+def deskew(binary: np.ndarray) -> np.ndarray:
+    """Rotates a binarized page straight, unless the skew is too small or too uncertain to bother."""
+    skew = estimate_skew(binary)
+    if not should_rotate(skew):
+        logger.debug(f"Not deskewing, estimated {skew.angle:.2f} deg (confidence {skew.confidence:.2f})")
+        return binary
+
+    logger.info(f"Deskewing by {skew.angle:.2f} deg (confidence {skew.confidence:.2f})")
+    return rotate_page(binary, -skew.angle)
+
+
+def _fast_bilateral(image: np.ndarray) -> np.ndarray:
+    # the same filter at half resolution (a 5 px window there covers what the
+    # 9 px one does at full size), then scaled back up; padded to even sides
+    # so the scale is exactly 2 and strips land on the same pixel grid
+    height, width = image.shape
+    padded = cv2.copyMakeBorder(image, 0, height % 2, 0, width % 2, cv2.BORDER_REPLICATE)
+    half = cv2.resize(padded, (padded.shape[1] // 2, padded.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    smoothed = cv2.bilateralFilter(half, 5, 75, 75)
+    full = cv2.resize(smoothed, (padded.shape[1], padded.shape[0]), interpolation=cv2.INTER_LINEAR)
+    return full[:height, :width]
+
+
+# edge-preserving filters for photos/scans, with how many pixels of context
+# each reads on every side of an output pixel
+IMAGE_DENOISERS = {
+    "bilateral": (lambda image: cv2.bilateralFilter(image, 9, 75, 75), 4),
+    "fast-bilateral": (_fast_bilateral, 8),
+}
+THRESHOLD_BLOCK = 11
+
+# one pool per size asked for, kept for the life of the process; callers
+# settle on one or two sizes (the plan's, a benchmark's --workers)
+_strip_pools: Dict[int, ThreadPoolExecutor] = {}
+
+
+def _get_strip_pool(workers: int) -> ThreadPoolExecutor:
+    pool = _strip_pools.get(workers)
+    if pool is None:
+        pool = _strip_pools.setdefault(
+            workers, ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"strip{workers}")
+        )
+    return pool
+
+
+def map_strips(
+    image: np.ndarray,
+    fn: Callable[[np.ndarray], np.ndarray],
+    halo: int,
+    workers: int,
+    min_rows: int = 256
+) -> np.ndarray:
+    """Runs a neighbourhood filter over horizontal strips of `image` in a thread pool.
+
+    Each strip is read with `halo` extra rows above and below, and only its
+    own rows are kept. When `fn` reads no further than `halo` pixels from the
+    output pixel the stitched result is identical to fn(image). Strip and
+    halo edges fall on multiples of 16 rows, so filters that work at a
+    reduced scale see the same pixel grid. OpenCV releases the GIL, so the
+    strips really run in parallel.
+    """
+    height = image.shape[0]
+    strips = min(workers, height // min_rows)
+    if strips <= 1:
+        return fn(image)
+
+    output = np.empty_like(image)
+    halo = -(-halo // 16) * 16
+    bounds = [min(height, round(height * i / strips / 16) * 16) for i in range(strips + 1)]
+    bounds[-1] = height
+
+    def run(strip: int):
+        top, bottom = bounds[strip], bounds[strip + 1]
+        read_top, read_bottom = max(0, top - halo), min(height, bottom + halo)
+        result = fn(image[read_top:read_bottom])
+        output[top:bottom] = result[top - read_top:bottom - read_top]
+
+    list(_get_strip_pool(workers).map(run, range(strips)))
+    return output
+
+
+@CLEANUP_PAGE_SECONDS.labels(source="image").time()
+def clean_image(image: np.ndarray, workers: int = 1) -> np.ndarray:
+    """Cleaning pass for single image uploads (jpeg/png), already decoded to grayscale.
+
+    Denoising and binarization run strip by strip on `workers` threads.
+    """
+    denoise, denoise_radius = IMAGE_DENOISERS[IMAGE_DENOISE]
+
+    def binarize(strip: np.ndarray) -> np.ndarray:
+        denoised = denoise(strip)
+        return cv2.adaptiveThreshold(
+            denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, THRESHOLD_BLOCK, 2
+        )
+
+    binary = map_strips(image, binarize, denoise_radius + THRESHOLD_BLOCK // 2, workers)
+    return deskew(binary)
+
+
+def preprocessing_fingerprint() -> str:
+    """Everything configurable that changes the cleaned output, for cache keys."""
+    return (
+        f"{PREPROCESSING_VERSION}:{IMAGE_DENOISE}:{DESKEW_MIN_ANGLE}:{DESKEW_MIN_CONFIDENCE}"
+        f":{VECTOR_MAX_NOISE}:{int(VECTOR_PASSTHROUGH)}"
+        f":{TARGET_INTERLINE}:{INTERLINE_PROBE_DPI}:{RENDER_DPI_MIN}:{RENDER_DPI_MAX}"
+    )
+
+
+_page_pool = None
+_page_pool_workers = 0
+
+
+def _init_page_worker():
+    # pages are already spread across processes; letting OpenCV spawn its own
+    # thread pool in each of them only oversubscribes the cores
+    cv2.setNumThreads(1)
+
+
+# one pool per process, reused across scores so workers only pay the
+# cv2/fitz import once. Unlike the strip threads, idle worker processes
+# hold memory, so a call asking for another size replaces the pool rather
+# than adding one; callers clean one document at a time
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    global _page_pool, _page_pool_workers
+    if _page_pool is not None and _page_pool_workers != workers:
+        _page_pool.shutdown(cancel_futures=True)
+        _page_pool = None
+    if _page_pool is None:
+        _page_pool_workers = workers
+        _page_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_page_worker,
+        )
+    return _page_pool
+
+
+def clean_pdf_pages(
+    pdf_path: str, page_count: int, workers: int = 1, first_page: int = 0,
+    classes: Optional[Sequence[PageClass]] = None, scales: Optional[Sequence[PageScale]] = None,
+) -> Iterator[CleanedPage]:
+    """Yields cleaned pages in page order, from `first_page` on.
+
+    `classes` and `scales` are the pages' classify_page and page_scale
+    results when the caller already has them, otherwise each page is
+    classified and measured as it's cleaned.
+
+    With more than one worker and more than one page the pages are rendered
+    and cleaned in a bounded process pool; CLEANUP_WORKERS=1 keeps everything
+    in-process, which is the easiest way to debug a single page.
+    """
+    if workers <= 1 or page_count - first_page <= 1:
+        for page_num in range(first_page, page_count):
+            yield clean_pdf_page(pdf_path, page_num, classes and classes[page_num], scales and scales[page_num])
+        return
+
+    logger.info(f"Cleaning {page_count - first_page} pages with {workers} workers")
+    pool = _get_page_pool(workers)
+    # only a couple of pages per worker are in flight at a time, so finished
+    # pages can't pile up here while the consumer writes an earlier one; the
+    # window is consumed in submission order, which keeps the page order
+    window = deque()
+    for page_num in range(first_page, page_count):
+        window.append(pool.submit(
+            clean_pdf_page, pdf_path, page_num, classes and classes[page_num], scales and scales[page_num]
+        ))
+        if len(window) >= 2 * workers:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
@@ -0,0 +1,100 @@
+import fcntl
+import logging
+import os
+import signal
+import threading
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Job workers and pool dispatchers start Audiveris JVMs (and page pools) of
+# their own. Terminating only the worker would leave those running, each
+# holding its multi-GB heap outside the memory budget, so every worker leads
+# a process group that its children join, and is stopped with the group.
+
+
+def lead_process_group():
+    """Called first thing in a worker: it and everything it starts get their own group."""
+    os.setpgrp()
+
+
+def stop_process_group(process: BaseProcess, timeout: float):
+    """Waits up to `timeout` for a worker to exit (after process.terminate(),
+    see stop_on_sigterm), then kills its whole group.
+
+    Also after a clean exit, so nothing the worker started outlives it.
+    """
+    process.join(timeout)
+    if process.is_alive():
+        logger.warning(f"{process.name} still running after {timeout}s, killing it and its children")
+    try:
+        # the group id is the leader's pid, valid as long as a member is left
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.join()
+
+
+class OwnerLock:
+    """An exclusive lock on a file, for what only one process may run at a time.
+
+    flock based: the kernel drops the lock when the holder exits, however it
+    exits, so a crashed owner never leaves it stuck. The holder's pid is
+    written into the file for whoever wonders who has it.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        """Takes the lock if nobody holds it, without waiting."""
+        if self._file is not None:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        file = open(self.path, "a+")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        file.seek(0)
+        file.truncate()
+        file.write(str(os.getpid()))
+        file.flush()
+        self._file = file
+        return True
+
+    def owner(self) -> Optional[int]:
+        try:
+            return int(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def parent_alive(parent_pid: int) -> bool:
+    """Whether the process that started this one is still there.
+
+    Workers lead their own process group, so they outlive a parent that was
+    killed outright; they check this to stop taking work once it is gone.
+    """
+    return os.getppid() == parent_pid
+
+
+def stop_on_sigterm() -> threading.Event:
+    """Called first thing in a worker: an Event that is set once SIGTERM asks it to stop.
+
+    Rather than a multiprocessing.Event shared with the owner: when a worker
+    is SIGKILLed (the OOM killer) while waiting on one of those, setting it
+    waits forever for that worker to wake up, and the owner hangs in stop().
+    """
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    return stopping
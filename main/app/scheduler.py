@@ -0,0 +1,147 @@
+import logging
+import math
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from .models import Job, JobStatus, Score
+from .config import (
+    JOB_WORKERS, CLEANUP_WORKERS, MEMORY_RESERVED_MB, JVM_OVERHEAD_MB,
+    AUDIVERIS_MIN_HEAP_MB, AUDIVERIS_MAX_HEAP_MB, JOB_QUEUE_LIMIT, JOB_RETRY_AFTER,
+)
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_UNLIMITED = 1 << 60
+
+
+class ResourceBudget(NamedTuple):
+    memory_mb: int
+    cpus: int
+
+
+class ConversionPlan(NamedTuple):
+    slots: int             # conversions (job workers / pool JVMs) running at once
+    heap_mb: int           # JVM heap of each Audiveris run
+    threads: int           # Audiveris threadCount of each run
+    cleanup_workers: int   # page-cleaning processes per job worker
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def cgroup_memory_mb(root: Path = CGROUP_ROOT) -> Optional[int]:
+    # v2 first (memory.max, "max" when unlimited), then v1
+    for path in (root / "memory.max", root / "memory" / "memory.limit_in_bytes"):
+        value = _read(path)
+        if value is None:
+            continue
+        if value == "max" or int(value) >= _UNLIMITED:
+            return None
+        return int(value) // (1024 * 1024)
+    return None
+
+
+def cgroup_cpus(root: Path = CGROUP_ROOT) -> Optional[float]:
+    value = _read(root / "cpu.max")
+    if value is not None:
+        quota, period = value.split()
+        return None if quota == "max" else int(quota) / int(period)
+
+    quota = _read(root / "cpu" / "cpu.cfs_quota_us")
+    period = _read(root / "cpu" / "cpu.cfs_period_us")
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def detect_budget(root: Path = CGROUP_ROOT) -> ResourceBudget:
+    """Memory and CPUs this container may use: the cgroup limits, else the host's."""
+    physical_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    memory_mb = min(cgroup_memory_mb(root) or physical_mb, physical_mb)
+
+    cpus = len(os.sched_getaffinity(0))
+    cgroup_quota = cgroup_cpus(root)
+    if cgroup_quota:
+        # a 2.5 cpu quota still lets 2 busy processes run flat out, not 3
+        cpus = min(cpus, max(1, math.floor(cgroup_quota)))
+    return ResourceBudget(memory_mb=memory_mb, cpus=cpus)
+
+
+def plan_conversions(budget: ResourceBudget, slots: int = 0) -> ConversionPlan:
+    """Splits the budget between concurrent Audiveris runs.
+
+    MEMORY_RESERVED_MB stays with the web process and OpenCV cleanup. From the
+    rest every run needs its heap plus JVM_OVERHEAD_MB (metaspace, native
+    buffers, Tesseract). Without an explicit `slots` as many runs as there
+    are cores go at once, as long as each still gets AUDIVERIS_MIN_HEAP_MB;
+    the heap is then grown up to AUDIVERIS_MAX_HEAP_MB.
+    """
+    available = max(0, budget.memory_mb - MEMORY_RESERVED_MB)
+    if not slots:
+        slots = max(1, min(budget.cpus, available // (AUDIVERIS_MIN_HEAP_MB + JVM_OVERHEAD_MB)))
+
+    heap_mb = min(AUDIVERIS_MAX_HEAP_MB, available // slots - JVM_OVERHEAD_MB)
+    if heap_mb < AUDIVERIS_MIN_HEAP_MB:
+        logger.warning(
+            f"{budget.memory_mb}MB is not enough for {slots} conversion(s) at "
+            f"{AUDIVERIS_MIN_HEAP_MB}MB heap each, the container may run out of memory"
+        )
+        heap_mb = AUDIVERIS_MIN_HEAP_MB
+
+    threads = max(1, budget.cpus // slots)
+    return ConversionPlan(slots=slots, heap_mb=heap_mb, threads=threads, cleanup_workers=threads)
+
+
+@lru_cache(maxsize=None)
+def current_plan() -> ConversionPlan:
+    # JOB_WORKERS / CLEANUP_WORKERS set in the environment win over the budget
+    budget = detect_budget()
+    plan = plan_conversions(budget, slots=JOB_WORKERS)
+    if CLEANUP_WORKERS:
+        plan = plan._replace(cleanup_workers=CLEANUP_WORKERS)
+    logger.info(f"Resource budget {budget}, conversion plan {plan}")
+    return plan
+
+
+def queued_jobs(db: Session) -> int:
+    return db.query(Job).filter(Job.status == JobStatus.QUEUED).count()
+
+
+def mean_conversion_seconds(db: Session, recent: int = 20) -> Optional[float]:
+    rows = (
+        db.query(Score.step_durations)
+        .filter(Score.step_durations.isnot(None))
+        .order_by(Score.id.desc())
+        .limit(recent)
+        .all()
+    )
+    totals = [sum(durations.values()) for durations, in rows if durations]
+    return sum(totals) / len(totals) if totals else None
+
+
+def admission_retry_after(db: Session) -> Optional[int]:
+    """Seconds to ask the client to wait when the queue is full, None to admit.
+
+    The estimate is how long the running slots need to drain the queue back
+    under JOB_QUEUE_LIMIT at the recent average conversion time.
+    """
+    backlog = queued_jobs(db)
+    if backlog < JOB_QUEUE_LIMIT:
+        return None
+
+    per_job = mean_conversion_seconds(db) or JOB_RETRY_AFTER
+    excess = backlog - JOB_QUEUE_LIMIT + 1
+    retry_after = math.ceil(excess * per_job / current_plan().slots)
+    logger.warning(f"Queue full ({backlog} waiting), rejecting upload for {retry_after}s")
+    return min(max(retry_after, 1), 3600)
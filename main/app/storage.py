@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import ContextManager, Iterator, Optional
+
+from .config import (
+    STORAGE_BACKEND, STORAGE_DIR, WORK_DIR, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION,
+)
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+# Originals, cleaned PDFs and MusicXML results are stored under their content
+# hash: <kind>/<ab>/<cd>/<sha256><suffix>. Keys never collide between users or
+# uploads, identical files are stored once, and a key's content never changes,
+# so it can be cached anywhere. The key is what the scores table keeps in
+# original_path, processed_path, xmlmusic_path and output_path.
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(kind: str, sha256: str, suffix: str) -> str:
+    return f"{kind}/{sha256[:2]}/{sha256[2:4]}/{sha256}{suffix.lower()}"
+
+
+def key_sha256(key: str) -> Optional[str]:
+    """The content hash a key was made from, None for paths stored before keys."""
+    if os.path.isabs(key):
+        return None
+    return Path(key).name.split(".", 1)[0]
+
+
+class Storage(ABC):
+    """Where artifacts live. Subclasses implement the abstract primitives below."""
+
+    def put_file(self, path: Path, kind: str, sha256: Optional[str] = None) -> str:
+        """Moves a local file into storage and returns its key; `path` is gone afterwards."""
+        sha256 = sha256 or file_sha256(path)
+        key = make_key(kind, sha256, path.suffix)
+        if self.exists(key):
+            # same bytes already stored, nothing to add
+            path.unlink()
+        else:
+            self._put(path, key)
+        return key
+
+    @abstractmethod
+    def _put(self, path: Path, key: str):
+        """Moves `path` to `key`, which doesn't exist yet."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        ...
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """A path the file can be read at directly, if the backend has one."""
+        return None
+
+    @abstractmethod
+    def local_copy(self, key: str) -> ContextManager[Path]:
+        """A local file with the content of `key` for the duration of a with block, for OpenCV and Audiveris."""
+
+    @abstractmethod
+    def iter_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Streams bytes start..end (inclusive) of `key` in chunks, never the whole file at once."""
+
+
+class LocalStorage(Storage):
+    """Sharded, hash-named files under one directory.
+
+    Absolute paths, which scores converted before storage keys hold, are read
+    as they are.
+    """
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return Path(key) if os.path.isabs(key) else self.root / key
+
+    def _put(self, path: Path, key: str):
+        dest = self._path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # written under a temporary name first, so a reader never sees half a file
+        partial = dest.with_name(f".{dest.name}.{os.getpid()}")
+        shutil.move(str(path), partial)
+        os.replace(partial, dest)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def size(self, key: str) -> int:
+        return self._path(key).stat().st_size
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[Path]:
+        path = self._path(key)
+        if not path.is_file():
+            raise FileNotFoundError(f"No stored file {key}")
+        yield path
+
+    def iter_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+class S3Storage(Storage):
+    """Objects in an S3 compatible bucket (AWS, MinIO, ...).
+
+    Credentials come from boto3's usual sources (AWS_ACCESS_KEY_ID and
+    AWS_SECRET_ACCESS_KEY, a profile, an instance role). Nodes need no shared
+    disk: workers download what they process into WORK_DIR and upload what
+    they produce.
+    """
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None):
+        # only needed with this backend, so not imported at module level
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3, install it or set STORAGE_BACKEND=local") from e
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self._client_error = ClientError
+
+    def _name(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def _put(self, path: Path, key: str):
+        self.client.upload_file(str(path), self.bucket, self._name(key))
+        path.unlink()
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> int:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(f"No stored object {key}")
+        return head["ContentLength"]
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[Path]:
+        WORK_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=WORK_DIR) as tmp:
+            path = Path(tmp) / Path(key).name
+            try:
+                self.client.download_file(self.bucket, self._name(key), str(path))
+            except self._client_error as e:
+                raise FileNotFoundError(f"No stored object {key}") from e
+            yield path
+
+    def iter_bytes(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(Bucket=self.bucket, Key=self._name(key), Range=byte_range)["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> Storage:
+    # one per process; job workers are spawned, so each builds its own client
+    if STORAGE_BACKEND == "s3":
+        if not S3_BUCKET:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+        logger.info(f"Storing artifacts in s3://{S3_BUCKET}/{S3_PREFIX}")
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected local or s3")
+    return LocalStorage(STORAGE_DIR)
@@ -0,0 +1,172 @@
+"""p50/p99 latency of /health and /scores/ while uploads are in progress.
+
+    python -m benchmarks.bench_async_db --uploaders 4 --seconds 10
+
+Builds a throwaway database (one user, --scores converted scores) and drives
+the app in-process through httpx's ASGI transport, so everything shares the
+one event loop the way it does under uvicorn: any database call made on the
+loop holds up every other request. --probes clients alternate between
+/health and /scores/ for --seconds, first on their own ("idle") and then
+with --uploaders clients posting distinct synthetic score pages back to
+back ("uploading"). No job workers run, the uploads only queue; instead
+--writer-hold-ms has another connection hold an exclusive lock for that long
+every --writer-interval-ms, like a job worker committing a large write, so
+requests wait on the lock now and then (0 turns it off). Readers only wait
+for it without WAL; run with DB_JOURNAL_MODE=DELETE to see handlers that
+query on the event loop stall everything else meanwhile.
+
+Uploaded files land in the app's storage and are removed afterwards (local
+storage only).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+# read by the app at import
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("JOB_QUEUE_LIMIT", "1000000")
+
+import cv2
+import httpx
+
+from app.auth_utils import create_access_token
+from app.database import Base, SessionLocal, async_engine, engine
+from app.main import app
+from app.models import Score, User
+from app.storage import get_storage
+from benchmarks.synthetic import draw_score
+
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(1000 * statistics.median(latencies), 2),
+        "p99_ms": round(1000 * latencies[int(0.99 * (len(latencies) - 1))], 2),
+    }
+
+
+def hold_write_lock(args, stop: threading.Event):
+    connection = sqlite3.connect("data/scores.db", isolation_level=None, timeout=30)
+    while not stop.wait(args.writer_interval_ms / 1000):
+        connection.execute("BEGIN EXCLUSIVE")
+        stop.wait(args.writer_hold_ms / 1000)
+        connection.execute("COMMIT")
+    connection.close()
+
+
+async def drive(client, args, page: bytes, uploaders: int) -> dict:
+    latencies = defaultdict(list)
+    uploads = []
+    deadline = perf_counter() + args.seconds
+
+    async def probe(offset: int):
+        i = offset
+        while perf_counter() < deadline:
+            path = ("/health", "/scores/")[i % 2]
+            started = perf_counter()
+            response = await client.get(path)
+            latencies[path].append(perf_counter() - started)
+            assert response.status_code == 200, (path, response.status_code)
+            i += 1
+
+    async def upload(n: int):
+        i = 0
+        while perf_counter() < deadline:
+            # a trailing chunk makes every upload distinct, no result cache hits
+            body = page + f"{n}-{i}".encode()
+            started = perf_counter()
+            response = await client.post(
+                "/upload_sheet_music/", files={"file": (f"bench_{n}_{i}.png", body, "image/png")}
+            )
+            uploads.append(perf_counter() - started)
+            assert response.status_code == 202, response.text
+            i += 1
+
+    stop = threading.Event()
+    if args.writer_hold_ms and uploaders:
+        threading.Thread(target=hold_write_lock, args=(args, stop), daemon=True).start()
+
+    started = perf_counter()
+    await asyncio.gather(
+        *(probe(n) for n in range(args.probes)),
+        *(upload(n) for n in range(uploaders)),
+    )
+    elapsed = perf_counter() - started
+    stop.set()
+    result = {path: percentiles(values) for path, values in sorted(latencies.items())}
+    if uploads:
+        result["/upload_sheet_music/"] = {**percentiles(uploads), "per_s": round(len(uploads) / elapsed, 1)}
+    return result
+
+
+async def run(args, workdir: str) -> dict:
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        user = User(username="bench", hashed_password="x")
+        db.add(user)
+        db.commit()
+        for i in range(args.scores):
+            db.add(Score(
+                original_path=f"{workdir}/{i}.pdf",
+                processed_path=f"{workdir}/{i}_clean.pdf",
+                xmlmusic_path=f"{workdir}/xml_{i}",
+                user_id=user.id,
+                status="done",
+            ))
+        db.commit()
+        token = create_access_token(data={"sub": str(user.id)})
+
+    image = draw_score(args.width, int(args.width * 1.414))
+    page = cv2.imencode(".png", image)[1].tobytes()
+
+    transport = httpx.ASGITransport(app=app)
+    cookies = {"access_token": f"Bearer {token}"}
+    results = {"upload_bytes": len(page)}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=cookies) as client:
+        for phase, uploaders in (("idle", 0), ("uploading", args.uploaders)):
+            results[phase] = await drive(client, args, page, uploaders)
+    # no lifespan through the ASGI transport, so nothing else closes the pool
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scores", type=int, default=200, help="converted scores in the database")
+    parser.add_argument("--probes", type=int, default=4, help="clients on /health and /scores/")
+    parser.add_argument("--uploaders", type=int, default=4, help="clients uploading")
+    parser.add_argument("--width", type=int, default=1240, help="width of the uploaded page in pixels")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--writer-hold-ms", type=float, default=50.0, help="how long the other writer holds the lock")
+    parser.add_argument("--writer-interval-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        # the database url is relative to the working directory
+        os.chdir(workdir)
+        os.mkdir("data")
+        try:
+            results = asyncio.run(run(args, workdir))
+        finally:
+            storage = get_storage()
+            with SessionLocal() as db:
+                for (key,) in db.query(Score.original_path).filter(Score.original_path.like("originals/%")):
+                    path = storage.local_path(key)
+                    if path is not None:
+                        path.unlink(missing_ok=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
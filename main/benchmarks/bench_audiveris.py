@@ -0,0 +1,93 @@
+"""Cold vs pooled Audiveris latency per score.
+
+Runs inside the container (needs the Audiveris install):
+
+    python -m benchmarks.bench_audiveris data/store/processed/<ab>/<cd>/<sha256>.pdf --scores 6
+
+"cold" converts the scores one after the other with one JVM each, the way
+AUDIVERIS_MODE=cold does. "pool" submits them all at once to an
+AudiverisPool, the way concurrent job workers do with AUDIVERIS_MODE=pool.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import threading
+from pathlib import Path
+from time import perf_counter
+
+from app.audiveris import AudiverisConverter
+from app.audiveris_pool import AudiverisPool, submit
+from app.config import AUDIVERIS_PATH
+
+
+def summarize(latencies, wall):
+    return {
+        "scores": len(latencies),
+        "mean_s": round(statistics.mean(latencies), 2),
+        "p50_s": round(statistics.median(latencies), 2),
+        "max_s": round(max(latencies), 2),
+        "wall_s": round(wall, 2),
+    }
+
+
+def bench_cold(pdf: Path, scores: int, workdir: Path):
+    converter = AudiverisConverter(AUDIVERIS_PATH)
+    latencies = []
+    started = perf_counter()
+    for i in range(scores):
+        output_dir = workdir / f"cold_{i}"
+        output_dir.mkdir()
+        t0 = perf_counter()
+        if converter.convert_to_musicxml(str(pdf), str(output_dir)) is None:
+            raise SystemExit(f"cold conversion {i} failed")
+        latencies.append(perf_counter() - t0)
+    return summarize(latencies, perf_counter() - started)
+
+
+def bench_pool(pdf: Path, scores: int, workdir: Path, size: int, batch: int):
+    pool = AudiverisPool(size=size, batch_size=batch)
+    pool.start()
+    latencies = [None] * scores
+
+    def convert(i):
+        t0 = perf_counter()
+        if submit(str(pdf), str(workdir / f"pool_{i}")) is None:
+            raise SystemExit(f"pooled conversion {i} failed")
+        latencies[i] = perf_counter() - t0
+
+    try:
+        threads = [threading.Thread(target=convert, args=(i,)) for i in range(scores)]
+        started = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = perf_counter() - started
+    finally:
+        pool.stop()
+    return summarize(latencies, wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", type=Path, help="a cleaned score to convert repeatedly")
+    parser.add_argument("--scores", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_audiveris_"))
+    try:
+        results = {
+            "cold": bench_cold(args.pdf, args.scores, workdir),
+            "pool": bench_pool(args.pdf, args.scores, workdir, args.pool_size, args.batch),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
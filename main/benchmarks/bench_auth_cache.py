@@ -0,0 +1,114 @@
+"""Requests per second on authenticated pages with the auth cache on and off.
+
+    python -m benchmarks.bench_auth_cache --scores 50 --clients 8 --seconds 5
+
+Builds a throwaway database (one user, --scores converted scores) in a
+temporary directory and drives the app in-process through httpx's ASGI
+transport, so only the app is measured, no sockets or server. --clients
+requests are kept in flight on --paths for --seconds, first with
+AUTH_CACHE_TTL=0 (JWT decode and a user query on every request, as before)
+and then with the cache on. Logging is set to WARNING for both.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+from time import perf_counter
+
+# read by auth_utils at import
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import httpx
+
+from app import auth_cache
+from app.auth_utils import create_access_token
+from app.database import Base, SessionLocal, async_engine, engine
+from app.main import app
+from app.models import Score, User
+
+
+async def drive(client, paths: list, clients: int, seconds: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = perf_counter() + seconds
+
+    async def client_loop(offset: int):
+        nonlocal errors
+        i = offset
+        while perf_counter() < deadline:
+            started = perf_counter()
+            response = await client.get(paths[i % len(paths)])
+            latencies.append(perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+            i += 1
+
+    started = perf_counter()
+    await asyncio.gather(*(client_loop(n) for n in range(clients)))
+    elapsed = perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(1000 * statistics.median(latencies), 2),
+        "p99_ms": round(1000 * latencies[int(0.99 * (len(latencies) - 1))], 2),
+    }
+
+
+async def run(args, workdir: str) -> list:
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        user = User(username="bench", hashed_password="x")
+        db.add(user)
+        db.commit()
+        for i in range(args.scores):
+            db.add(Score(
+                original_path=f"{workdir}/{i}.pdf",
+                processed_path=f"{workdir}/{i}_clean.pdf",
+                xmlmusic_path=f"{workdir}/xml_{i}",
+                user_id=user.id,
+            ))
+        db.commit()
+        token = create_access_token(data={"sub": str(user.id)})
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    cookies = {"access_token": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=cookies) as client:
+        for mode, ttl in (("off", 0), ("on", args.ttl)):
+            for cache in (auth_cache.token_cache, auth_cache.user_cache):
+                cache.ttl = ttl
+                cache.clear()
+            await drive(client, args.paths, args.clients, 1.0)  # warm up
+            result = await drive(client, args.paths, args.clients, args.seconds)
+            results.append({"cache": mode, "ttl": ttl, **result})
+    # no lifespan through the ASGI transport, so nothing else closes the pool
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scores", type=int, default=50, help="converted scores listed on /scores/")
+    parser.add_argument("--paths", nargs="+", default=["/scores/"])
+    parser.add_argument("--clients", type=int, default=8, help="requests in flight")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--ttl", type=float, default=30.0, help="AUTH_CACHE_TTL for the cached run")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        # the database url is relative to the working directory
+        os.chdir(workdir)
+        os.mkdir("data")
+        results = asyncio.run(run(args, workdir))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
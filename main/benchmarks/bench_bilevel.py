@@ -0,0 +1,101 @@
+"""8-bit vs 1-bit cleaned PDFs: size, write time, decode time.
+
+    python -m benchmarks.bench_bilevel --pages 20
+    python -m benchmarks.bench_bilevel --pdf data/store/originals/<ab>/<cd>/<sha256>.pdf --audiveris
+
+Cleans the pages once, then writes them with StreamingPdfWriter as all
+8-bit (how processed PDFs used to be stored) and with 1-bit pages where the
+page is pure black and white. Only pages clean_page_image binarizes (low
+contrast ones, without a skew correction) come out pure black and white;
+pages it judges clean keep their gray levels either way.
+
+"decode" reads every page image back out of the file, which is what
+Audiveris's LOAD step starts with; every decoded page is checked against
+the cleaned pixels. --audiveris also converts both files (needs the
+Audiveris install) for the end-to-end time.
+"""
+import argparse
+import json
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import fitz
+import numpy as np
+
+from app.audiveris import AudiverisConverter
+from app.config import AUDIVERIS_PATH
+from app.pdf_writer import StreamingPdfWriter
+from app.preprocessing import clean_pdf_pages
+from benchmarks.synthetic import make_score_pdf
+
+
+def decode_pages(path: Path) -> list:
+    images = []
+    with fitz.open(str(path)) as doc:
+        for page in doc:
+            xref = page.get_images()[0][0]
+            pix = fitz.Pixmap(doc, xref)
+            images.append(np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).copy())
+    return images
+
+
+def run(pages: list, output: Path, bilevel: bool, audiveris: bool) -> dict:
+    started = perf_counter()
+    with StreamingPdfWriter(output, bilevel=bilevel) as writer:
+        for page in pages:
+            writer.add_page(page.image, page.width, page.height)
+    write_s = perf_counter() - started
+
+    started = perf_counter()
+    decoded = decode_pages(output)
+    decode_s = perf_counter() - started
+
+    result = {
+        "mode": "1-bit" if bilevel else "8-bit",
+        "pages": len(pages),
+        "bilevel_pages": writer.bilevel_pages,
+        "size_kb": output.stat().st_size // 1024,
+        "write_s": round(write_s, 3),
+        "decode_s": round(decode_s, 3),
+        "pixel_identical": all(np.array_equal(a, page.image) for a, page in zip(decoded, pages)),
+    }
+    if audiveris:
+        converter = AudiverisConverter(AUDIVERIS_PATH)
+        started = perf_counter()
+        converter.convert_to_musicxml(str(output), str(output.parent / f"out_{result['mode']}"))
+        result["audiveris_s"] = round(perf_counter() - started, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", type=Path, help="PDF to clean (default: generated score)")
+    parser.add_argument("--pages", type=int, default=20, help="pages of the generated score")
+    parser.add_argument(
+        "--ink", type=float, default=0.6,
+        help="gray level of the generated notation; faded (the default) is binarized, "
+             "black ink is judged clean and kept 8-bit"
+    )
+    parser.add_argument("--audiveris", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        pdf_path = args.pdf
+        if pdf_path is None:
+            pdf_path = workdir / "score.pdf"
+            make_score_pdf(pdf_path, args.pages, ink=args.ink)
+        with fitz.open(str(pdf_path)) as doc:
+            page_count = len(doc)
+        pages = list(clean_pdf_pages(str(pdf_path), page_count))
+
+        results = [
+            run(pages, workdir / "gray.pdf", bilevel=False, audiveris=args.audiveris),
+            run(pages, workdir / "bilevel.pdf", bilevel=True, audiveris=args.audiveris),
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
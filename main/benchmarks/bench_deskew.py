@@ -0,0 +1,124 @@
+"""Skew estimation speed and accuracy on synthetically rotated scores.
+
+    python -m benchmarks.bench_deskew --pages 3
+
+Renders generated score pages at 300 dpi, binarizes them, rotates each by a
+set of known angles and estimates the skew back with:
+
+- "hough": full resolution Canny + HoughLines(150) and the median line
+  angle, what clean_page_image used before
+- "profile": preprocessing.estimate_skew
+
+Reports the absolute error against the applied angle and the time per
+estimate. --noise flips that fraction of the pixels after rotating, a rough
+stand-in for a scan. The straight pages (0 deg) also show whether an
+estimator would make deskew() rotate a page that needs no rotation.
+"""
+import argparse
+import json
+import statistics
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import fitz
+import numpy as np
+
+from app.config import DESKEW_MIN_ANGLE, DESKEW_MIN_CONFIDENCE
+from app.preprocessing import estimate_skew
+from benchmarks.synthetic import make_score_pdf
+
+ANGLES = [-8.0, -5.0, -3.0, -1.5, -0.7, -0.3, 0.0, 0.3, 0.7, 1.5, 3.0, 5.0, 8.0]
+
+
+def straight_pages(count: int) -> list:
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = Path(workdir) / "score.pdf"
+        make_score_pdf(pdf_path, count)
+        pages = []
+        with fitz.open(str(pdf_path)) as doc:
+            for page in doc:
+                pix = page.get_pixmap(dpi=300, colorspace=fitz.csGRAY, alpha=False)
+                gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+                pages.append(np.where(gray > 128, 255, 0).astype(np.uint8))
+    return pages
+
+
+def add_noise(binary: np.ndarray, fraction: float, rng: np.random.Generator) -> np.ndarray:
+    flip = rng.random(binary.shape) < fraction
+    return np.where(flip, 255 - binary, binary).astype(np.uint8)
+
+
+def rotate(binary: np.ndarray, angle: float) -> np.ndarray:
+    center = (binary.shape[1] // 2, binary.shape[0] // 2)
+    rot_mat = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(
+        binary, rot_mat, (binary.shape[1], binary.shape[0]),
+        flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=255
+    )
+
+
+def hough_skew(binary: np.ndarray) -> float:
+    edges = cv2.Canny(binary, 50, 150, apertureSize=3)
+    lines = cv2.HoughLines(edges, 1, np.pi / 180, 150)
+    if lines is None:
+        return 0.0
+    # the old code rotated by (median - 90) to straighten, i.e. it took the
+    # page to be tilted by 90 - median
+    return 90.0 - float(np.degrees(np.median([line[0][1] for line in lines])))
+
+
+def summarize(errors: list, times: list) -> dict:
+    errors = sorted(errors)
+    return {
+        "mean_abs_error_deg": round(statistics.mean(errors), 3),
+        "p95_abs_error_deg": round(errors[int(0.95 * (len(errors) - 1))], 3),
+        "max_abs_error_deg": round(errors[-1], 3),
+        "mean_ms": round(1000 * statistics.mean(times), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=0.0, help="fraction of pixels flipped")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    cv2.setNumThreads(1)
+    results = {"hough": ([], []), "profile": ([], [])}
+    rows = []
+    for page_num, page in enumerate(straight_pages(args.pages)):
+        for angle in ANGLES:
+            skewed = rotate(page, angle)
+            if args.noise:
+                skewed = add_noise(skewed, args.noise, rng)
+
+            started = perf_counter()
+            hough = hough_skew(skewed)
+            results["hough"][1].append(perf_counter() - started)
+            results["hough"][0].append(abs(hough - angle))
+
+            started = perf_counter()
+            profile = estimate_skew(skewed)
+            results["profile"][1].append(perf_counter() - started)
+            results["profile"][0].append(abs(profile.angle - angle))
+
+            rows.append({
+                "page": page_num,
+                "applied_deg": angle,
+                "hough_deg": round(hough, 2),
+                "profile_deg": profile.angle,
+                "confidence": profile.confidence,
+                "rotates": abs(profile.angle) >= DESKEW_MIN_ANGLE and profile.confidence >= DESKEW_MIN_CONFIDENCE,
+            })
+
+    print(json.dumps({
+        "estimates": rows,
+        "summary": {name: summarize(*values) for name, values in results.items()},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Monolithic vs tiled denoise + binarize for large single-image uploads.
+
+    python -m benchmarks.bench_image_tiling --width 4000 --height 6000 --workers 4
+
+Generates a noisy, unevenly lit photo of a score page and runs the
+denoise + adaptiveThreshold part of clean_image:
+
+- "monolithic": one call over the whole image, as before
+- "tiled": preprocessing.map_strips over --workers threads
+
+for both IMAGE_DENOISERS. Tiled output is compared pixel by pixel with the
+monolithic one, and both are scored against the ink of the page before the
+noise and lighting were added. OpenCV's own threading is set to 1 so the
+speedup is the strips' alone.
+"""
+import argparse
+import json
+import os
+import statistics
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from app.preprocessing import IMAGE_DENOISERS, THRESHOLD_BLOCK, map_strips
+from benchmarks.synthetic import make_photo
+
+
+def binarizer(denoise):
+    def binarize(strip):
+        return cv2.adaptiveThreshold(
+            denoise(strip), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, THRESHOLD_BLOCK, 2
+        )
+    return binarize
+
+
+def timed(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        started = perf_counter()
+        result = fn()
+        times.append(perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=6000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    image, ink = make_photo(args.width, args.height)
+    results = []
+    for name, (denoise, radius) in IMAGE_DENOISERS.items():
+        binarize = binarizer(denoise)
+        mono, mono_s = timed(lambda: binarize(image), args.repeat)
+        tiled, tiled_s = timed(
+            lambda: map_strips(image, binarize, radius + THRESHOLD_BLOCK // 2, args.workers), args.repeat
+        )
+        found = mono == 0
+        results.append({
+            "filter": name,
+            "workers": args.workers,
+            "monolithic_s": round(mono_s, 3),
+            "tiled_s": round(tiled_s, 3),
+            "speedup": round(mono_s / tiled_s, 2),
+            "tiled_pixels_differing": int(np.count_nonzero(mono != tiled)),
+            "error_vs_truth_pct": round(100 * np.count_nonzero(found != ink) / image.size, 2),
+            "missed_ink_pct": round(100 * np.count_nonzero(ink & ~found) / np.count_nonzero(ink), 2),
+        })
+
+    bilateral_s = results[0]["monolithic_s"]
+    for result in results:
+        result["vs_bilateral_monolithic"] = round(bilateral_s / result["tiled_s"], 2)
+    print(json.dumps({"image": f"{args.width}x{args.height}", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Upload ingestion throughput under concurrent uploads.
+
+    python -m benchmarks.bench_ingest --uploads 16 --size-mb 8
+
+"legacy" is the handler as it was: a fresh Magic() over a NamedTemporaryFile
+for the type check, then 1 KB blocking writes inside the coroutine. "ingest"
+is app.ingest.ingest_upload. Both run the same number of uploads at once on
+one event loop, next to a ticker task that should wake every 10 ms; how late
+it wakes up is what every other client of the server would feel.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import statistics
+import tempfile
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+
+from magic import Magic
+from starlette.datastructures import UploadFile
+
+from app.ingest import ingest_upload
+
+TICK = 0.01
+
+
+async def legacy_upload(file: UploadFile, dest_dir: Path, max_size: int):
+    with NamedTemporaryFile(delete=True) as tmp:
+        tmp.write(await file.read(2048))
+        tmp.flush()
+        Magic(mime=True).from_file(tmp.name)
+    await file.seek(0)
+
+    file_size = 0
+    hasher = hashlib.sha256()
+    with open(dest_dir / file.filename, "wb") as buffer:
+        while chunk := await file.read(1024):
+            file_size += len(chunk)
+            if file_size > max_size:
+                raise ValueError("too large")
+            hasher.update(chunk)
+            buffer.write(chunk)
+    return hasher.hexdigest()
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(perf_counter() - started - TICK)
+
+
+def make_uploads(payload: bytes, count: int):
+    # SpooledTemporaryFile rolled to disk, like starlette does for anything over 1 MB
+    uploads = []
+    for i in range(count):
+        spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        spool.write(payload)
+        spool.seek(0)
+        uploads.append(UploadFile(spool, size=len(payload), filename=f"upload_{i}.pdf"))
+    return uploads
+
+
+async def run(mode: str, payload: bytes, uploads: int, dest_dir: Path):
+    files = make_uploads(payload, uploads)
+    max_size = len(payload) + 1
+    stop = asyncio.Event()
+    lags = []
+    tick_task = asyncio.create_task(ticker(stop, lags))
+
+    started = perf_counter()
+    if mode == "legacy":
+        await asyncio.gather(*(legacy_upload(f, dest_dir, max_size) for f in files))
+    else:
+        await asyncio.gather(*(ingest_upload(f, dest_dir, max_size) for f in files))
+    wall = perf_counter() - started
+
+    stop.set()
+    await tick_task
+    for f in files:
+        f.file.close()
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "mode": mode,
+        "uploads": uploads,
+        "wall_s": round(wall, 3),
+        "throughput_mb_s": round(uploads * len(payload) / wall / (1024 * 1024), 1),
+        "loop_lag_p50_ms": round(statistics.median(lags_ms), 1),
+        "loop_lag_max_ms": round(lags_ms[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=16, help="concurrent uploads")
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # a PDF header so the sniff succeeds, random bytes after it
+    payload = b"%PDF-1.4\n" + os.urandom(int(args.size_mb * 1024 * 1024))
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ("legacy", "ingest"):
+            for _ in range(args.repeat):
+                dest_dir = Path(workdir) / mode
+                dest_dir.mkdir()
+                results.append(asyncio.run(run(mode, payload, args.uploads, dest_dir)))
+                shutil.rmtree(dest_dir)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
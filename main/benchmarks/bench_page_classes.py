@@ -0,0 +1,92 @@
+"""Cleanup time per document kind, every page cleaned like a scan vs by page class.
+
+    python -m benchmarks.bench_page_classes --pages 10
+    python -m benchmarks.bench_page_classes --pdf data/store/originals/<ab>/<cd>/<sha256>.pdf
+
+Generates a vector score (make_score_pdf), a noisy scan of one
+(make_raster_pdf) and a document with half of each, or takes --pdf. For
+each it times classify_pdf, then cleaning every page with clean_page_image
+("as_scan", how all pages used to go) and cleaning by class ("by_class":
+clean vector pages only thresholded, the rest as before). A document that
+is clean vector throughout is passed through without rendering when
+VECTOR_PASSTHROUGH is on, "passthrough" is then true and its cleanup costs
+the classification alone.
+"""
+import argparse
+import json
+import tempfile
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+
+import fitz
+
+from app.classifier import SCANNED, classify_pdf
+from app.config import VECTOR_PASSTHROUGH
+from app.preprocessing import clean_pdf_pages
+from benchmarks.synthetic import make_raster_pdf, make_score_pdf
+
+
+def time_cleanup(pdf_path: Path, page_count: int, classes: list, repeat: int) -> float:
+    # best of `repeat`, one worker so the pages don't compete for cores
+    timings = []
+    for _ in range(repeat):
+        started = perf_counter()
+        for _ in clean_pdf_pages(str(pdf_path), page_count, workers=1, classes=classes):
+            pass
+        timings.append(perf_counter() - started)
+    return min(timings)
+
+
+def run(name: str, pdf_path: Path, repeat: int) -> dict:
+    started = perf_counter()
+    classes = classify_pdf(str(pdf_path))
+    classify_s = perf_counter() - started
+    page_count = len(classes)
+    passthrough = VECTOR_PASSTHROUGH and all(page_class.clean_vector for page_class in classes)
+
+    as_scan = [page_class._replace(kind=SCANNED) for page_class in classes]
+    as_scan_s = time_cleanup(pdf_path, page_count, as_scan, repeat)
+    by_class_s = classify_s if passthrough else classify_s + time_cleanup(pdf_path, page_count, classes, repeat)
+    return {
+        "document": name,
+        "pages": page_count,
+        "classes": dict(Counter(page_class.kind for page_class in classes)),
+        "clean_vector": sum(page_class.clean_vector for page_class in classes),
+        "passthrough": passthrough,
+        "classify_ms_per_page": round(1000 * classify_s / page_count, 1),
+        "as_scan_s": round(as_scan_s, 3),
+        "by_class_s": round(by_class_s, 3),
+        "speedup": round(as_scan_s / by_class_s, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", type=Path, help="PDF to clean (default: generated documents)")
+    parser.add_argument("--pages", type=int, default=10, help="pages of each generated document")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--noise", type=float, default=12.0, help="sensor noise of the generated scan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        if args.pdf is not None:
+            documents = {args.pdf.name: args.pdf}
+        else:
+            documents = {"vector": workdir / "vector.pdf", "scanned": workdir / "scanned.pdf",
+                         "mixed": workdir / "mixed.pdf"}
+            make_score_pdf(documents["vector"], args.pages)
+            make_raster_pdf(documents["scanned"], args.pages, noise=args.noise)
+            half = args.pages // 2
+            with fitz.open() as mixed, fitz.open(str(documents["vector"])) as vector, \
+                    fitz.open(str(documents["scanned"])) as scanned:
+                mixed.insert_pdf(vector, to_page=half - 1)
+                mixed.insert_pdf(scanned, from_page=half)
+                mixed.save(str(documents["mixed"]))
+        results = [run(name, path, args.repeat) for name, path in documents.items()]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
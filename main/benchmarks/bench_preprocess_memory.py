@@ -0,0 +1,96 @@
+"""Peak memory of PDF preprocessing against page count.
+
+    python -m benchmarks.bench_preprocess_memory --pages 10 50 100
+
+Generates a vector score PDF with the largest page count (every page
+different, so nothing gets deduplicated) and cleans its first N pages in a
+fresh process per run, reporting that process's peak RSS:
+
+- "legacy": RGB render, cvtColor, Pixmap from .tobytes() and one fitz
+  document kept open until save(), the way clean_up used to work
+- "streaming": clean_pdf_pages (grayscale render over samples_mv) into a
+  StreamingPdfWriter, the way clean_up works now
+
+Runs serially (--workers 1) by default so the number is the memory of the
+whole pass in one process.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import fitz
+import numpy as np
+
+from app.pdf_writer import StreamingPdfWriter
+from app.preprocessing import clean_pdf_pages, clean_page_image
+from benchmarks.synthetic import make_score_pdf
+
+
+def legacy_clean(pdf_path: str, pages: int, output: Path):
+    new_doc = fitz.open()
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(pages):
+            page = doc.load_page(page_num)
+            pix = page.get_pixmap(dpi=300, alpha=False)
+            image_np = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+            binary, _ = clean_page_image(cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY))
+            pixmap = fitz.Pixmap(fitz.csGRAY, binary.shape[1], binary.shape[0], binary.ravel().tobytes())
+            new_page = new_doc.new_page(width=page.rect.width, height=page.rect.height)
+            new_page.insert_image(new_page.rect, pixmap=pixmap)
+    new_doc.save(str(output))
+    new_doc.close()
+
+
+def streaming_clean(pdf_path: str, pages: int, output: Path, workers: int):
+    with StreamingPdfWriter(output) as writer:
+        for page in clean_pdf_pages(pdf_path, pages, workers=workers):
+            writer.add_page(page.image, page.width, page.height)
+
+
+def run_one(mode: str, pdf_path: str, pages: int, workers: int, queue):
+    output = Path(pdf_path).with_name(f"{mode}_{pages}.pdf")
+    started = perf_counter()
+    if mode == "legacy":
+        legacy_clean(pdf_path, pages, output)
+    else:
+        streaming_clean(pdf_path, pages, output, workers)
+    elapsed = perf_counter() - started
+    queue.put({
+        "mode": mode,
+        "pages": pages,
+        "seconds": round(elapsed, 2),
+        "s_per_page": round(elapsed / pages, 3),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "output_mb": round(output.stat().st_size / (1024 * 1024), 2),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--workers", type=int, default=1, help="page workers for the streaming mode")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = Path(workdir) / "score.pdf"
+        make_score_pdf(pdf_path, max(args.pages))
+        for mode in ("legacy", "streaming"):
+            for pages in args.pages:
+                queue = ctx.Queue()
+                process = ctx.Process(target=run_one, args=(mode, str(pdf_path), pages, args.workers, queue))
+                process.start()
+                results.append(queue.get())
+                process.join()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Per-stage timing and memory of the cleaning pass on synthetic score pages.
+
+    python -m benchmarks.bench_preprocess_stages --pages 5 --output before.json
+    python -m benchmarks.bench_preprocess_stages --pages 5 --baseline before.json
+
+Generates one input per case (see CASES) with benchmarks.synthetic and runs
+the same stage functions clean_up uses, one at a time, timing each:
+
+- PDF pages (clean_pdf_page + clean_page_image): classify (classify_page),
+  probe (page_scale, the interline on a low dpi render), render (get_pixmap
+  at the probed dpi, straight to gray), gray (wrapping the pixmap's samples
+  as an array; the old RGB render + cvtColor is gone), check (the interline
+  of the full render), then vector (the threshold clean vector pages get)
+  or branch (the std_dev decision), copy (clean pages only), blur_clahe,
+  threshold, skew (estimate_skew, which replaced Canny + HoughLines), warp
+  (only when deskew would rotate), and write (StreamingPdfWriter.add_page,
+  which replaced fitz Pixmap + save). A page whose full render misses the
+  target interline is rendered again in clean_pdf_page, not here
+- image uploads (clean_image): decode, denoise, threshold, skew, warp, write.
+  Denoise and threshold run as one call over the whole image, as
+  clean_image does with one worker
+
+Each case runs in a fresh process with --threads OpenCV threads (1 by
+default, like the page workers). Memory is the tracemalloc peak above the
+stage's starting point, which covers numpy and OpenCV arrays but not
+MuPDF's own pixmaps, plus the process's peak RSS.
+
+--output writes the results as JSON. --baseline compares against an
+earlier --output and exits 1 when a stage's mean time or a case's peak
+memory grew by more than --tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import tracemalloc
+from collections import Counter, defaultdict
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import fitz
+import numpy as np
+
+from app.config import IMAGE_DENOISE
+from app.pdf_writer import StreamingPdfWriter
+from app.classifier import classify_page
+from app.interline import measure_staff_scale, page_scale, page_size_pt
+from app.preprocessing import (
+    IMAGE_DENOISERS,
+    PREPROCESSING_VERSION,
+    RENDER_DPI,
+    THRESHOLD_BLOCK,
+    binarize_page,
+    enhance_contrast,
+    estimate_skew,
+    looks_clean,
+    rotate_page,
+    should_rotate,
+    threshold_vector_page,
+)
+from benchmarks.synthetic import degrade, draw_score, make_raster_pdf, make_score_pdf
+
+# name: (kind, generator arguments)
+CASES = {
+    # exported from notation software, black vector ink
+    "born_digital": ("vector", {"ink": 0.0}),
+    # vector pages printed in faded gray, low contrast
+    "faded_print": ("vector", {"ink": 0.6}),
+    # a decent flatbed scan
+    "scan": ("raster", {"contrast": 0.8, "skew": 1.5, "blur": 0.8, "noise": 8}),
+    # a poor scan: faded, skewed, blurry and grainy
+    "noisy_scan": ("raster", {"contrast": 0.35, "skew": 3.0, "blur": 1.2, "lighting": 40, "noise": 25}),
+    # a 12 MP phone photo, uploaded as a jpeg
+    "phone_photo": ("photo", {"contrast": 0.8, "skew": 2.0, "lighting": 100, "noise": 12}),
+}
+PHOTO_SIZE = (3024, 4032)
+
+
+class StageTimer:
+    """Times named stages of one page and their traced memory peaks."""
+
+    def __init__(self):
+        self.times = {}
+        self.peaks = {}
+
+    def __call__(self, name: str, fn, *args):
+        start_traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        started = perf_counter()
+        result = fn(*args)
+        self.times[name] = perf_counter() - started
+        self.peaks[name] = tracemalloc.get_traced_memory()[1] - start_traced
+        return result
+
+
+def make_input(kind: str, options: dict, pages: int, workdir: Path) -> list:
+    """Writes the case's input(s) and returns their paths."""
+    if kind == "vector":
+        path = workdir / "vector.pdf"
+        make_score_pdf(path, pages, ink=options["ink"])
+        return [path]
+    if kind == "raster":
+        path = workdir / "raster.pdf"
+        make_raster_pdf(path, pages, **options)
+        return [path]
+    paths = []
+    width, height = PHOTO_SIZE
+    for page_num in range(pages):
+        photo = degrade(draw_score(width, height, page_num, paper=235, ink=40), page_num, **options)
+        path = workdir / f"photo_{page_num}.jpg"
+        cv2.imwrite(str(path), photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+def pdf_pages(pdf_path: Path, writer: StreamingPdfWriter):
+    with fitz.open(str(pdf_path)) as doc:
+        for page_num in range(len(doc)):
+            timer = StageTimer()
+            page = doc.load_page(page_num)
+            page_class = timer("classify", classify_page, page)
+            scale = timer("probe", page_scale, page, RENDER_DPI)
+            pix = timer("render", lambda: page.get_pixmap(dpi=scale.dpi, colorspace=fitz.csGRAY, alpha=False))
+            image = timer("gray", lambda: np.ndarray(
+                (pix.height, pix.width), dtype=np.uint8, buffer=pix.samples_mv, strides=(pix.stride, 1)
+            ))
+            if scale.interline_pt is not None:
+                timer("check", measure_staff_scale, image)
+            if page_class.clean_vector:
+                cleaned = timer("vector", threshold_vector_page, image)
+                timer("write", writer.add_page, cleaned, *page_size_pt(cleaned))
+                yield "vector", timer
+                continue
+            clean, _ = timer("branch", looks_clean, image)
+            if clean:
+                cleaned = timer("copy", image.copy)
+            else:
+                enhanced = timer("blur_clahe", enhance_contrast, image)
+                cleaned = timer("threshold", binarize_page, enhanced)
+                skew = timer("skew", estimate_skew, cleaned)
+                if should_rotate(skew):
+                    cleaned = timer("warp", rotate_page, cleaned, -skew.angle)
+            timer("write", writer.add_page, cleaned, *page_size_pt(cleaned))
+            yield ("clean" if clean else "binarized"), timer
+
+
+def image_pages(paths: list, writer: StreamingPdfWriter):
+    denoise, _ = IMAGE_DENOISERS[IMAGE_DENOISE]
+    for path in paths:
+        timer = StageTimer()
+        data = path.read_bytes()
+        image = timer("decode", lambda: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE))
+        denoised = timer("denoise", denoise, image)
+        binary = timer("threshold", lambda: cv2.adaptiveThreshold(
+            denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, THRESHOLD_BLOCK, 2
+        ))
+        skew = timer("skew", estimate_skew, binary)
+        if should_rotate(skew):
+            binary = timer("warp", rotate_page, binary, -skew.angle)
+        timer("write", writer.add_page, binary, *page_size_pt(binary))
+        yield "image", timer
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "mean": round(1000 * statistics.mean(values), 2),
+        "p50": round(1000 * statistics.median(values), 2),
+        "max": round(1000 * values[-1], 2),
+        "pages": len(values),
+    }
+
+
+def run_case(name: str, paths: list, threads: int, queue):
+    cv2.setNumThreads(threads)
+    kind, _ = CASES[name]
+    times = defaultdict(list)
+    peaks = defaultdict(int)
+    totals = []
+    branches = Counter()
+
+    tracemalloc.start()
+    output = paths[0].with_name(f"{name}_cleaned.pdf")
+    with StreamingPdfWriter(output) as writer:
+        pages = image_pages(paths, writer) if kind == "photo" else pdf_pages(paths[0], writer)
+        for branch, timer in pages:
+            branches[branch] += 1
+            totals.append(sum(timer.times.values()))
+            for stage, seconds in timer.times.items():
+                times[stage].append(seconds)
+                peaks[stage] = max(peaks[stage], timer.peaks[stage])
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    queue.put({
+        "branches": dict(branches),
+        "ms_per_page": summarize(totals),
+        "stages_ms": {stage: summarize(values) for stage, values in times.items()},
+        "stage_peak_mb": {stage: round(peak / 2**20, 1) for stage, peak in peaks.items()},
+        "traced_peak_mb": round(traced_peak / 2**20, 1),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "output_kb": output.stat().st_size // 1024,
+    })
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float) -> list:
+    """Stage means and case memory peaks that grew by more than `tolerance`."""
+    regressions = []
+    for name, case in results["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if old is None:
+            continue
+        for stage, stats in case["stages_ms"].items():
+            before = old["stages_ms"].get(stage, {}).get("mean")
+            after = stats["mean"]
+            if before is not None and after - before > min_ms and after > before * (1 + tolerance):
+                regressions.append(f"{name}/{stage}: {before} -> {after} ms")
+        for metric in ("traced_peak_mb", "peak_rss_mb"):
+            before, after = old.get(metric), case[metric]
+            if before and after > before * (1 + tolerance):
+                regressions.append(f"{name}/{metric}: {before} -> {after} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=5, help="pages (or photos) per case")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--threads", type=int, default=1, help="OpenCV threads")
+    parser.add_argument("--output", type=Path, help="write the results here as JSON")
+    parser.add_argument("--baseline", type=Path, help="earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed growth, 0.25 = 25%%")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="ignore stage slowdowns smaller than this")
+    args = parser.parse_args()
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "pymupdf": fitz.VersionBind,
+            "cpus": os.cpu_count(),
+            "opencv_threads": args.threads,
+            "preprocessing_version": PREPROCESSING_VERSION,
+            "image_denoise": IMAGE_DENOISE,
+        },
+        "pages": args.pages,
+        "cases": {},
+    }
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.cases:
+            case_dir = Path(workdir) / name
+            case_dir.mkdir()
+            kind, options = CASES[name]
+            paths = make_input(kind, options, args.pages, case_dir)
+            queue = ctx.Queue()
+            process = ctx.Process(target=run_case, args=(name, paths, args.threads, queue))
+            process.start()
+            results["cases"][name] = {"input": kind, **queue.get()}
+            process.join()
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance, args.min_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Fixed 300 dpi vs interline-adaptive rendering: pixels and cleanup time.
+
+    python -m benchmarks.bench_render_dpi --pages 4
+    python -m benchmarks.bench_render_dpi --pdf data/store/originals/<ab>/<cd>/<sha256>.pdf --audiveris
+
+Generates vector scores with the notation scaled from miniature (--scales
+0.5, a 3 pt interline) to large print (3, 18 pt), or takes --pdf, and cleans
+every page twice: rendered at RENDER_DPI, and at the dpi page_scale picks
+for TARGET_INTERLINE (the probe render included in the time). "megapixels"
+is what the cleaned pages add up to, which is what OpenCV and Audiveris
+work through, and "interline_px" the interline measured on them, which is
+what Audiveris sees: pages are sized so its 300 dpi render is the cleaned
+image pixel for pixel. --audiveris also converts both cleaned PDFs (needs the
+Audiveris install).
+"""
+import argparse
+import json
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from app.audiveris import AudiverisConverter
+from app.classifier import classify_pdf
+from app.config import AUDIVERIS_PATH, TARGET_INTERLINE
+from app.interline import PageScale, measure_staff_scale
+from app.pdf_writer import StreamingPdfWriter
+from app.preprocessing import RENDER_DPI, clean_pdf_pages
+from benchmarks.synthetic import make_score_pdf
+
+
+def run(pdf_path: Path, workdir: Path, mode: str, audiveris: bool) -> dict:
+    classes = classify_pdf(str(pdf_path))
+    scales = [PageScale(RENDER_DPI, None)] * len(classes) if mode == "fixed" else None
+    output = workdir / f"{pdf_path.stem}_{mode}.pdf"
+
+    started = perf_counter()
+    pixels = 0
+    dpis = []
+    interlines = []
+    with StreamingPdfWriter(output) as writer:
+        for page in clean_pdf_pages(str(pdf_path), len(classes), workers=1, classes=classes, scales=scales):
+            writer.add_page(page.image, page.width, page.height)
+            pixels += page.image.size
+            dpis.append(page.stats.dpi)
+            measured = measure_staff_scale(page.image)
+            if measured:
+                interlines.append(round(measured.interline, 1))
+    result = {
+        "mode": mode,
+        "dpi": sorted(set(dpis)),
+        "interline_pt": page.stats.interline_pt,
+        "interline_px": sorted(set(interlines)),
+        "megapixels": round(pixels / 1e6, 1),
+        "cleanup_s": round(perf_counter() - started, 3),
+        "size_kb": output.stat().st_size // 1024,
+    }
+    if audiveris:
+        converter = AudiverisConverter(AUDIVERIS_PATH)
+        started = perf_counter()
+        converter.convert_to_musicxml(str(output), str(workdir / f"out_{output.stem}"))
+        result["audiveris_s"] = round(perf_counter() - started, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", type=Path, help="PDF to clean (default: generated scores)")
+    parser.add_argument("--pages", type=int, default=4, help="pages of each generated score")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.5, 1.0, 2.0, 3.0])
+    parser.add_argument("--audiveris", action="store_true")
+    args = parser.parse_args()
+
+    results = {"target_interline_px": TARGET_INTERLINE, "documents": []}
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        if args.pdf is not None:
+            documents = {args.pdf.name: args.pdf}
+        else:
+            documents = {}
+            for scale in args.scales:
+                documents[f"scale {scale}"] = workdir / f"score_{scale}.pdf"
+                make_score_pdf(documents[f"scale {scale}"], args.pages, scale=scale)
+        for name, path in documents.items():
+            results["documents"].append({
+                "document": name,
+                "runs": [run(path, workdir, mode, args.audiveris) for mode in ("fixed", "adaptive")],
+            })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
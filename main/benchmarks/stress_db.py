@@ -0,0 +1,184 @@
+"""Concurrency stress test for the database layer.
+
+    python -m benchmarks.stress_db --writers 4 --readers 4 --seconds 10
+    python -m benchmarks.stress_db --journal-mode DELETE --attempts 1   # the old setup
+
+Runs --writers and --readers processes against one throwaway database for
+--seconds. Writers do what uploads and job workers do: add a score and
+enqueue its job, claim the next queued job, post progress and move it to
+done. Readers page through the scores listing and poll job progress.
+Everything goes through app.database, so the engine settings (DB_* from
+config, overridable here) and the commit retries are the ones the app uses.
+
+Prints operations, errors and latency per role, the commits that were
+retried, and checks that no job was claimed twice. Exits 1 on any error or
+double claim. --url runs against another database (e.g. PostgreSQL), which
+must be empty; its tables are created and left behind.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import traceback
+from collections import Counter
+from time import perf_counter
+
+
+def configure(args, url: str):
+    # read by app.config at import, which happens in each process after this
+    os.environ["DATABASE_URL"] = url
+    os.environ["DB_JOURNAL_MODE"] = args.journal_mode
+    os.environ["DB_BUSY_TIMEOUT_MS"] = str(args.busy_timeout_ms)
+    os.environ["DB_COMMIT_ATTEMPTS"] = str(args.attempts)
+    os.environ.setdefault("SECRET_KEY", "stress")
+    os.environ.setdefault("ALGORITHM", "HS256")
+
+
+def writer(session_factory, user_id: int, n: int):
+    from app.jobs import _set_status, claim_next_job
+    from app.models import Job, JobStatus, Score
+    from app.database import commit_with_retry
+
+    with session_factory() as db:
+        if n % 2 == 0:
+            score = Score(original_path=f"stress_{os.getpid()}_{n}.pdf", user_id=user_id)
+            # the score and its job in one commit, as queue_score does
+            job = Job(score=score, status=JobStatus.QUEUED)
+            commit_with_retry(db, lambda: db.add_all([score, job]))
+            return "upload"
+        job_id = claim_next_job()
+        if job_id is None:
+            return "idle"
+        job = db.get(Job, job_id)
+        for step in ("LOAD", "GRID", "EXPORT"):
+            progress = {"step": step, "sheet": 1}
+            commit_with_retry(db, lambda: setattr(job, "progress", progress))
+        _set_status(job, db, JobStatus.DONE)
+        return "job"
+
+
+def reader(session_factory, user_id: int, n: int):
+    from app.listing import LISTING_ORDER, page_filters, split_page
+    from app.models import Job, Score
+
+    with session_factory() as db:
+        cursor = None
+        for _ in range(3):
+            rows = (
+                db.query(Score.id, Score.created_at)
+                .filter(*page_filters(user_id if n % 2 else None, None, cursor))
+                .order_by(*LISTING_ORDER)
+                .limit(51)
+                .all()
+            )
+            _, cursor = split_page(rows, 50)
+            if cursor is None:
+                break
+        db.query(Job).order_by(Job.id.desc()).first()
+        return "read"
+
+
+def worker(role: str, args, url: str, user_id: int, results):
+    configure(args, url)
+    from sqlalchemy.exc import OperationalError
+    from app.database import SessionLocal
+    from app.metrics import DB_COMMIT_RETRIES
+
+    operation = writer if role == "writer" else reader
+    counts, errors, latencies = Counter(), Counter(), []
+    deadline = perf_counter() + args.seconds
+    n = 0
+    while perf_counter() < deadline:
+        started = perf_counter()
+        try:
+            counts[operation(SessionLocal, user_id, n)] += 1
+            latencies.append(perf_counter() - started)
+        except OperationalError as e:
+            errors[str(e.orig)] += 1
+        except Exception:
+            errors[traceback.format_exc(limit=1).strip().splitlines()[-1]] += 1
+        n += 1
+    results.put({
+        "role": role,
+        "counts": dict(counts),
+        "errors": dict(errors),
+        "latencies": latencies,
+        "retries": DB_COMMIT_RETRIES._value.get(),
+    })
+
+
+def summarize(role: str, reports: list) -> dict:
+    latencies = sorted(latency for report in reports for latency in report["latencies"])
+    counts, errors = Counter(), Counter()
+    for report in reports:
+        counts.update(report["counts"])
+        errors.update(report["errors"])
+    return {
+        "processes": len(reports),
+        "operations": dict(counts),
+        "errors": dict(errors),
+        "commit_retries": int(sum(report["retries"] for report in reports)),
+        "p50_ms": round(1000 * statistics.median(latencies), 2) if latencies else None,
+        "p99_ms": round(1000 * latencies[int(0.99 * (len(latencies) - 1))], 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--journal-mode", default="WAL", help="SQLite journal mode (DB_JOURNAL_MODE)")
+    parser.add_argument("--busy-timeout-ms", type=int, default=15000, help="DB_BUSY_TIMEOUT_MS")
+    parser.add_argument("--attempts", type=int, default=5, help="DB_COMMIT_ATTEMPTS, 1 turns retries off")
+    parser.add_argument("--url", help="database url; default a SQLite file in a temporary directory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        url = args.url or f"sqlite:///{workdir}/stress.db"
+        configure(args, url)
+        from app.database import Base, SessionLocal, engine
+        from app.models import Job, User
+
+        Base.metadata.create_all(engine)
+        with SessionLocal() as db:
+            user = User(username=f"stress_{os.getpid()}", hashed_password="x")
+            db.add(user)
+            db.commit()
+            user_id = user.id
+        engine.dispose()
+
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        roles = ["writer"] * args.writers + ["reader"] * args.readers
+        processes = [ctx.Process(target=worker, args=(role, args, url, user_id, results)) for role in roles]
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        with SessionLocal() as db:
+            double_claims = db.query(Job).filter(Job.attempts > 1).count()
+            jobs = db.query(Job).count()
+
+    summary = {
+        "url": url if args.url else "sqlite (temporary)",
+        "journal_mode": args.journal_mode,
+        "busy_timeout_ms": args.busy_timeout_ms,
+        "commit_attempts": args.attempts,
+        "seconds": args.seconds,
+        "jobs": jobs,
+        "double_claims": double_claims,
+        **{role + "s": summarize(role, [r for r in reports if r["role"] == role]) for role in ("writer", "reader")},
+    }
+    print(json.dumps(summary, indent=2))
+    failed = double_claims or any(summary[role]["errors"] for role in ("writers", "readers"))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Synthetic score pages for the benchmarks.
+
+- make_score_pdf: born-digital (vector) pages, as exported by notation software
+- draw_score + degrade: raster pages with controlled noise, blur, skew,
+  contrast and uneven lighting, for scans and phone photos
+- make_raster_pdf: degraded raster pages wrapped in a PDF, like a scanner's output
+- make_photo: a large, unevenly lit photo of a page, like a phone upload
+
+Everything is seeded, so the same arguments give the same pages.
+"""
+import random
+from pathlib import Path
+
+import cv2
+import fitz
+import numpy as np
+
+# A4 at 300 dpi
+A4_PIXELS = (2480, 3508)
+
+
+def make_score_pdf(path: Path, pages: int, seed: int = 0, ink: float = 0.0, scale: float = 1.0):
+    """A4 pages of five-line staves with randomly placed note heads and stems.
+
+    `ink` is the gray level of the notation (0 black, 1 white); faded ink
+    gives the low contrast pages clean_page_image binarizes. `scale` sizes
+    the notation, the interline is 6 * scale points (2.1 mm at 1).
+    """
+    rng = random.Random(seed)
+    with fitz.open() as doc:
+        for _ in range(pages):
+            page = doc.new_page(width=595, height=842)
+            shape = page.new_shape()
+            step = 76 * scale
+            for staff in range(int((842 - 120) // step) + 1):
+                top = 60 + staff * step
+                for line in range(5):
+                    y = top + line * 6 * scale
+                    shape.draw_line((40, y), (555, y))
+                for x in np.arange(60, 540, 18 * scale):
+                    y = top + rng.randint(-2, 10) * 3 * scale
+                    shape.draw_oval(fitz.Rect(x, y - 2.5 * scale, x + 7 * scale, y + 2.5 * scale))
+                    shape.draw_line((x + 7 * scale, y), (x + 7 * scale, y - 18 * scale))
+            shape.finish(color=(ink, ink, ink), fill=(ink, ink, ink), width=0.8 * scale)
+            shape.commit()
+        doc.save(str(path))
+
+
+def draw_score(width: int, height: int, seed: int = 0, paper: int = 255, ink: int = 0) -> np.ndarray:
+    """Staves with note heads and stems drawn straight into a grayscale image."""
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width), paper, np.uint8)
+    spacing = height // 200
+    thickness = max(1, spacing // 6)
+    for top in range(height // 12, height - height // 12, height // 12):
+        for line in range(5):
+            y = top + line * spacing
+            cv2.line(image, (width // 20, y), (width - width // 20, y), ink, thickness)
+        for x in range(width // 15, width - width // 15, width // 40):
+            y = top + int(rng.integers(0, 9)) * spacing // 2
+            cv2.ellipse(image, (x, y), (spacing // 2 + 1, spacing // 3 + 1), -20, 0, 360, ink, -1)
+            cv2.line(image, (x + spacing // 2, y), (x + spacing // 2, y - 3 * spacing), ink, thickness)
+    return image
+
+
+def degrade(
+    image: np.ndarray,
+    seed: int = 0,
+    contrast: float = 1.0,
+    skew: float = 0.0,
+    blur: float = 0.0,
+    lighting: float = 0.0,
+    noise: float = 0.0,
+) -> np.ndarray:
+    """Returns a degraded copy of a clean page.
+
+    contrast: scales the ink's distance from the paper (1 unchanged, 0.3 faded)
+    skew: rotation in degrees, counter-clockwise
+    blur: gaussian sigma in pixels
+    lighting: how many gray levels darker the far corner is
+    noise: sensor noise standard deviation in gray levels
+    """
+    rng = np.random.default_rng(seed)
+    paper = float(np.max(image))
+    out = image.astype(np.float32)
+    if contrast != 1.0:
+        out = paper - (paper - out) * contrast
+    if skew:
+        center = (image.shape[1] / 2, image.shape[0] / 2)
+        rot_mat = cv2.getRotationMatrix2D(center, skew, 1.0)
+        out = cv2.warpAffine(
+            out, rot_mat, (image.shape[1], image.shape[0]),
+            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=paper
+        )
+    if blur:
+        out = cv2.GaussianBlur(out, (0, 0), blur)
+    if lighting:
+        height, width = image.shape
+        out -= (np.linspace(0, 0.6 * lighting, width)[None, :] + np.linspace(0, 0.4 * lighting, height)[:, None])
+    if noise:
+        out += rng.normal(0, noise, image.shape).astype(np.float32)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def make_raster_pdf(path: Path, pages: int, seed: int = 0, **degradation):
+    """A4 PDF of 300 dpi degraded raster pages, `degradation` as for degrade()."""
+    width, height = A4_PIXELS
+    with fitz.open() as doc:
+        for page_num in range(pages):
+            image = degrade(draw_score(width, height, seed + page_num), seed + page_num, **degradation)
+            _, png = cv2.imencode(".png", image)
+            page = doc.new_page(width=595, height=842)
+            page.insert_image(page.rect, stream=png.tobytes())
+        doc.save(str(path))
+
+
+def make_photo(width: int, height: int, seed: int = 0):
+    """A phone photo of a page: gray paper, light falling off towards one
+    corner and sensor noise. Returns the photo and the true ink mask."""
+    clean = draw_score(width, height, seed, paper=235, ink=40)
+    photo = degrade(clean, seed, lighting=100, noise=12)
+    return photo, clean < 138
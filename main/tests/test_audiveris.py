@@ -0,0 +1,74 @@
+from itertools import count
+
+import fitz
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import pipeline
+from app.audiveris import StepTimer, parse_progress
+from app.database import Base
+from app.models import Score, User
+from app.pipeline import PipelineError
+from app.storage import LocalStorage
+
+
+@pytest.mark.parametrize("line, progress", [
+    ("INFO  [sonata#3] Step GRID starting", ("GRID", 3)),
+    ("INFO  [sonata#12] BINARY done in 812 ms", ("BINARY", 12)),
+    ("INFO  [sonata] Step EXPORT starting", ("EXPORT", None)),
+    ("INFO  [my-book_v2#1] LOAD", ("LOAD", 1)),
+    # step names only count as whole words
+    ("INFO  [sonata#3] Loading GRIDLINES", None),
+    ("INFO  Audiveris version 5.3", None),
+    ("", None),
+])
+def test_parse_progress(line, progress):
+    assert parse_progress(line) == progress
+
+
+def test_step_timer_sums_sheets():
+    timer = StepTimer()
+    assert timer.update("LOAD", 1, 0.0)
+    assert not timer.update("LOAD", 1, 1.0)
+    assert timer.update("LOAD", 2, 1.0)
+    assert timer.update("BINARY", 1, 2.0)
+    assert timer.update("BINARY", 2, 4.0)
+    assert timer.update("EXPORT", None, 7.0)
+    # sheet 1 never got further than BINARY
+    assert timer.finish(10.0) == {"LOAD": 5.0, "BINARY": 14.0, "EXPORT": 3.0}
+    assert timer.current == {}
+
+
+def test_failed_conversion_keeps_step_durations(tmp_path, monkeypatch):
+    storage = LocalStorage(tmp_path / "storage")
+    monkeypatch.setattr(pipeline, "get_storage", lambda: storage)
+    monkeypatch.setattr(pipeline, "WORK_DIR", tmp_path / "work")
+    clock = count()
+    monkeypatch.setattr(pipeline, "monotonic", lambda: float(next(clock)))
+
+    def run_audiveris(processed_file, musicxml_dir, on_progress):
+        on_progress("LOAD", 1)
+        on_progress("BINARY", 1)
+        raise RuntimeError("Audiveris crashed")
+
+    monkeypatch.setattr(pipeline, "run_audiveris", run_audiveris)
+
+    processed = tmp_path / "processed.pdf"
+    with fitz.open() as doc:
+        doc.new_page()
+        doc.save(str(processed))
+    engine = create_engine(f"sqlite:///{tmp_path}/steps.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(User(id=1, username="steps", hashed_password="x"))
+        key = storage.put_file(processed, "processed")
+        score = Score(original_path=key, processed_path=key, user_id=1)
+        db.add(score)
+        db.commit()
+
+        with pytest.raises(PipelineError):
+            pipeline.convert_to_musicxml(score, db)
+        db.expire_all()
+        assert set(db.get(Score, score.id).step_durations) == {"LOAD", "BINARY"}
+    engine.dispose()
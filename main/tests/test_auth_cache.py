@@ -0,0 +1,67 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import auth_cache, auth_utils
+from app.database import Base
+from app.models import RevokedToken
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(auth_utils, "SECRET_KEY", "test")
+    monkeypatch.setattr(auth_utils, "ALGORITHM", "HS256")
+    forget_locally(monkeypatch)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/auth.db")
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def forget_locally(monkeypatch):
+    # what another worker, or this one after its cache dropped the entries, sees
+    monkeypatch.setattr(auth_cache, "token_cache", auth_cache.TTLCache(16, 30))
+    monkeypatch.setattr(auth_cache, "revoked_tokens", auth_cache.TTLCache(16, float("inf")))
+
+
+def test_revocation_outlives_the_local_cache(sessions, monkeypatch):
+    kept = auth_utils.create_access_token({"sub": "1"})
+    revoked = auth_utils.create_access_token({"sub": "1"}, timedelta(minutes=5))
+
+    async def run():
+        async with sessions() as db:
+            assert await auth_cache.token_user_id(revoked, db) == 1
+            await auth_cache.revoke_token(revoked, db)
+            assert await auth_cache.token_user_id(revoked, db) is None
+            forget_locally(monkeypatch)
+            assert await auth_cache.token_user_id(revoked, db) is None
+            assert await auth_cache.token_user_id(kept, db) == 1
+            # logging out twice is fine
+            await auth_cache.revoke_token(revoked, db)
+            return (await db.execute(select(RevokedToken))).scalars().all()
+
+    rows = asyncio.run(run())
+    assert len(rows) == 1 and rows[0].token_sha256 != revoked
+
+
+def test_expired_revocations_are_dropped(sessions):
+    old = auth_utils.create_access_token({"sub": "1"}, timedelta(seconds=1))
+    new = auth_utils.create_access_token({"sub": "2"})
+
+    async def run():
+        async with sessions() as db:
+            await auth_cache.revoke_token(old, db)
+            await asyncio.sleep(2)
+            await auth_cache.revoke_token(new, db)
+            return (await db.execute(select(RevokedToken))).scalars().all()
+
+    rows = asyncio.run(run())
+    assert [row.token_sha256 for row in rows] == [auth_cache._token_sha256(new)]
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import main
+from app.database import Base
+from app.ingest import BatchMember, IngestedFile
+from app.models import Batch, Job, Score, User
+from app.storage import LocalStorage
+
+
+class FailingStorage(LocalStorage):
+    def put_file(self, path, kind, sha256=None):
+        if sha256 == "broken":
+            raise OSError("disk full")
+        return super().put_file(path, kind, sha256)
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    storage = FailingStorage(tmp_path / "storage")
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(main, "make_cache_key", lambda digest: digest)
+    monkeypatch.setattr(main, "admission_retry_after", lambda session: None)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/batch.db")
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(engine)() as db:
+            db.add(User(id=1, username="batch", hashed_password="x"))
+            await db.commit()
+
+    asyncio.run(create())
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def test_member_that_fails_to_queue_is_listed(sessions, tmp_path, monkeypatch):
+    async def members(files, dest_dir):
+        for name in ("first", "broken", "last"):
+            path = tmp_path / f"{name}.pdf"
+            path.write_bytes(name.encode())
+            yield BatchMember(name, IngestedFile(path, len(name), name, "application/pdf"), None)
+
+    monkeypatch.setattr(main, "ingest_batch", members)
+
+    async def run():
+        async with sessions() as db:
+            user = await db.get(User, 1)
+            response = await main.upload_batch(user=user, db=db, files=[])
+            batch = (await db.execute(select(Batch))).scalars().one()
+            queued = (await db.execute(select(Score.id).join(Job))).scalars().all()
+            return json.loads(response.body), batch.rejected, queued
+
+    body, rejected, queued = asyncio.run(run())
+    assert [score["name"] for score in body["scores"]] == ["first", "last"]
+    assert body["rejected"] == rejected == [{"name": "broken", "detail": "Could not be saved"}]
+    assert sorted(queued) == sorted(score["score_id"] for score in body["scores"])
+    assert not (tmp_path / "broken.pdf").exists()
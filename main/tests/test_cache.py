@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import cache
+from app.database import Base
+from app.models import CachedResult, Score, User
+from app.storage import LocalStorage
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    storage = LocalStorage(tmp_path / "storage")
+    monkeypatch.setattr(cache, "get_storage", lambda: storage)
+    for key in ("processed/a.pdf", "musicxml/a.mxl"):
+        (storage.root / key).parent.mkdir(parents=True, exist_ok=True)
+        (storage.root / key).write_bytes(b"x")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/cache.db")
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(engine)() as db:
+            db.add(User(id=1, username="cache", hashed_password="x"))
+            for key in ("kept", "artifacts gone"):
+                db.add(Score(id=len(key), original_path="x.pdf", user_id=1))
+            db.add_all([
+                CachedResult(cache_key="kept", processed_path="processed/a.pdf",
+                             xmlmusic_path="musicxml/a.mxl", score_id=len("kept")),
+                CachedResult(cache_key="artifacts gone", processed_path="processed/a.pdf",
+                             xmlmusic_path="musicxml/gone.mxl", score_id=len("artifacts gone")),
+                CachedResult(cache_key="score gone", processed_path="processed/a.pdf",
+                             xmlmusic_path="musicxml/a.mxl", score_id=99),
+            ])
+            await db.commit()
+
+    asyncio.run(create())
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def test_lookup_evicts_entries_it_cant_serve(sessions):
+    async def run():
+        async with sessions() as db:
+            found = {key: await cache.lookup_result(key, db) for key in ("kept", "artifacts gone", "score gone", "new")}
+            return found, (await db.execute(select(CachedResult.cache_key))).scalars().all()
+
+    found, left = asyncio.run(run())
+    assert found["kept"].score_id == len("kept")
+    assert found["artifacts gone"] is found["score gone"] is found["new"] is None
+    assert left == ["kept"]
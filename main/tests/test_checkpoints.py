@@ -0,0 +1,113 @@
+import fitz
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import pipeline
+from app.checkpoints import resume_stage, save_page, set_checkpoint
+from app.classifier import PageClass
+from app.database import Base
+from app.models import Score, User
+from app.preprocessing import CleanedPage, PageStats, preprocessing_fingerprint
+from app.scheduler import current_plan
+from app.storage import LocalStorage
+
+PAGES = 3
+
+
+@pytest.mark.parametrize("checkpoints, stage", [
+    (None, "cleanup"),
+    ({"ingest": {}}, "cleanup"),
+    ({"cleanup": {"pages": [{"file": "00000.png"}]}}, "cleanup"),
+    ({"cleanup": {"complete": True}}, "omr"),
+    ({"cleanup": {"complete": True}, "omr": {"output": "x.mxl"}}, "export"),
+    ({"cleanup": {"complete": True}, "omr": {"output": "x.mxl"}, "export": {"at": "..."}}, None),
+])
+def test_resume_stage(checkpoints, stage):
+    assert resume_stage(Score(checkpoints=checkpoints)) == stage
+
+
+def page_image(page_num: int) -> np.ndarray:
+    image = np.full((200, 150), 255, np.uint8)
+    image[20 + 10 * page_num, :] = 0
+    return image
+
+
+@pytest.fixture
+def score(tmp_path, monkeypatch):
+    storage = LocalStorage(tmp_path / "storage")
+    monkeypatch.setattr(pipeline, "get_storage", lambda: storage)
+    monkeypatch.setattr(pipeline, "WORK_DIR", tmp_path / "work")
+    monkeypatch.setattr(pipeline, "current_plan", lambda: current_plan()._replace(cleanup_workers=1))
+    scanned = PageClass("scanned", drawings=0, images=1, image_dpi=300.0, image_coverage=1.0,
+                        text_chars=0, hidden_chars=0, noise=6.0)
+    monkeypatch.setattr(pipeline, "classify_pdf", lambda path: [scanned] * PAGES)
+
+    original = tmp_path / "upload.pdf"
+    original.write_bytes(b"%PDF- classified and cleaned by the stand-ins")
+    engine = create_engine(f"sqlite:///{tmp_path}/checkpoints.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(User(id=1, username="checkpoints", hashed_password="x"))
+        score = Score(original_path=storage.put_file(original, "originals"), user_id=1)
+        db.add(score)
+        db.commit()
+        yield score, db, storage, tmp_path / "work" / f"score_{score.id}"
+    engine.dispose()
+
+
+def test_resumed_cleanup_reuses_finished_pages(score, monkeypatch):
+    score, db, storage, work_dir = score
+    # an earlier attempt cleaned two pages, then failed
+    (work_dir / "pages").mkdir(parents=True)
+    pages = []
+    for page_num in range(2):
+        entry = {"file": f"{page_num:05d}.png", "width": 72.0, "height": 96.0,
+                 "stats": list(PageStats("binarized", 30.0, page_class="scanned", dpi=300))}
+        save_page(work_dir / "pages" / entry["file"], page_image(page_num))
+        pages.append(entry)
+    set_checkpoint(score, "cleanup", fingerprint=preprocessing_fingerprint(), page_count=PAGES, pages=pages)
+    db.commit()
+
+    cleaned = []
+
+    def clean_pdf_pages(pdf_path, page_count, workers, first_page, classes, scales):
+        for page_num in range(first_page, page_count):
+            cleaned.append(page_num)
+            yield CleanedPage(72.0, 96.0, page_image(page_num), PageStats("binarized", 30.0, dpi=300))
+
+    monkeypatch.setattr(pipeline, "clean_pdf_pages", clean_pdf_pages)
+    pipeline.clean_up(score, db)
+
+    assert cleaned == [2]
+    assert resume_stage(score) == "omr"
+    assert score.profile.stages["clean_up"]["reused_pages"] == 2
+    assert not work_dir.exists()
+    with storage.local_copy(score.processed_path) as path, fitz.open(str(path)) as doc:
+        assert doc.page_count == PAGES
+        for page_num, page in enumerate(doc):
+            pix = fitz.Pixmap(doc, page.get_images()[0][0])
+            decoded = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+            assert np.array_equal(decoded, page_image(page_num))
+
+
+def test_pages_cleaned_another_way_are_not_reused(score, monkeypatch):
+    score, db, storage, work_dir = score
+    (work_dir / "pages").mkdir(parents=True)
+    save_page(work_dir / "pages" / "00000.png", page_image(0))
+    set_checkpoint(score, "cleanup", fingerprint="older", page_count=PAGES, pages=[
+        {"file": "00000.png", "width": 72.0, "height": 96.0, "stats": list(PageStats("binarized", 30.0))}
+    ])
+    db.commit()
+
+    first_pages = []
+
+    def clean_pdf_pages(pdf_path, page_count, workers, first_page, classes, scales):
+        first_pages.append(first_page)
+        for page_num in range(first_page, page_count):
+            yield CleanedPage(72.0, 96.0, page_image(page_num), PageStats("binarized", 30.0, dpi=300))
+
+    monkeypatch.setattr(pipeline, "clean_pdf_pages", clean_pdf_pages)
+    pipeline.clean_up(score, db)
+    assert first_pages == [0]
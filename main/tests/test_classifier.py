@@ -0,0 +1,52 @@
+import fitz
+import numpy as np
+import pytest
+
+from app.classifier import MIXED, SCANNED, VECTOR, classify_page
+
+
+def add_image(page: fitz.Page, rect: fitz.Rect, dpi: int = 300):
+    width, height = int(rect.width * dpi / 72), int(rect.height * dpi / 72)
+    pixels = np.random.default_rng(0).integers(200, 256, (height, width), dtype=np.uint8)
+    page.insert_image(rect, pixmap=fitz.Pixmap(fitz.csGRAY, width, height, pixels.tobytes(), False))
+
+
+def add_staves(page: fitz.Page):
+    for top in range(60, 760, 76):
+        for line in range(5):
+            page.draw_line((40, top + line * 6), (555, top + line * 6))
+
+
+@pytest.fixture
+def page():
+    with fitz.open() as doc:
+        yield doc.new_page(width=595, height=842)
+
+
+def test_vector_with_a_logo(page):
+    add_staves(page)
+    add_image(page, fitz.Rect(40, 10, 100, 40))
+    assert classify_page(page).kind == VECTOR
+
+
+def test_full_page_scan_under_an_ocr_layer(page):
+    add_image(page, page.rect, dpi=150)
+    page.insert_text((50, 50), "Allegro moderato", render_mode=3)
+    result = classify_page(page)
+    assert (result.kind, result.text_chars, result.hidden_chars) == (SCANNED, 0, 15)
+
+
+def test_small_scan_alone_is_not_vector(page):
+    add_image(page, fitz.Rect(100, 100, 200, 200), dpi=72)
+    assert classify_page(page).kind == SCANNED
+
+
+def test_scan_with_margins(page):
+    add_image(page, fitz.Rect(100, 100, 450, 500))
+    assert classify_page(page).kind == SCANNED
+
+
+def test_vector_notation_beside_an_image(page):
+    add_staves(page)
+    add_image(page, fitz.Rect(100, 100, 450, 400))
+    assert classify_page(page).kind == MIXED
@@ -0,0 +1,147 @@
+import asyncio
+import multiprocessing
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.database import Base, commit_with_retry, commit_with_retry_async
+from app.models import Job, JobStatus, Score, User
+
+JOBS = 200
+WORKERS = 4
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def locked() -> OperationalError:
+    return OperationalError("UPDATE jobs ...", {}, Exception("database is locked"))
+
+
+def test_retries_when_apply_loses_the_lock():
+    db = FakeSession()
+    calls = []
+
+    def apply():
+        calls.append(1)
+        if len(calls) < 3:
+            raise locked()
+        return "claimed"
+
+    assert commit_with_retry(db, apply, attempts=5) == "claimed"
+    assert (len(calls), db.rollbacks, db.commits) == (3, 2, 1)
+
+
+def test_gives_up_after_attempts():
+    db = FakeSession()
+
+    def apply():
+        raise locked()
+
+    with pytest.raises(OperationalError):
+        commit_with_retry(db, apply, attempts=2)
+    assert db.rollbacks == 2
+
+
+class LockedOnce(AsyncSession):
+    # the commit after `failures` is filled loses to another writer
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = []
+
+    async def commit(self):
+        if self.failures:
+            raise self.failures.pop()
+        await super().commit()
+
+
+def test_objects_stay_readable_after_an_async_retry(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/retry.db")
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(engine, class_=LockedOnce, expire_on_commit=False)() as db:
+            db.add(User(id=1, username="retry", hashed_password="x"))
+            await db.commit()
+            user = await db.get(User, 1)
+            score = Score(original_path="x.pdf", user_id=user.id)
+            db.failures.append(locked())
+            await commit_with_retry_async(db, lambda: db.add(score), attempts=2)
+            # plain attribute reads, as a handler building its response does
+            return user.username, score.id, score.user_id
+
+    try:
+        assert asyncio.run(run()) == ("retry", 1, 1)
+    finally:
+        asyncio.run(engine.dispose())
+
+
+def _claim_all(results):
+    # a fresh process: app.config reads the test database from the environment
+    from app.database import SessionLocal, commit_with_retry
+    from app.jobs import claim_next_job
+    from app.models import Job
+
+    claimed = []
+    try:
+        with SessionLocal() as db:
+            while (job_id := claim_next_job()) is not None:
+                claimed.append(job_id)
+                job = db.get(Job, job_id)
+                commit_with_retry(db, lambda: setattr(job, "progress", {"step": "LOAD", "sheet": 1}))
+        results.put(("ok", claimed))
+    except Exception as e:
+        results.put(("error", repr(e)))
+
+
+def test_concurrent_claims_take_every_job_once(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path}/jobs.db"
+    # a busy timeout this short turns most lock waits into errors the
+    # retries have to handle
+    monkeypatch.setenv("DATABASE_URL", url)
+    monkeypatch.setenv("DB_BUSY_TIMEOUT_MS", "1")
+    monkeypatch.setenv("DB_COMMIT_ATTEMPTS", "20")
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        user = User(username="claims", hashed_password="x")
+        db.add(user)
+        db.flush()
+        scores = [Score(original_path=f"{i}.pdf", user_id=user.id) for i in range(JOBS)]
+        db.add_all(scores)
+        db.flush()
+        db.add_all(Job(score_id=score.id, status=JobStatus.QUEUED) for score in scores)
+        db.commit()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_claim_all, args=(results,)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert [outcome for outcome, _ in reports] == ["ok"] * WORKERS, reports
+    claimed = [job_id for _, job_ids in reports for job_id in job_ids]
+    assert sorted(claimed) == list(range(1, JOBS + 1))
+
+    with Session(engine) as db:
+        jobs = db.query(Job).all()
+        assert all(job.status == JobStatus.CLEANING and job.attempts == 1 for job in jobs)
+        assert all(job.progress == {"step": "LOAD", "sheet": 1} for job in jobs)
+    engine.dispose()
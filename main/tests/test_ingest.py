@@ -0,0 +1,117 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from app.ingest import SNIFF_BYTES, BodySizeLimit, ingest_batch, ingest_upload, store_upload
+
+PDF = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n1 0 obj\n<< /Type /Catalog >>\nendobj\n" + b"0" * 4 * SNIFF_BYTES
+
+
+def upload(data: bytes, name: str = "score.pdf", size: int = None) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=name, size=size)
+
+
+def zipped(*names: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name in names:
+            archive.writestr(name, b"" if name.endswith("/") else PDF)
+    return buffer.getvalue()
+
+
+def test_stores_hashes_and_names_the_upload(tmp_path):
+    ingested = store_upload(io.BytesIO(PDF), tmp_path)
+    assert ingested.mime == "application/pdf" and ingested.path.suffix == ".pdf"
+    assert ingested.path.read_bytes() == PDF and ingested.size == len(PDF)
+
+
+def test_oversized_upload_leaves_nothing_behind(tmp_path):
+    with pytest.raises(HTTPException) as raised:
+        store_upload(io.BytesIO(PDF), tmp_path, max_size=len(PDF) - 1)
+    assert raised.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_declared_size_is_checked_before_reading(tmp_path):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(ingest_upload(upload(PDF, size=11 * 1024 * 1024), tmp_path, max_size=10 * 1024 * 1024))
+    assert raised.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("data", [b"just some notes\n" * 100, b"<html><body>score</body></html>", b""])
+def test_wrong_type_is_rejected(tmp_path, data):
+    with pytest.raises(HTTPException) as raised:
+        store_upload(io.BytesIO(data), tmp_path)
+    assert raised.value.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+
+
+def ingest(files, dest_dir, **kwargs) -> list:
+    async def run():
+        return [member async for member in ingest_batch(files, dest_dir, **kwargs)]
+    return asyncio.run(run())
+
+
+def test_archive_clutter_is_skipped(tmp_path):
+    archive = zipped("scores/", "scores/one.pdf", "__MACOSX/scores/._one.pdf", "scores/.DS_Store", ".hidden.pdf", "two.pdf")
+    members = ingest([upload(archive, "book.zip")], tmp_path)
+    assert [(member.name, member.error) for member in members] == [
+        ("book.zip/scores/one.pdf", None), ("book.zip/two.pdf", None)
+    ]
+    assert sorted(path.read_bytes() for path in tmp_path.iterdir()) == [PDF, PDF]
+
+
+def test_members_past_the_file_limit_are_rejected(tmp_path):
+    members = ingest([upload(PDF), upload(zipped("1.pdf", "2.pdf", "3.pdf"), "book.zip")], tmp_path, max_files=3)
+    assert [member.error is None for member in members] == [True, True, True, False]
+    assert members[-1].name == "book.zip/3.pdf" and "More than 3 files" in members[-1].error
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_unreadable_archive_is_listed(tmp_path):
+    archive = zipped("1.pdf")
+    [member] = ingest([upload(archive[:len(archive) // 2], "cut.zip")], tmp_path)
+    assert member.ingested is None and member.error
+
+
+def run_limited(headers: list, chunks: list, max_bytes: int = 100):
+    called, sent = [], []
+
+    async def app(scope, receive, send):
+        called.append(True)
+        while (await receive()).get("more_body"):
+            pass
+
+    async def run():
+        messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                    for i, chunk in enumerate(chunks)]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "path": "/upload_batch/", "headers": headers}
+        await BodySizeLimit(app, paths=["/upload_batch/"], max_bytes=max_bytes, detail="Too big")(scope, receive, send)
+
+    asyncio.run(run())
+    return called, sent
+
+
+def test_body_limit_answers_413_on_content_length():
+    called, sent = run_limited([(b"content-length", b"101")], [b"x" * 101])
+    assert not called
+    assert sent[0]["status"] == 413
+
+
+def test_body_limit_counts_streamed_bodies():
+    called, _ = run_limited([], [b"x" * 60])
+    assert called
+    with pytest.raises(HTTPException) as raised:
+        run_limited([], [b"x" * 60, b"x" * 60])
+    assert raised.value.status_code == 413
@@ -0,0 +1,53 @@
+import fitz
+import numpy as np
+import pytest
+
+from app.config import RENDER_DPI_MAX, RENDER_DPI_MIN
+from app.interline import AUDIVERIS_PDF_DPI, in_target_band, measure_staff_scale, page_scale
+from app.pdf_writer import StreamingPdfWriter
+from app.preprocessing import RENDER_DPI, clean_pdf_page
+from benchmarks.synthetic import draw_score, make_score_pdf
+
+
+@pytest.mark.parametrize("scale", [0.5, 0.75, 1.0, 1.5])
+def test_probe_measures_interline(tmp_path, scale):
+    pdf_path = tmp_path / "score.pdf"
+    make_score_pdf(pdf_path, 1, scale=scale)
+    with fitz.open(str(pdf_path)) as doc:
+        page_scale_ = page_scale(doc[0], RENDER_DPI)
+    assert page_scale_.interline_pt == pytest.approx(6 * scale, rel=0.02)
+    assert RENDER_DPI_MIN <= page_scale_.dpi <= RENDER_DPI_MAX
+
+
+def test_blank_page_has_no_staves(tmp_path):
+    pdf_path = tmp_path / "blank.pdf"
+    with fitz.open() as doc:
+        doc.new_page()
+        doc.save(str(pdf_path))
+    with fitz.open(str(pdf_path)) as doc:
+        assert page_scale(doc[0], RENDER_DPI) == (RENDER_DPI, None)
+
+
+def test_raster_interline():
+    image = draw_score(1240, 1754)
+    measured = measure_staff_scale(image)
+    assert measured.interline == pytest.approx(1754 // 200, abs=0.2)
+
+
+# scales whose target dpi stays within RENDER_DPI_MIN..MAX
+@pytest.mark.parametrize("scale", [0.5, 0.75, 1.0, 1.5])
+def test_audiveris_sees_target_interline(tmp_path, scale):
+    pdf_path = tmp_path / "score.pdf"
+    make_score_pdf(pdf_path, 1, scale=scale)
+    page = clean_pdf_page(str(pdf_path), 0)
+    assert in_target_band(page.stats.interline_px)
+
+    # what Audiveris gets: the cleaned PDF rendered at its fixed dpi
+    cleaned_path = tmp_path / "cleaned.pdf"
+    with StreamingPdfWriter(cleaned_path) as writer:
+        writer.add_page(page.image, page.width, page.height)
+    with fitz.open(str(cleaned_path)) as doc:
+        pix = doc[0].get_pixmap(dpi=AUDIVERIS_PDF_DPI, colorspace=fitz.csGRAY, alpha=False)
+    assert (pix.width, pix.height) == (page.image.shape[1], page.image.shape[0])
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    assert in_target_band(measure_staff_scale(image).interline)
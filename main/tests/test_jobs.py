@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import jobs
+from app.database import Base
+from app.models import Job, JobStatus, Score, User, utcnow
+from app.processes import OwnerLock
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/jobs.db")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(jobs, "SessionLocal", sessionmaker(bind=engine))
+    with Session(engine) as session:
+        session.add(User(id=1, username="jobs", hashed_password="x"))
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def add_job(db: Session, status: str, heartbeat_age: float = None, attempts: int = 1) -> Job:
+    score = Score(original_path="x.pdf", user_id=1, status=status)
+    heartbeat = None if heartbeat_age is None else utcnow() - timedelta(seconds=heartbeat_age)
+    job = Job(score=score, status=status, attempts=attempts, heartbeat_at=heartbeat)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_requeues_only_jobs_whose_worker_is_gone(db):
+    running = add_job(db, JobStatus.CONVERTING, heartbeat_age=5)
+    dead = add_job(db, JobStatus.CLEANING, heartbeat_age=300)
+    from_before_heartbeats = add_job(db, JobStatus.CONVERTING)
+    given_up = add_job(db, JobStatus.CONVERTING, heartbeat_age=300, attempts=3)
+    queued = add_job(db, JobStatus.QUEUED)
+
+    assert jobs.requeue_interrupted_jobs(stale_after=60) == 3
+    db.expire_all()
+    assert running.status == JobStatus.CONVERTING
+    assert dead.status == from_before_heartbeats.status == queued.status == JobStatus.QUEUED
+    assert given_up.status == given_up.score.status == JobStatus.FAILED
+
+
+def test_owner_lock_has_one_holder(tmp_path):
+    first, second = OwnerLock(tmp_path / "x.lock"), OwnerLock(tmp_path / "x.lock")
+    assert first.acquire()
+    assert not second.acquire()
+    assert second.owner() == first.owner()
+    first.release()
+    assert second.acquire()
+    second.release()
+
+
+def test_second_pool_leaves_the_owners_requests(tmp_path, monkeypatch):
+    from app import audiveris_pool
+
+    monkeypatch.setattr(audiveris_pool, "POOL_DIR", tmp_path / "pool")
+    monkeypatch.setattr(audiveris_pool, "POOL_LOCK", tmp_path / "pool.lock")
+    in_flight = tmp_path / "pool" / "claimed" / "request.json"
+    in_flight.parent.mkdir(parents=True)
+    in_flight.write_text("{}")
+
+    owner = OwnerLock(tmp_path / "pool.lock")
+    assert owner.acquire()
+    assert not audiveris_pool.AudiverisPool(size=1).start()
+    assert in_flight.exists()
+    owner.release()
+
+
+def test_only_the_owner_sizes_the_workers(tmp_path, monkeypatch):
+    def plan():
+        raise AssertionError("sized outside the owner")
+
+    monkeypatch.setattr(jobs, "current_plan", plan)
+    monkeypatch.setattr(jobs, "RUNNER_LOCK", tmp_path / "runner.lock")
+    owner = OwnerLock(tmp_path / "runner.lock")
+    assert owner.acquire()
+    runner = jobs.JobRunner()
+    assert not runner.start()
+    assert runner.workers is None
+    owner.release()
+
+
+def test_requeue_survives_a_job_without_its_score(db):
+    db.add(Job(score_id=999, status=JobStatus.CONVERTING))
+    db.commit()
+    assert jobs.requeue_interrupted_jobs(stale_after=60) == 1
+
+
+def test_failing_cache_entry_leaves_the_job_done(db, monkeypatch):
+    from app import cache, pipeline
+
+    monkeypatch.setattr(pipeline, "clean_up", lambda score, session: None)
+    monkeypatch.setattr(pipeline, "convert_to_musicxml", lambda score, session, on_progress: None)
+
+    def remember_result(score, session):
+        raise OperationalError("INSERT INTO cached_results ...", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(cache, "remember_result", remember_result)
+    job = add_job(db, JobStatus.CLEANING)
+    jobs.run_job(job.id)
+    db.refresh(job)
+    assert (job.status, job.score.status, job.error) == (JobStatus.DONE, JobStatus.DONE, None)
@@ -0,0 +1,87 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.listing import LISTING_ORDER, decode_cursor, encode_cursor, page_filters, split_page
+from app.models import JobStatus, Score, User
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 10, 18, 9, 30, 1, 250000, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not base64!",
+    "é",
+    encode_cursor(datetime(2026, 10, 18), 42)[:-3],
+    base64.urlsafe_b64encode(b"\xff\xfe|1").decode(),
+    base64.urlsafe_b64encode(b"2026-10-18T09:30:00").decode(),
+    base64.urlsafe_b64encode(b"yesterday|1").decode(),
+    base64.urlsafe_b64encode(b"2026-10-18T09:30:00|one").decode(),
+    base64.urlsafe_b64encode(b"2026-10-18T09:30:00|1|2").decode(),
+])
+def test_malformed_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/listing.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([User(id=1, username="one", hashed_password="x"), User(id=2, username="two", hashed_password="x")])
+        # runs of scores created in the same instant, as a batch upload gives
+        start = datetime(2026, 10, 18, tzinfo=timezone.utc)
+        for i in range(11):
+            session.add(Score(
+                original_path=f"{i}.pdf", user_id=1 + i % 2, created_at=start + timedelta(seconds=i // 4),
+                status=JobStatus.DONE if i % 3 else JobStatus.FAILED,
+            ))
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def all_pages(db: Session, limit: int, **filters) -> list:
+    ids, cursor = [], None
+    while True:
+        rows = db.execute(
+            select(Score.id, Score.created_at).where(*page_filters(cursor=cursor, **filters))
+            .order_by(*LISTING_ORDER).limit(limit + 1)
+        ).all()
+        page, cursor = split_page(rows, limit)
+        assert len(page) <= limit
+        ids.extend(row.id for row in page)
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 11, 50])
+def test_pages_cover_every_row_once_in_order(db, limit):
+    expected = db.execute(select(Score.id).order_by(*LISTING_ORDER)).scalars().all()
+    # newest first, ties on created_at broken by id
+    assert expected == [11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+    assert all_pages(db, limit) == expected
+
+
+def test_filtered_pages(db):
+    expected = db.execute(
+        select(Score.id).where(Score.user_id == 2, Score.status == JobStatus.DONE).order_by(*LISTING_ORDER)
+    ).scalars().all()
+    assert expected and all_pages(db, 1, user_id=2, score_status=JobStatus.DONE) == expected
+
+
+def test_last_page_has_no_cursor():
+    rows = [Score(id=i, created_at=datetime(2026, 10, 18)) for i in (3, 2, 1)]
+    assert split_page(rows, 3) == (rows, None)
+    page, cursor = split_page(rows, 2)
+    assert page == rows[:2] and decode_cursor(cursor) == (datetime(2026, 10, 18), 2)
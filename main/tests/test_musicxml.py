@@ -0,0 +1,74 @@
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from app.musicxml import CONTAINER_XML, MXL_MIMETYPE, MergeError, merge_mxl_files, read_movements
+
+
+def score_xml(parts: int, measures: int, pickup: bool = False) -> str:
+    measure_tags = ['<measure number="0" implicit="yes"><note/></measure>'] if pickup else []
+    measure_tags += [f'<measure number="{n}"><note/></measure>' for n in range(1, measures + 1)]
+
+    def part(index: int) -> str:
+        return f'<part id="P{index}">' + "".join(measure_tags) + "</part>"
+
+    score_parts = "".join(f'<score-part id="P{i}"/>' for i in range(1, parts + 1))
+    return (f"<score-partwise><part-list>{score_parts}</part-list>"
+            + "".join(part(i) for i in range(1, parts + 1)) + "</score-partwise>")
+
+
+def write_chunk(path, *movements: str):
+    # Audiveris' layout: an opus pointing at one file per movement
+    names = [f"movement{i}.xml" for i in range(1, len(movements) + 1)]
+    opus = '<opus xmlns:xlink="http://www.w3.org/1999/xlink">' + "".join(
+        f'<score xlink:href="{name}"/>' for name in names
+    ) + "</opus>"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", MXL_MIMETYPE)
+        archive.writestr("META-INF/container.xml", CONTAINER_XML.format(name="opus.opus.xml"))
+        archive.writestr("opus.opus.xml", opus)
+        for name, movement in zip(names, movements):
+            archive.writestr(name, movement)
+    return path
+
+
+def measures(score: ET.Element) -> list:
+    return [[(m.get("number"), m.get("implicit")) for m in part.findall("measure")] for part in score.findall("part")]
+
+
+def test_measures_run_on_across_chunks(tmp_path):
+    chunks = [
+        write_chunk(tmp_path / "1.mxl", score_xml(2, 2, pickup=True)),
+        # a chunk starting mid-piece can look like it opens with a pickup
+        write_chunk(tmp_path / "2.mxl", score_xml(2, 2, pickup=True), score_xml(2, 1)),
+    ]
+    merged = merge_mxl_files(chunks, tmp_path / "merged.mxl")
+
+    [score] = read_movements(merged)
+    expected = [("0", "yes"), ("1", None), ("2", None), ("3", "yes"), ("4", None), ("5", None), ("6", None)]
+    assert measures(score) == [expected, expected]
+    assert len(score.find("part-list")) == 2
+
+
+def test_part_count_change_is_a_merge_error(tmp_path):
+    chunks = [write_chunk(tmp_path / "1.mxl", score_xml(2, 2)), write_chunk(tmp_path / "2.mxl", score_xml(1, 2))]
+    with pytest.raises(MergeError, match="Part count"):
+        merge_mxl_files(chunks, tmp_path / "merged.mxl")
+
+
+@pytest.mark.parametrize("content", [b"not a zip", None])
+def test_unreadable_chunk_is_a_merge_error(tmp_path, content):
+    good = write_chunk(tmp_path / "1.mxl", score_xml(1, 2))
+    bad = tmp_path / "2.mxl"
+    if content is None:
+        # cut off before the movement it points at
+        with zipfile.ZipFile(bad, "w") as archive:
+            archive.writestr("META-INF/container.xml", CONTAINER_XML.format(name="opus.opus.xml"))
+            archive.writestr("opus.opus.xml", '<opus xmlns:xlink="http://www.w3.org/1999/xlink">'
+                                              '<score xlink:href="movement1.xml"/></opus>')
+    else:
+        bad.write_bytes(content)
+    with pytest.raises(MergeError, match="Unreadable chunk"):
+        merge_mxl_files([good, bad], tmp_path / "merged.mxl")
+    assert not (tmp_path / "merged.mxl").exists()
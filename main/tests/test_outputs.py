@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app import outputs
+from app.models import Score
+from app.outputs import etag_matches, output_is_current, parse_range, unmodified_since
+from app.storage import LocalStorage
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=990-2000", (990, SIZE - 1)),
+    ("bytes=500-", (500, SIZE - 1)),
+    ("bytes=999-", (999, SIZE - 1)),
+    ("bytes=-100", (900, SIZE - 1)),
+    ("bytes=-5000", (0, SIZE - 1)),
+    ("bytes=-0", None),
+    # malformed or more than we serve: the whole file
+    ("bytes=50-10", None),
+    ("bytes=0-10,20-30", None),
+    ("bytes=a-b", None),
+    ("items=0-10", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", SIZE), ("bytes=5000-6000", SIZE), ("bytes=-10", 0)])
+def test_unsatisfiable_range(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+def score(**columns) -> Score:
+    defaults = dict(output_sha256="abc", output_modified=datetime(2026, 10, 1, 12, 0, 0))
+    return Score(**{**defaults, **columns})
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", W/"abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+    ("abc", False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, score()) is matches
+
+
+@pytest.mark.parametrize("header, unmodified", [
+    ("Thu, 01 Oct 2026 12:00:00 GMT", True),
+    ("Fri, 02 Oct 2026 08:00:00 GMT", True),
+    ("Thu, 01 Oct 2026 11:59:59 GMT", False),
+    ("yesterday", False),
+    ("", False),
+    # no zone: can't be compared
+    ("Thu, 01 Oct 2026 12:00:00", False),
+])
+def test_unmodified_since(header, unmodified):
+    assert unmodified_since(header, score()) is unmodified
+    assert unmodified_since(header, score(output_modified=datetime(2026, 10, 1, 12, tzinfo=timezone.utc))) is unmodified
+
+
+def test_output_is_current(tmp_path, monkeypatch):
+    storage = LocalStorage(tmp_path)
+    monkeypatch.setattr(outputs, "get_storage", lambda: storage)
+    (tmp_path / "out.mxl").write_bytes(b"x" * 10)
+
+    assert output_is_current(score(output_path="out.mxl", output_bytes=10))
+    assert not output_is_current(score(output_path="out.mxl", output_bytes=11))
+    assert not output_is_current(score(output_path="gone.mxl", output_bytes=10))
+    assert not output_is_current(score(output_path=None, output_bytes=10))
+    assert not output_is_current(score(output_path="out.mxl", output_bytes=10, output_sha256=None))
@@ -0,0 +1,43 @@
+import fitz
+import numpy as np
+import pytest
+
+from app.pdf_writer import StreamingPdfWriter, pack_bits
+
+
+def binarized(height: int, width: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((height, width)) < 0.3, 0, 255).astype(np.uint8)
+
+
+def decode(page: fitz.Page) -> np.ndarray:
+    pix = fitz.Pixmap(page.parent, page.get_images()[0][0])
+    assert pix.n == 1
+    rows = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return rows[:, :pix.width]
+
+
+def test_pack_bits_pads_rows_with_white():
+    image = np.zeros((2, 11), np.uint8)
+    packed, width, height = pack_bits(image)
+    assert (width, height) == (16, 2)
+    assert packed == bytes([0x00, 0x1F, 0x00, 0x1F])
+
+
+def test_pages_decode_to_the_pixels_written(tmp_path):
+    # widths that aren't a multiple of 8 leave padding bits at every row's end
+    bilevel = binarized(301, 1001)
+    gray = np.arange(300 * 203, dtype=np.uint32).reshape(300, 203).astype(np.uint8)
+    path = tmp_path / "pages.pdf"
+    with StreamingPdfWriter(path) as writer:
+        writer.add_page(bilevel, 595.28, 841.89)
+        writer.add_page(gray, 300.5, 200.25)
+    assert writer.bilevel_pages == 1
+
+    with fitz.open(str(path)) as doc:
+        assert doc.page_count == 2
+        for page, image, size in zip(doc, (bilevel, gray), ((595.28, 841.89), (300.5, 200.25))):
+            assert (page.mediabox.width, page.mediabox.height) == pytest.approx(size, abs=0.01)
+            decoded = decode(page)
+            assert decoded.shape == image.shape
+            assert np.array_equal(decoded, image)
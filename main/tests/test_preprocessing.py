@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+import pytest
+
+from app import preprocessing
+from app.config import DESKEW_MIN_ANGLE, DESKEW_MIN_CONFIDENCE
+from app.interline import measure_staff_scale
+from app.pdf_writer import is_bilevel
+from app.preprocessing import _get_page_pool, _get_strip_pool, clean_image, deskew, estimate_skew, map_strips, should_rotate
+from benchmarks.synthetic import A4_PIXELS, degrade, draw_score
+
+# degradations of a 300 dpi page a scanner or a phone could plausibly give
+SCANS = {
+    "faded, unevenly lit": dict(skew=3.0, contrast=0.5, lighting=40, blur=1.0, noise=8),
+    "noisy": dict(skew=-2.0, noise=12),
+    "barely tilted": dict(skew=0.4, noise=5),
+}
+
+
+@pytest.fixture(scope="module")
+def page() -> np.ndarray:
+    return draw_score(*A4_PIXELS, seed=1)
+
+
+@pytest.mark.parametrize("angle", [-8.0, -3.0, -1.5, 0.7, 5.0])
+def test_estimates_the_applied_skew(page, angle):
+    skew = estimate_skew(degrade(page, skew=angle))
+    assert skew.angle == pytest.approx(angle, abs=0.1)
+    assert skew.confidence >= DESKEW_MIN_CONFIDENCE
+
+
+def test_straight_page_is_not_rotated(page):
+    assert deskew(page) is page
+
+
+def test_no_confidence_without_staves():
+    rng = np.random.default_rng(0)
+    speckle = np.where(rng.random((1000, 800)) < 0.02, 0, 255).astype(np.uint8)
+    assert not should_rotate(estimate_skew(speckle))
+    assert estimate_skew(np.full((1000, 800), 255, np.uint8)).confidence == 0
+
+
+@pytest.mark.parametrize("degradation", SCANS.values(), ids=SCANS.keys())
+def test_cleaned_scan(page, degradation):
+    truth = measure_staff_scale(page)
+    cleaned = clean_image(degrade(page, **degradation))
+
+    assert cleaned.shape == page.shape
+    # black and white, so the PDF writer keeps it at 1 bit per pixel
+    assert is_bilevel(cleaned)
+    assert abs(estimate_skew(cleaned).angle) < DESKEW_MIN_ANGLE
+    # the staves Audiveris goes by survive: same spacing, and about as much
+    # ink as the clean page (noise and thick strokes add some)
+    staves = measure_staff_scale(cleaned)
+    assert staves is not None and staves.interline == pytest.approx(truth.interline, abs=0.5)
+    assert 0.9 < np.mean(cleaned == 0) / np.mean(page == 0) < 1.6
+
+
+def test_strips_run_on_as_many_threads_as_asked(page):
+    blur = lambda image: cv2.GaussianBlur(image, (9, 9), 0)
+    expected = blur(page)
+    for workers in (2, 4):
+        assert np.array_equal(map_strips(page, blur, 4, workers), expected)
+        assert _get_strip_pool(workers)._max_workers == workers
+
+
+def test_page_pool_follows_the_worker_count(monkeypatch):
+    monkeypatch.setattr(preprocessing, "_page_pool", None)
+    for workers in (2, 3, 3):
+        pool = _get_page_pool(workers)
+        assert pool._max_workers == workers
+    assert _get_page_pool(3) is pool
+    pool.shutdown()
@@ -0,0 +1,114 @@
+import hashlib
+import os
+
+import pytest
+
+from app import storage
+from app.storage import READ_CHUNK_SIZE, LocalStorage, S3Storage, Storage, make_key
+
+# spans a few read chunks and ends part way into one
+DATA = os.urandom(2 * READ_CHUNK_SIZE + 17)
+SIZE = len(DATA)
+
+
+@pytest.fixture
+def local_storage(tmp_path):
+    return LocalStorage(tmp_path / "storage")
+
+
+@pytest.fixture
+def s3_storage(tmp_path, monkeypatch):
+    pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    for name, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")]:
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(storage, "WORK_DIR", tmp_path / "work")
+    with moto.mock_aws():
+        s3 = S3Storage("artifacts", "scores/", region="us-east-1")
+        s3.client.create_bucket(Bucket="artifacts")
+        yield s3
+
+
+@pytest.fixture(params=["local", "s3"])
+def store(request) -> Storage:
+    return request.getfixturevalue(f"{request.param}_storage")
+
+
+@pytest.fixture
+def upload(tmp_path):
+    def write(name: str = "score.PDF", data: bytes = DATA):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return path
+    return write
+
+
+def test_put_file_stores_by_hash_once(store, upload, monkeypatch):
+    first = upload()
+    key = store.put_file(first, "originals")
+    assert key == make_key("originals", hashlib.sha256(DATA).hexdigest(), ".pdf")
+    assert not first.exists()
+
+    def put_again(path, key):
+        raise AssertionError(f"{key} stored twice")
+
+    monkeypatch.setattr(store, "_put", put_again)
+    again = upload("again.pdf")
+    assert store.put_file(again, "originals") == key
+    assert not again.exists()
+
+
+def test_exists_and_size(store, upload):
+    key = store.put_file(upload(), "originals")
+    assert store.exists(key)
+    assert store.size(key) == SIZE
+    missing = make_key("originals", "0" * 64, ".pdf")
+    assert not store.exists(missing)
+    with pytest.raises(FileNotFoundError):
+        store.size(missing)
+
+
+def test_local_copy(store, upload, tmp_path):
+    key = store.put_file(upload(), "originals")
+    with store.local_copy(key) as path:
+        assert path.read_bytes() == DATA
+    # downloads are removed afterwards, stored files stay where they are
+    assert store.exists(key)
+    assert path.exists() == (store.local_path(key) is not None)
+    assert not any((tmp_path / "work").glob("**/*.pdf"))
+    with pytest.raises(FileNotFoundError):
+        with store.local_copy(make_key("originals", "0" * 64, ".pdf")):
+            pass
+
+
+@pytest.mark.parametrize("start, end", [
+    (0, None),
+    (100, None),
+    (0, 0),
+    (SIZE - 1, SIZE - 1),
+    (SIZE - 10, None),
+    (READ_CHUNK_SIZE - 2, READ_CHUNK_SIZE + 1),
+    (READ_CHUNK_SIZE, 2 * READ_CHUNK_SIZE - 1),
+])
+def test_iter_bytes_ranges(store, upload, start, end):
+    key = store.put_file(upload(), "originals")
+    assert b"".join(store.iter_bytes(key, start, end)) == DATA[start:None if end is None else end + 1]
+
+
+def test_backend_missing_a_primitive_cant_be_built():
+    class NoRanges(Storage):
+        def _put(self, path, key):
+            pass
+
+        def exists(self, key):
+            return False
+
+        def size(self, key):
+            return 0
+
+        def local_copy(self, key):
+            pass
+
+    with pytest.raises(TypeError):
+        NoRanges()